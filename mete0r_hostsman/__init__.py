@@ -17,15 +17,61 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from __future__ import with_statement
+from bisect import bisect_left
+from bisect import bisect_right
 from contextlib import contextmanager
+from itertools import chain
 import re
+import time
+
+try:
+    from thread import allocate_lock
+except ImportError:
+    from _thread import allocate_lock
 
 
 __version__ = '0.0.0'
 
 
+try:
+    basestring = basestring
+except NameError:
+    basestring = (str, bytes)
+
+
+def literal(text, like):
+    ''' An ASCII str literal, as bytes or text like `like`.
+
+    Lines may be bytes, as read from a file opened in binary mode, or text.
+    '''
+    if isinstance(text, type(like)):
+        return text
+    if isinstance(like, bytes):
+        return text.encode('ascii')
+    return text.decode('ascii')
+
+
+def as_text(value, encoding='utf-8'):
+    ''' Decode bytes of Python 3 to str; anything else is returned as it is.
+    '''
+    if bytes is not str and isinstance(value, bytes):
+        return value.decode(encoding, 'replace')
+    return value
+
+
+def decode_hosts(hosts, encoding='utf-8'):
+    ''' (name, address) pairs of bytes lines, decoded to str.
+    '''
+    for hostname, hostaddr in hosts:
+        yield as_text(hostname, encoding), as_text(hostaddr, encoding)
+
+
 ADDR_SEP = re.compile('[ \t]+')
 NAME_SEP = re.compile('[ \t\r\n]')
+_BYTES_SEPARATORS = (re.compile(b'[ \t]+'), re.compile(b'[ \t\r\n]'))
+
+MANAGED_BEGIN = '# BEGIN managed by mete0r.hostsman'
+MANAGED_END = '# END managed by mete0r.hostsman'
 
 
 def list_hosts(parsed_lines):
@@ -39,7 +85,16 @@ def list_hosts(parsed_lines):
 def get_hosts(parsed_lines, hosts):
     if isinstance(hosts, basestring):
         hosts = (hosts, )
-    return get_hosts_by_predicate(parsed_lines, predicate_hostname(hosts))
+    hosts = set(name_key(hostname) for hostname in hosts)
+    for line in parsed_lines:
+        if line['type'] != 'HOSTADDR':
+            continue
+        keys = line_keys(line)
+        if not hosts.isdisjoint(keys):
+            hostaddr = line['addr']
+            for hostname, key in zip(line['names'], keys):
+                if key in hosts:
+                    yield hostname, hostaddr
 
 
 def get_hosts_by_predicate(parsed_lines, predicate):
@@ -49,63 +104,713 @@ def get_hosts_by_predicate(parsed_lines, predicate):
 
 
 def predicate_hostname(hosts):
-    hosts = set(hostname.upper() for hostname in hosts)
-    return lambda hostname, hostaddr: hostname.upper() in hosts
+    hosts = set(name_key(hostname) for hostname in hosts)
+    return lambda hostname, hostaddr: name_key(hostname) in hosts
 
 
 def predicate_hostaddr(addrs):
-    addrs = set(addr.strip() for addr in addrs)
-    return lambda hostname, hostaddr: hostaddr.strip() in addrs
+    addrs = set(addr_match_key(addr) for addr in addrs)
+    return lambda hostname, hostaddr: addr_match_key(hostaddr) in addrs
+
+
+def predicate_glob(patterns):
+    if isinstance(patterns, basestring):
+        patterns = (patterns, )
+    from fnmatch import fnmatchcase
+    patterns = tuple(pattern.lower() for pattern in patterns)
+    return lambda hostname, hostaddr: any(fnmatchcase(name_key(hostname), p)
+                                          for p in patterns)
+
+
+def predicate_regex(pattern):
+    search = re.compile(pattern, re.IGNORECASE).search
+    return lambda hostname, hostaddr: search(hostname) is not None
+
+
+def reversed_name(hostname):
+    ''' Reverse labels of a name key: 'a.Example.tld' -> 'tld.example.a'
+    '''
+    dot = literal('.', hostname)
+    return dot.join(reversed(name_key(hostname).split(dot)))
+
+
+class NameIndex:
+    ''' (name, address) pairs sorted by their reversed labels.
+
+    Names under a domain make a contiguous range of the index, so suffix
+    queries are answered with binary searches and range scans.
+    '''
+
+    def __init__(self, hosts):
+        entries = sorted((reversed_name(hostname), hostname, hostaddr)
+                         for hostname, hostaddr in hosts)
+        self.keys = [key for key, hostname, hostaddr in entries]
+        self.hosts = [(hostname, hostaddr)
+                      for key, hostname, hostaddr in entries]
+
+    def range(self, lo, hi):
+        return self.hosts[bisect_left(self.keys, lo):
+                          bisect_left(self.keys, hi)]
+
+    def suffix(self, domain, include_domain=True):
+        ''' Names under the domain and, optionally, the domain itself.
+        '''
+        key = reversed_name(domain.strip(literal('.', domain)))
+        if include_domain:
+            for host in self.hosts[bisect_left(self.keys, key):
+                                   bisect_right(self.keys, key)]:
+                yield host
+        # the keys under the domain are in [key + '.', key + '/')
+        for host in self.range(key + literal('.', key),
+                               key + literal('/', key)):
+            yield host
+
+
+GLOB_CHARS = '*?['
+
+
+def glob_suffix(pattern):
+    ''' Return the domain of a '*.<domain>' pattern without other wildcards.
+    '''
+    if not pattern.startswith('*.'):
+        return None
+    domain = pattern[len('*.'):]
+    if [c for c in GLOB_CHARS if c in domain]:
+        return None
+    return domain
+
+
+def addr_key(hostaddr):
+    ''' Packed binary key of an IPv4 or IPv6 address.
+
+    Equivalent forms of an address, e.g. '::1' and '0:0:0:0:0:0:0:1', have
+    the same key. Keys are prefixed with the address family, so IPv4 keys
+    sort before IPv6 keys; an IPv6 zone ('%eth0') is appended as it is.
+    Returns None if `hostaddr` is not an address.
+
+    line_addr_key() keeps the key of an address line as its 'addr_key'.
+    '''
+    import socket
+    hostaddr = as_text(hostaddr, 'ascii')
+    hostaddr, percent, zone = hostaddr.strip().partition('%')
+    try:
+        packed = socket.inet_pton(socket.AF_INET, hostaddr)
+    except (socket.error, ValueError):
+        pass
+    else:
+        if not percent:
+            return b'\x04' + packed
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, hostaddr)
+    except (socket.error, ValueError):
+        return None
+    if percent:
+        try:
+            zone = zone.encode('ascii')
+        except UnicodeError:
+            return None
+        if not zone:
+            return None
+        return b'\x06' + packed + b'%' + zone
+    return b'\x06' + packed
+
+
+def addr_match_key(hostaddr):
+    ''' Key to compare addresses with: addr_key() or the stripped text.
+    '''
+    key = addr_key(hostaddr)
+    if key is None:
+        return hostaddr.strip()
+    return key
+
+
+def line_addr_key(line):
+    ''' addr_key() of a HOSTADDR line, computed on first use and kept on
+    the line as its 'addr_key'.
+    '''
+    try:
+        return line['addr_key']
+    except KeyError:
+        key = line['addr_key'] = addr_key(line['addr'])
+        return key
+
+
+def line_match_key(line):
+    ''' addr_match_key() of a HOSTADDR line.
+    '''
+    key = line_addr_key(line)
+    if key is None:
+        return line['addr'].strip()
+    return key
+
+
+def network_range(network):
+    ''' (lowest, highest) address keys of an '<address>/<prefixlen>' network.
+    '''
+    from binascii import hexlify
+    from binascii import unhexlify
+    hostaddr, _, prefixlen = network.partition(literal('/', network))
+    key = addr_key(hostaddr)
+    if key is None:
+        raise ValueError('invalid network: %s' % network)
+    family, packed, zone = key[:1], key[1:], None
+    if family == b'\x06':
+        packed, zone = packed[:16], packed[16:]
+    if zone:
+        raise ValueError('invalid network: %s' % network)
+    bits = len(packed) * 8
+    if not prefixlen:
+        prefixlen = bits
+    elif prefixlen.isdigit():
+        prefixlen = int(prefixlen)
+    else:
+        raise ValueError('invalid network: %s' % network)
+    if not 0 <= prefixlen <= bits:
+        raise ValueError('invalid network: %s' % network)
+    hostmask = (1 << (bits - prefixlen)) - 1
+    lowest = int(hexlify(packed), 16) & ~hostmask
+    highest = lowest | hostmask
+    return tuple(family + unhexlify('%0*x' % (bits // 4, n))
+                 for n in (lowest, highest))
+
+
+def addr_ranges(addrs=(), networks=()):
+    ''' (lowest, highest) address key ranges of addresses and networks.
+
+    Raises ValueError on an invalid address or network.
+    '''
+    if isinstance(addrs, basestring):
+        addrs = (addrs, )
+    if isinstance(networks, basestring):
+        networks = (networks, )
+    ranges = []
+    for hostaddr in addrs:
+        key = addr_key(hostaddr)
+        if key is None:
+            raise ValueError('invalid address: %s' % hostaddr)
+        ranges.append((key, key))
+    for network in networks:
+        lowest, highest = network_range(network)
+        # zoned keys have the zone appended after the packed address
+        ranges.append((lowest, highest + b'\xff'))
+    return ranges
+
+
+class AddressIndex:
+    ''' Positions of HOSTADDR lines sorted by their address keys.
+
+    Lines of an address or of a network make a contiguous range of the
+    index, found with binary searches.
+    '''
+
+    def __init__(self, parsed_lines):
+        entries = []
+        for position, line in enumerate(parsed_lines):
+            if line['type'] == 'HOSTADDR':
+                key = line_addr_key(line)
+                if key is not None:
+                    entries.append((key, position))
+        entries.sort()
+        self.keys = [key for key, position in entries]
+        self.positions = [position for key, position in entries]
+
+    def between(self, lowest, highest):
+        return self.positions[bisect_left(self.keys, lowest):
+                              bisect_right(self.keys, highest)]
+
+    def find(self, addrs=(), networks=()):
+        ''' Positions of lines of the addresses or in the networks.
+        '''
+        positions = set()
+        for lowest, highest in addr_ranges(addrs, networks):
+            positions.update(self.between(lowest, highest))
+        return sorted(positions)
+
+
+BLOOM_ERROR_RATE = 0.01
+
+
+class BloomFilter(object):
+    ''' A Bloom filter of name keys, to reject absent names quickly.
+
+    Names added are always found; an absent name is found with a
+    probability of about `error_rate`, given at most `capacity` names.
+    '''
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE, bits=None,
+                 hashes=None, data=None):
+        import math
+        capacity = max(capacity, 1)
+        if bits is None:
+            bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                 math.log(2) ** 2))
+        if hashes is None:
+            hashes = max(1, int(round(float(bits) / capacity * math.log(2))))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8) if data is None else data
+
+    @property
+    def memory(self):
+        ''' Bytes used by the bits of the filter.
+        '''
+        return len(self.data)
+
+    def positions(self, hostname):
+        from hashlib import md5
+        from struct import unpack_from
+        key = name_key(hostname)
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        # double hashing: h1 + i * h2 for the i-th hash
+        h1, h2 = unpack_from('<LL', md5(key).digest())
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def add(self, hostname):
+        self.update((hostname, ))
+
+    def update(self, hostnames):
+        from hashlib import md5
+        from struct import Struct
+        unpack_from = Struct('<LL').unpack_from
+        data = self.data
+        bits = self.bits
+        hashes = range(self.hashes)
+        for hostname in hostnames:
+            key = name_key(hostname)
+            if not isinstance(key, bytes):
+                key = key.encode('utf-8')
+            h1, h2 = unpack_from(md5(key).digest())
+            for i in hashes:
+                position = (h1 + i * h2) % bits
+                data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, hostname):
+        data = self.data
+        for position in self.positions(hostname):
+            if not data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def copy(self):
+        return BloomFilter(self.capacity, self.error_rate, self.bits,
+                           self.hashes, bytearray(self.data))
+
+
+def build_bloom(parsed_lines, error_rate=BLOOM_ERROR_RATE):
+    ''' A Bloom filter of the names of parsed lines.
+    '''
+    names = [hostname for hostname, hostaddr in list_hosts(parsed_lines)]
+    bloom = BloomFilter(len(names), error_rate)
+    bloom.update(names)
+    return bloom
 
 
 def put_hosts(parsed_lines, hosts):
+    return OpPlan(put=hosts).apply(parsed_lines)
 
-    new_hostnames = set(hosts)
 
-    for line in parsed_lines:
-        if line['type'] == 'HOSTADDR':
-            for hostname, hostaddr in hosts.items():
-                if hostaddr == line['addr'] and hostname in new_hostnames:
-                    line = line_append_hostname_if_missing(line, hostname)
-                    new_hostnames.remove(hostname)
-                else:
-                    line = line_delete_hostname(line, hostname)
-            if len(line['names']) == 0:
+class OpPlan(object):
+    ''' A batch of puts and deletes, compiled once to apply to many files.
+
+    Applying it is equivalent to ``put_hosts(delete_hosts(lines, delete),
+    put)``, in a single pass: name keys, the puts of each address and the
+    lines of new addresses are prepared when the plan is made. Without
+    names to delete, it is ``put_hosts(lines, put)``: an address line
+    without names then gets the names put to its address.
+    '''
+
+    def __init__(self, put=None, delete=()):
+        if isinstance(delete, basestring):
+            delete = (delete, )
+        put = put or {}
+        self.put = put
+        self.delete = tuple(delete)
+        self.delete_keys = frozenset(name_key(hostname) for hostname in delete)
+        self.put_keys = frozenset(name_key(hostname) for hostname in put)
+        self.removed_keys = self.delete_keys | self.put_keys
+        self.puts_by_addr = {}
+        for hostname, hostaddr in put.items():
+            puts = self.puts_by_addr.setdefault(addr_match_key(hostaddr), [])
+            puts.append((hostname, name_key(hostname)))
+        self.new_lines = tuple(new_hostaddr_lines(put.items()))
+
+    def __call__(self, parsed_lines):
+        return self.apply(parsed_lines)
+
+    def apply(self, parsed_lines):
+        delete_keys = self.delete_keys
+        put_keys = self.put_keys
+        removed_keys = self.removed_keys
+        puts_by_addr = self.puts_by_addr
+        placed = set()
+
+        for line in parsed_lines:
+            if line['type'] != 'HOSTADDR':
+                yield line
+                continue
+            names = line['names']
+            keys = line_keys(line)
+            puts = puts_by_addr.get(line_match_key(line))
+            if puts is None and names and removed_keys.isdisjoint(keys):
+                yield line
+                continue
+
+            kept = [(name, key) for name, key in zip(names, keys)
+                    if key not in delete_keys]
+            if not kept and (puts is None or delete_keys):
                 # skip address without any names
                 continue
-        yield line
 
-    # add new hosts: grouped by address
+            # puts of this address go to its first line
+            appended = []
+            for hostname, key in puts or ():
+                if hostname not in placed:
+                    placed.add(hostname)
+                    appended.append((hostname, key))
+            here_keys = set(key for hostname, key in appended)
+            new_names = [(name, key) for name, key in kept
+                         if key not in put_keys or key in here_keys]
+            present = set(key for name, key in new_names)
+            for hostname, key in appended:
+                if key not in present:
+                    present.add(key)
+                    new_names.append((hostname, key))
+
+            if not new_names:
+                # skip address without any names
+                continue
+            new_names, new_keys = names_and_keys(new_names)
+            if new_names != names:
+                line = line_with_names(line, new_names, new_keys)
+            yield line
+
+        # add new hosts: grouped by address
+        for line in self.new_lines:
+            kept = [(name, key) for name, key in zip(line['names'],
+                                                     line['keys'])
+                    if name not in placed]
+            if kept:
+                yield line_with_names(line, *names_and_keys(kept))
+
+
+def apply_plan(parsed_lines, plan):
+    return plan.apply(parsed_lines)
+
+
+def put_hosts_unmerged(parsed_lines, hosts):
+    ''' Put names on new lines, even if their addresses have lines.
+    '''
+    return chain(delete_hosts(parsed_lines, list(hosts)),
+                 new_hostaddr_lines(hosts.items()))
+
+
+def can_append(snapshot, hosts, merge=True):
+    ''' Whether putting hosts only appends new lines to the snapshot.
+
+    That is if no line has any of the names and, if merging, any of their
+    addresses. Names rejected by the Bloom filter are not looked for. Nor
+    may there be an address line without names: a put drops those.
+    '''
+    bloom = snapshot.bloom
+    keys = set(name_key(hostname) for hostname in hosts
+               if bloom is None or hostname in bloom)
+    addrs = set()
+    if merge:
+        addrs = set(addr_match_key(hostaddr) for hostaddr in hosts.values())
+    for line in snapshot.all_lines():
+        if line['type'] == 'HOSTADDR':
+            if not line['names']:
+                # to be dropped, as by any put
+                return False
+            if addrs and line_match_key(line) in addrs:
+                return False
+            if keys and not keys.isdisjoint(line_keys(line)):
+                return False
+    return True
+
+
+def appended_lines(old, new):
+    ''' Lines of snapshot `new` after those of `old`, if it only has lines
+    appended to them; None if other lines have changed.
+    '''
+    same = 0
+    for old_chunk, new_chunk in zip(old.chunks, new.chunks):
+        if old_chunk is not new_chunk:
+            break
+        same += 1
+    old_lines = list(chain.from_iterable(old.chunks[same:]))
+    new_lines = list(chain.from_iterable(new.chunks[same:]))
+    if len(new_lines) < len(old_lines):
+        return None
+    for old_line, new_line in zip(old_lines, new_lines):
+        if old_line is not new_line:
+            return None
+    return new_lines[len(old_lines):]
+
 
+def new_hostaddr_lines(hosts):
+    ''' New lines of (hostname, hostaddr) pairs, grouped by address.
+
+    Equivalent forms of an address go to the same line, which is written
+    with the first form seen. Lines are ordered by address text.
+    '''
     new_addrs = {}
-    for hostname in new_hostnames:
-        hostaddr = hosts[hostname]
-        new_addrs.setdefault(hostaddr, []).append(hostname)
-    for hostaddr in sorted(new_addrs):
-        names = new_addrs[hostaddr]
+    for hostname, hostaddr in hosts:
+        key = addr_match_key(hostaddr)
+        if key not in new_addrs:
+            new_addrs[key] = (hostaddr, [])
+        new_addrs[key][1].append(hostname)
+    for hostaddr, names in sorted(new_addrs.values()):
         yield {
             'type': 'HOSTADDR',
             'addr': hostaddr,
+            'addr_key': addr_key(hostaddr),
             'names': tuple(names),
+            'keys': tuple(name_key(hostname) for hostname in names),
         }
 
 
 def delete_hosts(parsed_lines, hosts):
     if isinstance(hosts, basestring):
         hosts = (hosts, )
+    hosts = set(name_key(hostname) for hostname in hosts)
     for line in parsed_lines:
         if line['type'] == 'HOSTADDR':
-            for hostname in hosts:
-                line = line_delete_hostname(line, hostname)
+            line = line_without_keys(line, hosts)
             if len(line['names']) == 0:
                 # skip address without any names
                 continue
         yield line
 
 
+def delete_lines(parsed_lines, positions):
+    ''' Drop lines at the given 0-based positions.
+    '''
+    positions = set(positions)
+    for position, line in enumerate(parsed_lines):
+        if position not in positions:
+            yield line
+
+
+def delete_hosts_by_addr(parsed_lines, addrs=(), networks=()):
+    ''' Drop lines of the given addresses or of addresses in the networks.
+    '''
+    parsed_lines = tuple(parsed_lines)
+    positions = AddressIndex(parsed_lines).find(addrs, networks)
+    return delete_lines(parsed_lines, positions)
+
+
+def sync_hosts(parsed_lines, hosts, counts=None):
+    ''' Make the hosts equal to a desired {hostname: hostaddr} dict.
+
+    In a single pass, names not in `hosts` are deleted, names with a wrong
+    address are moved and missing names are added. Lines already matching
+    the desired state are yielded untouched.
+
+    If `counts` dict is given, it is updated with the number of names
+    'added', 'updated', 'deleted' and 'unchanged'.
+    '''
+    if counts is None:
+        counts = {}
+    for kind in ('added', 'updated', 'deleted', 'unchanged'):
+        counts.setdefault(kind, 0)
+
+    wanted = dict((name_key(hostname), hostname) for hostname in hosts)
+    host_keys = dict((hostname, addr_match_key(hostaddr))
+                     for hostname, hostaddr in hosts.items())
+    placed = set()
+    misplaced = {}
+
+    for line in parsed_lines:
+        if line['type'] == 'HOSTADDR':
+            line_key = line_match_key(line)
+            names = []
+            for name, key in zip(line['names'], line_keys(line)):
+                hostname = wanted.get(key)
+                if hostname is None or key in placed:
+                    counts['deleted'] += 1
+                elif host_keys[hostname] == line_key:
+                    placed.add(key)
+                    names.append((name, key))
+                    counts['unchanged'] += 1
+                else:
+                    misplaced[key] = misplaced.get(key, 0) + 1
+            if len(names) != len(line['names']):
+                if len(names) == 0:
+                    # skip address without any names
+                    continue
+                line = line_with_names(line, *names_and_keys(names))
+        yield line
+
+    # add missing and misplaced hosts: grouped by address
+
+    new_hosts = []
+    for key, hostname in wanted.items():
+        occurrences = misplaced.get(key, 0)
+        if key in placed:
+            counts['deleted'] += occurrences
+            continue
+        if occurrences:
+            counts['updated'] += 1
+            counts['deleted'] += occurrences - 1
+        else:
+            counts['added'] += 1
+        new_hosts.append((hostname, hosts[hostname]))
+    for line in new_hostaddr_lines(new_hosts):
+        yield line
+
+
+MAX_LINE_LENGTH = 1024
+
+
+def check_hosts(parsed_lines, max_line_length=MAX_LINE_LENGTH):
+    ''' Find problems in parsed lines, in a single pass as they come.
+
+    Yields a dict for each problem with its 'line_no', the kind of
+    'problem', a 'detail' message and fields of its kind:
+
+    - ``unrecognized``: a line that is neither a comment nor an address
+      line, other than a blank one;
+    - ``too-long``: a line longer than `max_line_length` characters
+      ('length');
+    - ``duplicate-line``: the same address and names as an earlier line
+      ('first_line_no');
+    - ``multiple-addresses``: a name already given another address
+      ('name', 'addr', 'first_addr', 'first_line_no').
+
+    Only the keys of the lines and names seen so far are kept.
+    '''
+    seen_lines = {}
+    seen_names = {}
+    for line in parsed_lines:
+        line_no = line.get('line_no')
+        text = as_text(line.get('line', '')).rstrip('\r\n')
+        if max_line_length and len(text) > max_line_length:
+            yield {
+                'line_no': line_no,
+                'problem': 'too-long',
+                'detail': '%d characters' % len(text),
+                'length': len(text),
+            }
+        if line['type'] == 'UNRECOGNIZED':
+            if text.strip():
+                yield {
+                    'line_no': line_no,
+                    'problem': 'unrecognized',
+                    'detail': text.strip(),
+                }
+            continue
+        if line['type'] != 'HOSTADDR':
+            continue
+
+        addr = line_match_key(line)
+        keys = line_keys(line)
+        line_key = (addr, frozenset(keys))
+        first_line_no = seen_lines.setdefault(line_key, line_no)
+        if first_line_no != line_no:
+            yield {
+                'line_no': line_no,
+                'problem': 'duplicate-line',
+                'detail': 'same as line %d' % first_line_no,
+                'first_line_no': first_line_no,
+            }
+            continue
+
+        for name, key in zip(line['names'], keys):
+            first = seen_names.setdefault(key, (addr, line['addr'], line_no))
+            if first[0] != addr:
+                yield {
+                    'line_no': line_no,
+                    'problem': 'multiple-addresses',
+                    'detail': '%s is %s, also %s on line %d' % (
+                        as_text(name), as_text(line['addr']),
+                        as_text(first[1]), first[2]
+                    ),
+                    'name': as_text(name),
+                    'addr': as_text(line['addr']),
+                    'first_addr': as_text(first[1]),
+                    'first_line_no': first[2],
+                }
+
+
+def is_managed_begin(line):
+    if line['type'] != 'COMMENT':
+        return False
+    text = line['line'].strip()
+    return text == literal(MANAGED_BEGIN, text)
+
+
+def is_managed_end(line):
+    if line['type'] != 'COMMENT':
+        return False
+    text = line['line'].strip()
+    return text == literal(MANAGED_END, text)
+
+
+def managed_lines(parsed_lines):
+    ''' Yield lines inside the managed section only.
+    '''
+    lines = iter(parsed_lines)
+    for line in lines:
+        if is_managed_begin(line):
+            break
+    for line in lines:
+        if is_managed_end(line):
+            break
+        yield line
+
+
+def apply_managed(parsed_lines, op, *args):
+    ''' Apply `op(lines, *args)` to lines inside the managed section only.
+
+    Lines outside of the section are passed through as they are. If there
+    is no managed section yet, a new one is appended at the end with
+    whatever `op` yields for the empty section.
+    '''
+    lines = iter(parsed_lines)
+    for line in lines:
+        yield line
+        if is_managed_begin(line):
+            break
+    else:
+        section = list(op((), *args))
+        if len(section) > 0:
+            like = section[0].get('line', section[0].get('addr'))
+            yield {
+                'type': 'COMMENT',
+                'line': literal(MANAGED_BEGIN + '\n', like),
+            }
+            for line in section:
+                yield line
+            yield {
+                'type': 'COMMENT',
+                'line': literal(MANAGED_END + '\n', like),
+            }
+        return
+
+    end = []
+
+    def section():
+        for line in lines:
+            if is_managed_end(line):
+                end.append(line)
+                return
+            yield line
+
+    for line in op(section(), *args):
+        yield line
+    if end:
+        yield end[0]
+        for line in lines:
+            yield line
+
+
 def line_contains_hostname(line, hostname):
-    names = set(name.upper() for name in line['names'])
-    return hostname.upper() in names
+    return name_key(hostname) in line_keys(line)
 
 
 def line_append_hostname_if_missing(line, hostname):
@@ -115,41 +820,132 @@ def line_append_hostname_if_missing(line, hostname):
 
 
 def line_append_hostname(line, hostname):
-    return dict(line, names=line['names'] + (hostname, ))
+    return line_with_names(line, line['names'] + (hostname, ),
+                           line_keys(line) + (name_key(hostname), ))
 
 
 def line_delete_hostname(line, hostname):
-    hostnames = line['names']
-    hostnames = tuple(name for name in hostnames
-                      if name.upper() != hostname.upper())
-    return dict(line, names=hostnames)
+    return line_without_keys(line, (name_key(hostname), ))
+
+
+def line_without_keys(line, keys):
+    ''' A HOSTADDR line without the names of the keys: a copy if it has any.
+    '''
+    old_keys = line_keys(line)
+    if not [key for key in old_keys if key in keys]:
+        return line
+    return line_with_names(line, *names_and_keys(
+        (name, key) for name, key in zip(line['names'], old_keys)
+        if key not in keys
+    ))
+
+
+def line_with_names(line, names, keys=None):
+    ''' Copy of a HOSTADDR line with other names, and their keys if known.
+
+    The copy has no original 'line' text, so it gets rendered anew.
+    '''
+    line = dict(line, names=names)
+    line.pop('line', None)
+    if keys is None:
+        line.pop('keys', None)
+    else:
+        line['keys'] = keys
+    return line
 
 
-def parse(lines):
+def line_keys(line):
+    ''' name_key() of each name of a HOSTADDR line.
+
+    Keys are computed on first use and kept on the line as its 'keys':
+    names are never changed in place, but by line_with_names(). Names that
+    are all lower case, the common case, are their own keys.
+    '''
+    try:
+        return line['keys']
+    except KeyError:
+        pass
+    names = line['names']
+    keys = names
+    if names:
+        keys = tuple(map(type(names[0]).lower, names))
+        if keys == names:
+            keys = names
+    line['keys'] = keys
+    return keys
+
+
+def names_and_keys(pairs):
+    ''' (names, keys) tuples of (name, key) pairs.
+    '''
+    pairs = tuple(pairs)
+    return (tuple(name for name, key in pairs),
+            tuple(key for name, key in pairs))
+
+
+def name_key(hostname):
+    ''' Case-folded key of a name to compare names with.
+
+    The key of an already lower-case name, the common case, is the name
+    itself, so it costs no extra string. line_keys() keeps the keys of the
+    names of an address line as its 'keys'.
+    '''
+    key = hostname.lower()
+    if key == hostname:
+        return hostname
+    return key
+
+
+def parse(lines, share=True):
+    ''' Parse lines of a hosts file, yielding a dict for each.
+
+    With `share`, repeated addresses and names share one string: this
+    saves memory for lines kept, but costs memory for every distinct
+    string seen, until the parse is done. Readers that go through lines
+    once and drop them do not share. Keys of names and addresses are not
+    computed here, but by line_keys() and line_addr_key() when needed.
+    '''
+    addrs = {}
+    names = {}
+    comment = None
     for line_no, line in enumerate(lines):
+        if comment is None:
+            comment = literal('#', line)
         ev = {
             'line': line,
             'line_no': line_no + 1,
         }
-        if line.startswith('#'):
+        if line.startswith(comment):
             ev['type'] = 'COMMENT'
         else:
             try:
                 ev['type'] = 'HOSTADDR'
                 ev.update(parse_hostaddr_line(line))
                 ev['type'] = 'HOSTADDR'
+                if share:
+                    addr = ev['addr']
+                    ev['addr'] = addrs.setdefault(addr, addr)
+                    ev['names'] = tuple(map(names.setdefault, ev['names'],
+                                            ev['names']))
             except Exception as e:
                 ev['type'] = 'UNRECOGNIZED'
                 ev['exception'] = e
         yield ev
 
 
+def separators(binary=False):
+    ''' Return (ADDR_SEP, NAME_SEP) for bytes or text lines.
+    '''
+    if binary:
+        return _BYTES_SEPARATORS
+    return ADDR_SEP, NAME_SEP
+
+
 def parse_hostaddr_line(line):
-    addr, name_trail = ADDR_SEP.split(line, 1)
-    names = NAME_SEP.split(name_trail)
-    names = (name.strip() for name in names)
-    names = (name for name in names if name)
-    names = tuple(names)
+    addr_sep, name_sep = separators(isinstance(line, bytes))
+    addr, name_trail = addr_sep.split(line, 1)
+    names = map(type(name_trail).strip, name_sep.split(name_trail))
+    names = tuple(name for name in names if name)
     return {
         'addr': addr,
         'names': names
@@ -157,32 +953,154 @@ def parse_hostaddr_line(line):
 
 
 def render(parsed_lines):
+    ''' Render lines, reusing the original text of unmodified lines.
+    '''
+    newline = None
+    newline_missing = False
     for line in parsed_lines:
-        if line['type'] == 'HOSTADDR':
-            yield render_hostaddr_line(line)
-        else:
-            yield line['line']
+        text = render_line(line)
+        if newline is None:
+            newline = literal('\n', text)
+        if newline_missing:
+            # e.g. the last line of the original file, followed by new lines
+            yield newline
+        yield text
+        newline_missing = not text.endswith(newline)
+
+
+def render_line(line):
+    text = line.get('line')
+    if text is None:
+        return render_hostaddr_line(line)
+    return text
 
 
 def render_hostaddr_line(line):
-    return '%s\t%s\n' % (line['addr'], ' '.join(line['names']))
+    addr = line['addr']
+    if bytes is not str and isinstance(addr, bytes):
+        return addr + b'\t' + b' '.join(line['names']) + b'\n'
+    return '%s\t%s\n' % (addr, ' '.join(line['names']))
+
+
+class Stats:
+    ''' Per-phase timings (in seconds) and counters.
+    '''
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
 
+    @contextmanager
+    def timing(self, phase):
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            self.timings[phase] = self.timings.get(phase, 0) + elapsed
 
-class HostsManager:
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def as_dict(self):
+        return {
+            'timings': dict(self.timings),
+            'counters': dict(self.counters),
+        }
+
+
+CHUNK_SIZE = 1024
+
+
+def chunk_lines(lines, size=CHUNK_SIZE):
+    lines = tuple(lines)
+    return tuple(lines[i:i + size] for i in range(0, len(lines), size))
+
+
+def rechunk(chunks, lines, size=CHUNK_SIZE):
+    ''' Chunk lines, reusing the given chunks where lines are unchanged.
+    '''
+    lines = list(lines)
+    by_first_line = dict((id(chunk[0]), chunk) for chunk in chunks if chunk)
+    new_chunks = []
+    start = 0  # of the lines not chunked yet
+    position = 0
+    while position < len(lines):
+        chunk = by_first_line.get(id(lines[position]))
+        if chunk is not None and chunk[0] is lines[position]:
+            end = position + len(chunk)
+            if tuple(lines[position:end]) == chunk:
+                new_chunks.extend(chunk_lines(lines[start:position], size))
+                new_chunks.append(chunk)
+                start = position = end
+                continue
+        position += 1
+    new_chunks.extend(chunk_lines(lines[start:], size))
+    return tuple(new_chunks)
 
-    def __init__(self, lines=()):
-        self.parsed = tuple(parse(lines))
+
+class HostsSnapshot(object):
+    ''' An immutable version of the hosts.
+
+    Lines are kept in a tuple of chunks, so that successive versions share
+    the chunks with unchanged lines.
+    '''
+
+    def __init__(self, chunks=(), managed=False, bloom=None):
+        self.chunks = chunks
+        self.managed = managed
+        self.bloom = bloom
+        self._name_index = None
+        self._address_index = None
+
+    def all_lines(self):
+        return chain.from_iterable(self.chunks)
+
+    def lines(self):
+        if self.managed:
+            return managed_lines(self.all_lines())
+        return self.all_lines()
 
     def list(self):
-        return list_hosts(self.parsed)
+        return list_hosts(self.lines())
 
     __iter__ = list
 
     def get(self, hostnames=()):
-        return get_hosts(self.parsed, hostnames)
+        if self.bloom is not None:
+            if isinstance(hostnames, basestring):
+                hostnames = (hostnames, )
+            hostnames = [hostname for hostname in hostnames
+                         if hostname in self.bloom]
+            if not hostnames:
+                return iter(())
+        return get_hosts(self.lines(), hostnames)
 
     def get_by_predicate(self, predicate):
-        return get_hosts_by_predicate(self.parsed, predicate)
+        return get_hosts_by_predicate(self.lines(), predicate)
+
+    def name_index(self):
+        # indexes are built on demand; a race only builds one twice
+        if self._name_index is None:
+            self._name_index = NameIndex(list_hosts(self.lines()))
+        return self._name_index
+
+    def get_by_suffix(self, domain, include_domain=True):
+        return self.name_index().suffix(domain, include_domain)
+
+    def get_by_glob(self, pattern):
+        domain = glob_suffix(pattern)
+        if domain is not None:
+            return self.get_by_suffix(domain, include_domain=False)
+        return self.get_by_predicate(predicate_glob(pattern))
+
+    def get_by_regex(self, pattern):
+        return self.get_by_predicate(predicate_regex(pattern))
+
+    def address_index(self):
+        if self._address_index is None:
+            self._address_index = AddressIndex(self.lines())
+        return self._address_index
 
     def __getitem__(self, key):
         for hostname, hostaddr in self.get(key):
@@ -190,37 +1108,595 @@ class HostsManager:
                 return hostaddr
         raise KeyError(key)
 
-    def put(self, hosts):
-        self.parsed = tuple(put_hosts(self.parsed, hosts))
+    def render(self):
+        return render(self.all_lines())
+
+
+class HostsManager(object):
+    ''' Hosts, updated by publishing new snapshots.
+
+    Readers never block: they read the snapshot current at the time of
+    the call, or keep one with `snapshot()`. Writers are serialized.
+    '''
+
+    def __init__(self, lines=(), managed=False, stats=None, bloom=None):
+        ''' `bloom` is a BloomFilter of the names of the lines, or a false
+        positive rate to build one with, for `get()` to reject absent names.
+        '''
+        self.stats = Stats() if stats is None else stats
+        with self.stats.timing('parse'):
+            parsed = tuple(parse(lines))
+        self.stats.count('lines_parsed', len(parsed))
+        self.stats.count('lines_unrecognized', len([
+            line for line in parsed if line['type'] == 'UNRECOGNIZED'
+        ]))
+        if bloom is not None and not isinstance(bloom, BloomFilter):
+            with self.stats.timing('bloom'):
+                bloom = build_bloom(parsed, bloom)
+        if bloom is not None:
+            self.stats.count('bloom_bytes', bloom.memory)
+        self._lock = allocate_lock()
+        self._snapshot = HostsSnapshot(chunk_lines(parsed), managed, bloom)
+
+    def snapshot(self):
+        return self._snapshot
+
+    def publish(self, lines, managed=None):
+        with self._lock:
+            self._publish(lines, managed)
+
+    def _publish(self, lines, managed=None):
+        snapshot = self._snapshot
+        if managed is None:
+            managed = snapshot.managed
+        self._publish_chunks(rechunk(snapshot.chunks, lines), managed)
+
+    def _publish_chunks(self, chunks, managed):
+        snapshot = self._snapshot
+        bloom = snapshot.bloom
+        if bloom is not None:
+            # names only appear in new chunks: modified lines, or lines
+            # published from outside, which still have their text
+            bloom = bloom.copy()
+            reused = set(map(id, snapshot.chunks))
+            bloom.update(hostname
+                         for chunk in chunks if id(chunk) not in reused
+                         for line in chunk if line['type'] == 'HOSTADDR'
+                         for hostname in line['names'])
+        self._snapshot = HostsSnapshot(chunks, managed, bloom)
+
+    @property
+    def parsed(self):
+        return tuple(self._snapshot.all_lines())
+
+    @parsed.setter
+    def parsed(self, lines):
+        self.publish(lines)
+
+    @property
+    def managed(self):
+        return self._snapshot.managed
+
+    @managed.setter
+    def managed(self, managed):
+        with self._lock:
+            self._publish(self._snapshot.all_lines(), managed)
+
+    def lines(self):
+        return self._snapshot.lines()
+
+    def apply(self, op, *args):
+        with self._lock:
+            self._apply(op, *args)
+
+    def _apply(self, op, *args):
+        snapshot = self._snapshot
+        with self.stats.timing(op.__name__):
+            lines = snapshot.all_lines()
+            if snapshot.managed:
+                lines = apply_managed(lines, op, *args)
+            else:
+                lines = op(lines, *args)
+            self._publish(lines)
+
+    def list(self):
+        return self._snapshot.list()
+
+    __iter__ = list
+
+    def get(self, hostnames=()):
+        return self._snapshot.get(hostnames)
+
+    def get_by_predicate(self, predicate):
+        return self._snapshot.get_by_predicate(predicate)
+
+    def name_index(self):
+        with self.stats.timing('name_index'):
+            return self._snapshot.name_index()
+
+    def get_by_suffix(self, domain, include_domain=True):
+        return self._snapshot.get_by_suffix(domain, include_domain)
+
+    def get_by_glob(self, pattern):
+        return self._snapshot.get_by_glob(pattern)
+
+    def get_by_regex(self, pattern):
+        return self._snapshot.get_by_regex(pattern)
+
+    def address_index(self):
+        with self.stats.timing('address_index'):
+            return self._snapshot.address_index()
+
+    def __getitem__(self, key):
+        return self._snapshot[key]
+
+    def put(self, hosts, merge=True):
+        ''' Put names to their addresses.
+
+        Names are added to an existing line of their address, unless not
+        to `merge`: then they get lines of their own. If none of the names
+        is in the hosts, nor, when merging, any of their addresses, the new
+        lines are appended without going through the other lines.
+        '''
+        with self._lock:
+            if not self._append_if_new(hosts, merge):
+                self._apply(put_hosts if merge else put_hosts_unmerged, hosts)
+
+    def _append_if_new(self, hosts, merge=True):
+        snapshot = self._snapshot
+        if snapshot.managed:
+            return False
+        with self.stats.timing('append_check'):
+            if not can_append(snapshot, hosts, merge):
+                return False
+        with self.stats.timing('append'):
+            lines = tuple(new_hostaddr_lines(hosts.items()))
+            self._publish_chunks(snapshot.chunks + chunk_lines(lines),
+                                 snapshot.managed)
+        self.stats.count('lines_appended', len(lines))
+        return True
 
     def __setitem__(self, hostname, hostaddr):
         self.put({hostname: hostaddr})
 
     def delete(self, hostnames):
-        self.parsed = tuple(delete_hosts(self.parsed, hostnames))
+        self.apply(delete_hosts, hostnames)
+
+    def apply_plan(self, plan):
+        with self._lock:
+            if plan.delete or not self._append_if_new(plan.put):
+                self._apply(apply_plan, plan)
 
     __delitem__ = delete
 
+    def delete_by_addr(self, addrs=(), networks=()):
+        with self._lock:
+            positions = self.address_index().find(addrs, networks)
+            if positions:
+                self._apply(delete_lines, positions)
+            return len(positions)
+
+    def sync(self, hosts):
+        counts = {}
+        self.apply(sync_hosts, hosts, counts)
+        return counts
+
     def render(self):
-        return render(self.parsed)
+        snapshot = self._snapshot
+        self.stats.count('lines_rewritten', len([
+            line for line in snapshot.all_lines() if 'line' not in line
+        ]))
+        return snapshot.render()
+
+
+def load(f, managed=False, stats=None, bloom=None):
+    ''' Load a hosts file object, or a path to open with open_hosts().
+    '''
+    if isinstance(f, basestring):
+        with open_hosts(f) as f:
+            return load(f, managed=managed, stats=stats, bloom=bloom)
+    stats = Stats() if stats is None else stats
+    with stats.timing('read'):
+        lines = list(f)
+    return HostsManager(lines, managed=managed, stats=stats, bloom=bloom)
+
+
+BLOOM_SUFFIX = '.bloom'
+
+
+def stat_signature(path):
+    ''' (size, mtime, inode, device) of a file, to tell if it has changed.
+    '''
+    import os
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime, st.st_ino, st.st_dev]
+
+
+def save_bloom(bloom, path, signature):
+    ''' Keep a Bloom filter of a hosts file in a file alongside it.
+
+    `signature` is the stat_signature() of the hosts file when it was read.
+    '''
+    import json
+    import os
+    header = json.dumps({
+        'capacity': bloom.capacity,
+        'error_rate': bloom.error_rate,
+        'bits': bloom.bits,
+        'hashes': bloom.hashes,
+        'signature': signature,
+    })
+    temp = path + BLOOM_SUFFIX + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(header.encode('ascii') + b'\n')
+        f.write(bytes(bloom.data))
+    os.rename(temp, path + BLOOM_SUFFIX)
+
+
+def load_bloom(path):
+    ''' The Bloom filter kept alongside a hosts file, if it is up to date.
+
+    Returns None if there is none, or if the hosts file has changed since.
+    '''
+    import json
+    try:
+        with open(path + BLOOM_SUFFIX, 'rb') as f:
+            header = json.loads(f.readline().decode('ascii'))
+            if header['signature'] != stat_signature(path):
+                return None
+            data = bytearray(f.read())
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    if len(data) != (header['bits'] + 7) // 8:
+        return None
+    return BloomFilter(header['capacity'], header['error_rate'],
+                       header['bits'], header['hashes'], data)
+
+
+COMPRESSION_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+)
+
+
+def compression(path):
+    ''' 'gzip', 'bz2' or 'xz', detected by the magic bytes of the file.
+
+    Returns None for a file that is not compressed.
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, kind in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return kind
+
+
+def open_hosts(path, binary=False):
+    ''' Open a hosts file to read, decompressing it as it is read.
+
+    Compressed files are detected by compression(). They are decompressed
+    in small blocks while lines are read, never as a whole.
+    '''
+    kind = compression(path)
+    if kind is None:
+        return open(path, 'rb' if binary else 'r')
+    if kind == 'gzip':
+        from gzip import GzipFile
+        f = GzipFile(path, 'rb')
+    elif kind == 'bz2':
+        from bz2 import BZ2File
+        f = BZ2File(path, 'rb')
+    else:
+        try:
+            from lzma import LZMAFile
+        except ImportError:
+            try:
+                from backports.lzma import LZMAFile
+            except ImportError:
+                raise IOError('%s: xz is not supported without lzma' % path)
+        f = LZMAFile(path, 'rb')
+    if binary or bytes is str:
+        return f
+    from io import TextIOWrapper
+    return TextIOWrapper(f)
+
+
+SORT_MEMORY = 64 << 20
+
+# rough bytes of a (name, address) pair held in memory, besides its strings
+SORT_ENTRY_OVERHEAD = 120
+
+SORT_BLOCK = 1024
+
+
+def sort_hosts(hosts, memory=SORT_MEMORY, stats=None):
+    ''' Sort (name, address) pairs, holding about `memory` bytes of them.
+
+    Pairs are sorted in runs that fit the budget. Each full run is spilled
+    to a temporary file; the runs are then merged, read back block by
+    block. Without spills, this is a plain sort.
+    '''
+    import heapq
+    spilled = []
+    try:
+        run = []
+        size = 0
+        for host in hosts:
+            run.append(host)
+            size += SORT_ENTRY_OVERHEAD + len(host[0]) + len(host[1])
+            if size >= memory:
+                run.sort()
+                spilled.append(spill_run(run))
+                run = []
+                size = 0
+        run.sort()
+        if stats is not None:
+            stats.count('sort_runs', len(spilled) + 1)
+        runs = [read_run(f) for f in spilled] + [iter(run)]
+        for host in heapq.merge(*runs):
+            yield host
+    finally:
+        for f in spilled:
+            f.close()
+
+
+def spill_run(run):
+    ''' Write a sorted run to a temporary file, in pickled blocks.
+    '''
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    import tempfile
+    f = tempfile.TemporaryFile()
+    for start in range(0, len(run), SORT_BLOCK):
+        pickle.dump(run[start:start + SORT_BLOCK], f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def read_run(f):
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    while True:
+        try:
+            block = pickle.load(f)
+        except EOFError:
+            return
+        for host in block:
+            yield host
 
 
-def load(f):
-    return HostsManager(f)
+def open_file(path, mode, binary=False):
+    ''' Open a file to edit, as bytes or as text with newlines as they are.
 
+    Python 3 would otherwise read CRLF newlines as LF, and unmodified lines
+    would lose their CR when written back.
+    '''
+    if binary:
+        return open(path, mode[:1] + 'b' + mode[1:])
+    if bytes is str:
+        return open(path, mode)
+    return open(path, mode, newline='')
 
-def dump(hostsman, f):
-    for line in hostsman.render():
-        f.write(line)
+
+DUMP_BUFFER_SIZE = 1 << 16
+
+
+def dump(hostsman, f, buffer_size=DUMP_BUFFER_SIZE):
+    ''' Write rendered lines in chunks of about `buffer_size` characters.
+    '''
+    stats = hostsman.stats
+    with stats.timing('render'):
+        rendered = list(hostsman.render())
+    empty = rendered[0][:0] if rendered else ''
+    with stats.timing('write'):
+        written = 0
+        chunk = []
+        chunk_size = 0
+        for text in rendered:
+            chunk.append(text)
+            chunk_size += len(text)
+            if chunk_size >= buffer_size:
+                f.write(empty.join(chunk))
+                written += chunk_size
+                chunk = []
+                chunk_size = 0
+        if chunk:
+            f.write(empty.join(chunk))
+            written += chunk_size
+    stats.count('bytes_written', written)
 
 
 @contextmanager
-def edit(path='/etc/hosts'):
-    with open(path, 'r+') as f:
-        hostsman = load(f)
+def edit(path='/etc/hosts', managed=False, stats=None,
+         buffer_size=DUMP_BUFFER_SIZE, binary=False, backups=0):
+    ''' Load a hosts file to edit, writing it back when done.
+
+    With `binary`, the file is read and written as bytes without decoding:
+    names and addresses are bytes on Python 3. Compressed files are
+    refused: they cannot be rewritten in place.
+
+    The file is rewritten only if lines have changed; lines added after
+    all others are appended, and nothing is written if nothing changed.
+
+    With `backups`, the file is instead replaced by a new one, and the
+    last `backups` versions are kept as ``<path>.1`` (the previous one) to
+    ``<path>.<backups>``; see replace().
+    '''
+    kind = compression(path)
+    if kind is not None:
+        raise ValueError('%s: cannot edit a %s compressed file' % (path, kind))
+    with open_file(path, 'r+', binary) as f:
+        hostsman = load(f, managed=managed, stats=stats)
+        original = hostsman.snapshot()
 
         yield hostsman
 
-        f.seek(0)
-        dump(hostsman, f)
-        f.truncate()
+        appended = appended_lines(original, hostsman.snapshot())
+        if appended == []:
+            pass
+        elif backups:
+            replace(hostsman, path, backups, buffer_size, binary)
+        elif appended is None:
+            f.seek(0)
+            dump(hostsman, f, buffer_size)
+            f.truncate()
+        else:
+            f.seek(0, 2)
+            append(hostsman, f, appended, original)
+
+
+def append(hostsman, f, lines, original):
+    ''' Write lines appended to the `original` snapshot at the end of f.
+    '''
+    stats = hostsman.stats
+    last_lines = list(original.chunks[-1][-1:]) if original.chunks else []
+    with stats.timing('render'):
+        # the last line is rendered only for render() to tell if a newline
+        # is missing before the lines appended
+        rendered = list(render(chain(last_lines, lines)))[len(last_lines):]
+    empty = rendered[0][:0] if rendered else ''
+    with stats.timing('write'):
+        f.write(empty.join(rendered))
+    stats.count('bytes_written', sum(len(text) for text in rendered))
+
+
+def backup_path(path, version):
+    return '%s.%d' % (path, version)
+
+
+@contextmanager
+def replacing(path, binary=False):
+    ''' A file to write in place of `path`, renamed over it once written.
+
+    The file replaced, if any, gives it its mode and owner; see
+    copy_mode(). If writing fails, the file written is removed and `path`
+    is left as it was.
+    '''
+    import os
+    temp = path + '.tmp'
+    try:
+        with open_file(temp, 'w', binary) as f:
+            yield f
+    except BaseException:
+        os.unlink(temp)
+        raise
+    if os.path.exists(path):
+        copy_mode(path, temp)
+    os.rename(temp, path)
+
+
+def copy_mode(path, temp):
+    ''' Give a file written to replace `path` the mode and owner of it.
+
+    The owner is kept only where the user may change it.
+    '''
+    import os
+    st = os.stat(path)
+    os.chmod(temp, st.st_mode & 0o7777)
+    try:
+        os.chown(temp, st.st_uid, st.st_gid)
+    except (AttributeError, OSError):
+        pass
+
+
+def replace(hostsman, path, backups, buffer_size=DUMP_BUFFER_SIZE,
+            binary=False):
+    ''' Replace a hosts file by a new one, keeping the old as a backup.
+
+    The new file is written next to it and renamed over it once complete,
+    with the mode and owner of the old one; see replacing(). The old file
+    is only linked as ``<path>.1`` before: no data is copied.
+    '''
+    with replacing(path, binary) as f:
+        dump(hostsman, f, buffer_size)
+        with hostsman.stats.timing('backup'):
+            rotate_backups(path, backups)
+
+
+def rotate_backups(path, backups):
+    ''' Keep a file as ``<path>.1``, shifting older backups up by one.
+
+    Backups past ``<path>.<backups>`` are removed. The file is hard linked,
+    or copied where hard links are not supported.
+    '''
+    import os
+    version = backups
+    while os.path.exists(backup_path(path, version + 1)):
+        os.unlink(backup_path(path, version + 1))
+        version += 1
+    for version in range(backups - 1, 0, -1):
+        if os.path.exists(backup_path(path, version)):
+            os.rename(backup_path(path, version),
+                      backup_path(path, version + 1))
+    latest = backup_path(path, 1)
+    if os.path.exists(latest):
+        os.unlink(latest)
+    try:
+        os.link(path, latest)
+    except (AttributeError, OSError):
+        import shutil
+        shutil.copy2(path, latest)
+
+
+def rollback(path, version=1):
+    ''' Restore a hosts file as it was `version` edits ago.
+
+    Its backup ``<path>.<version>`` is renamed over it. The newer backups
+    are removed, and the older renumbered from ``<path>.1``.
+    '''
+    import os
+    backup = backup_path(path, version)
+    if version < 1 or not os.path.exists(backup):
+        raise ValueError('%s: no backup %d' % (path, version))
+    os.rename(backup, path)
+    for newer in range(1, version):
+        if os.path.exists(backup_path(path, newer)):
+            os.unlink(backup_path(path, newer))
+    older = version + 1
+    while os.path.exists(backup_path(path, older)):
+        os.rename(backup_path(path, older), backup_path(path, older - version))
+        older += 1
+
+
+def apply_ops(hostsman, ops):
+    ''' Apply (method, args...) operations, returning their results.
+    '''
+    return [getattr(hostsman, op[0])(*op[1:]) for op in ops]
+
+
+def edit_many(paths, ops, workers=4, managed=False, binary=False,
+              backups=0):
+    ''' Apply the same operations to many hosts files concurrently.
+
+    `ops` are (method, args...) tuples of HostsManager methods, e.g.
+    ``('put', {'example.tld': '127.0.0.1'})``. Returns a dict for each path,
+    in order, with the 'path', the 'results' of the operations and the
+    'error' raised, if any.
+    '''
+    ops = tuple(ops)
+    paths = list(paths)
+
+    def edit_one(path):
+        try:
+            with edit(path, managed=managed, binary=binary,
+                      backups=backups) as hostsman:
+                results = apply_ops(hostsman, ops)
+        except Exception as e:
+            return {'path': path, 'results': None, 'error': e}
+        return {'path': path, 'results': results, 'error': None}
+
+    if workers <= 1 or len(paths) <= 1:
+        return [edit_one(path) for path in paths]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(paths)))
+    try:
+        return pool.map(edit_one, paths)
+    finally:
+        pool.close()
+        pool.join()
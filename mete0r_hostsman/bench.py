@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+#
+#   hostsman : Manage /etc/hosts
+#   Copyright (C) 2014 mete0r <mete0r@sarangbang.or.kr>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+''' Benchmarks for hostsman.
+
+Usage::
+
+    hostsman-bench [options]
+    hostsman-bench startup [options]
+    hostsman-bench --help
+
+Options::
+
+    -h --help               Show this screen
+    --sizes=<sizes>         comma-separated line counts.
+                            [default: 1000,10000,100000]
+    --names-per-line=<n>    maximum number of names per line. [default: 4]
+    --comments=<ratio>      ratio of comment lines. [default: 0.1]
+    --duplicates=<ratio>    ratio of names repeated from earlier lines.
+                            [default: 0.1]
+    --seed=<seed>           random seed. [default: 0]
+    --repeat=<n>            repeat each measurement, keeping the best.
+                            [default: 3]
+    -o --output=<file>      write JSON results to a file instead of stdout.
+
+'''
+from __future__ import with_statement
+from collections import deque
+import json
+import math
+import os
+import os.path
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from mete0r_hostsman import __version__
+from mete0r_hostsman import HostsManager
+from mete0r_hostsman import OpPlan
+from mete0r_hostsman import delete_hosts
+from mete0r_hostsman import literal
+from mete0r_hostsman import parse
+from mete0r_hostsman import put_hosts
+from mete0r_hostsman import render
+
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def generate_lines(count, names_per_line=4, comment_ratio=0.1,
+                   duplicate_ratio=0.1, seed=0):
+    ''' Generate `count` lines of a synthetic hosts file.
+
+    Each address line has 1 to `names_per_line` names; a `duplicate_ratio`
+    of them repeat a name seen earlier. A `comment_ratio` of lines are
+    comments.
+    '''
+    rng = random.Random(seed)
+    seen = []
+    for line_no in range(count):
+        if rng.random() < comment_ratio:
+            yield '# comment %d\n' % line_no
+            continue
+        names = []
+        for _ in range(rng.randint(1, names_per_line)):
+            if seen and rng.random() < duplicate_ratio:
+                names.append(rng.choice(seen))
+            else:
+                name = 'host%d-%d.zone%d.example.tld' % (
+                    line_no, len(names), rng.randint(0, 99)
+                )
+                if len(seen) < 10000:
+                    seen.append(name)
+                names.append(name)
+        addr = '10.%d.%d.%d' % (rng.randint(0, 255), rng.randint(0, 255),
+                                rng.randint(1, 254))
+        yield '%s\t%s\n' % (addr, ' '.join(names))
+
+
+def consume(iterable):
+    deque(iterable, maxlen=0)
+
+
+def operations(lines):
+    ''' Return (name, setup, run) of the operations to benchmark.
+
+    `setup()` prepares the input outside of measurement; `run(input)` is
+    measured.
+    '''
+    def parsed():
+        return tuple(parse(lines))
+
+    def hostsman():
+        manager = HostsManager()
+        manager.parsed = parsed()
+        return manager
+
+    hosts = dict(('bench%d.example.tld' % i, '10.255.255.%d' % (i + 1))
+                 for i in range(10))
+    names = list(hosts)
+    plan = OpPlan(put=hosts, delete=['bench%d.example.tld' % i
+                                     for i in range(10, 20)])
+
+    def get(manager):
+        try:
+            manager['absent.example.tld']
+        except KeyError:
+            pass
+
+    # as read from a file in binary mode, and decoded as in text mode
+    binary_lines = [literal(line, b'') for line in lines]
+
+    def roundtrip_bytes(lines):
+        consume(render(parse(lines)))
+
+    def roundtrip_text(lines):
+        texts = render(parse(line.decode('utf-8') for line in lines))
+        consume(text.encode('utf-8') for text in texts)
+
+    return [
+        ('parse', lambda: lines, lambda lines: consume(parse(lines))),
+        ('render', parsed, lambda parsed: consume(render(parsed))),
+        ('get', hostsman, get),
+        ('put', parsed, lambda parsed: consume(put_hosts(parsed, hosts))),
+        ('delete', parsed,
+         lambda parsed: consume(delete_hosts(parsed, names))),
+        ('plan', parsed, lambda parsed: consume(plan.apply(parsed))),
+        ('roundtrip_bytes', lambda: binary_lines, roundtrip_bytes),
+        ('roundtrip_text', lambda: binary_lines, roundtrip_text),
+    ]
+
+
+def measure(setup, run, repeat=3):
+    ''' Measure best seconds and peak bytes.
+
+    Peak bytes are those allocated, as tracemalloc traces them. Without
+    tracemalloc, e.g. on Python 2, they are the growth of the maximum
+    resident set size of a forked child that runs the operation once;
+    see fork_peak(). They are None if neither is available.
+    '''
+    best = None
+    for _ in range(repeat):
+        given = setup()
+        started = timer()
+        run(given)
+        elapsed = timer() - started
+        if best is None or elapsed < best:
+            best = elapsed
+        del given
+
+    peak = None
+    if tracemalloc is not None:
+        given = setup()
+        tracemalloc.start()
+        try:
+            run(given)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    else:
+        peak = fork_peak(setup, run)
+    return best, peak
+
+
+def fork_peak(setup, run):
+    ''' Growth of the maximum resident set size of run(setup()), in bytes.
+
+    It is measured in a forked child, whose maximum starts from its size
+    when forked. This counts what the interpreter keeps from the system,
+    not what is allocated: it is coarser than tracemalloc. Returns None
+    without fork() and getrusage().
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    if not hasattr(os, 'fork'):
+        return None
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            given = setup()
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            run(given)
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, str(after - before).encode('ascii'))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    try:
+        output = b''
+        while True:
+            chunk = os.read(read_fd, 64)
+            if not chunk:
+                break
+            output += chunk
+    finally:
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+    if not output:
+        return None
+    # kilobytes, but bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return int(output) * scale
+
+
+def bench_operations(sizes, repeat=3, **options):
+    ''' Benchmark each operation on synthetic files of the given sizes.
+    '''
+    results = []
+    for size in sizes:
+        lines = list(generate_lines(size, **options))
+        for name, setup, run in operations(lines):
+            seconds, peak = measure(setup, run, repeat)
+            results.append({
+                'operation': name,
+                'lines': size,
+                'seconds': seconds,
+                'lines_per_second': size / seconds if seconds else None,
+                'peak_bytes': peak,
+            })
+    return results
+
+
+def scaling(results):
+    ''' Estimate the exponent k of t ~ n^k between successive sizes.
+    '''
+    by_operation = {}
+    for result in results:
+        by_operation.setdefault(result['operation'], []).append(result)
+    curves = {}
+    for name, points in by_operation.items():
+        points.sort(key=lambda result: result['lines'])
+        curve = []
+        for a, b in zip(points, points[1:]):
+            if a['seconds'] and b['seconds'] and a['lines'] != b['lines']:
+                exponent = (math.log(b['seconds'] / a['seconds']) /
+                            math.log(float(b['lines']) / a['lines']))
+            else:
+                exponent = None
+            curve.append({
+                'from': a['lines'],
+                'to': b['lines'],
+                'exponent': exponent,
+            })
+        curves[name] = curve
+    return curves
+
+
+STARTUP_GET = '''
+import sys
+sys.argv = ['hostsman', '-f', sys.argv[1], 'get', 'localhost']
+from mete0r_hostsman.cli import main
+main()
+'''
+
+
+def bench_startup(repeat=10):
+    ''' Measure startup of `hostsman get` in fresh interpreters.
+
+    Returns best and median wall-clock seconds of a whole `hostsman get`
+    invocation, and, where ``python -X importtime`` is supported (Python
+    3.7 and later, not Python 2), the cumulative import time of
+    `mete0r_hostsman.cli` in microseconds and the names of all modules it
+    has imported.
+    '''
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_dir] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'hosts')
+        with open(path, 'w') as f:
+            f.write('127.0.0.1\tlocalhost\n')
+
+        command = [sys.executable, '-c', STARTUP_GET, path]
+        with open(os.devnull, 'w') as devnull:
+            timings = []
+            for _ in range(repeat):
+                started = time.time()
+                subprocess.check_call(command, env=env, stdout=devnull)
+                timings.append(time.time() - started)
+        timings.sort()
+        result = {
+            'best': timings[0],
+            'median': timings[len(timings) // 2],
+        }
+        if sys.version_info >= (3, 7):
+            result.update(importtime(command, env))
+        return result
+    finally:
+        shutil.rmtree(workdir)
+
+
+def importtime(command, env):
+    ''' Run command with `-X importtime` and summarize what cli imports.
+    '''
+    command = command[:1] + ['-X', 'importtime'] + command[1:]
+    process = subprocess.Popen(command, env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    _, stderr = process.communicate()
+
+    # lines: "import time: <self> | <cumulative> | <indented name>"
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(fields[1])))
+
+    # children are reported before their parent
+    cli_cumulative = None
+    cli_modules = []
+    for index, (depth, name, cumulative) in enumerate(entries):
+        if name == 'mete0r_hostsman.cli':
+            cli_cumulative = cumulative
+            for child_depth, child, _ in reversed(entries[:index]):
+                if child_depth <= depth:
+                    break
+                cli_modules.append(child)
+    return {
+        'import_cli_us': cli_cumulative,
+        'import_cli_modules': sorted(cli_modules),
+    }
+
+
+def main():
+    from docopt import docopt
+    from mete0r_hostsman.cli import rest_to_docopt
+    args = docopt(rest_to_docopt(__doc__))
+
+    repeat = int(args['--repeat'])
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+    }
+    if args['startup']:
+        report['startup'] = bench_startup(repeat)
+    else:
+        sizes = [int(size) for size in args['--sizes'].split(',')]
+        options = {
+            'names_per_line': int(args['--names-per-line']),
+            'comment_ratio': float(args['--comments']),
+            'duplicate_ratio': float(args['--duplicates']),
+            'seed': int(args['--seed']),
+        }
+        results = bench_operations(sizes, repeat, **options)
+        report.update({
+            'options': options,
+            'results': results,
+            'scaling': scaling(results),
+        })
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            write_report(report, f)
+    else:
+        write_report(report, sys.stdout)
+
+
+def write_report(report, f):
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -20,67 +20,590 @@
 
 Usage::
 
-    hostsman [-f <file>] list
-    hostsman [-f <file>] get <name>...
-    hostsman [-f <file>] put <name-address>...
-    hostsman [-f <file>] delete <name>...
+    hostsman [options] [-f <file>]... list
+    hostsman [options] [-f <file>]... get <name>...
+    hostsman [options] [-f <file>]... get --suffix=<domain>
+    hostsman [options] [-f <file>]... get --glob=<pattern>
+    hostsman [options] [-f <file>]... get --regex=<pattern>
+    hostsman [options] [-f <file>]... put [--no-merge] <name-address>...
+    hostsman [options] [-f <file>]... put [--no-merge] --from=<input>
+    hostsman [options] [-f <file>]... delete <name>...
+    hostsman [options] [-f <file>]... delete
+        (--addr=<address> | --cidr=<network>)...
+    hostsman [options] [-f <file>]... sync --desired=<desired>
+    hostsman [options] [-f <file>]... check [--max-line-length=<n>]
+    hostsman [options] [-f <file>]... export [--output=<output>]
+    hostsman [options] [-f <file>]... rollback [--to=<n>]
+    hostsman [options] [-f <file>]... import
+    hostsman [options] [-f <file>]... render
     hostsman --help
 
 Options::
 
     -h --help               Show this screen
-    -f --file=<file>        hosts file. (default: /etc/hosts)
+    -f --file=<file>        hosts file, repeatable; a shell-style pattern
+                            matches many. put, delete and sync edit all of
+                            them concurrently. (default: /etc/hosts)
+                            Files only read, as well as the inputs of
+                            put and sync, may be gzip, bzip2 or xz
+                            compressed. A directory is a set of shards;
+                            see --shards.
+    --files-from=<list>     read hosts file paths, one per line, from a file.
+                            ('-' for stdin)
+    -j --jobs=<n>           edit at most <n> files at once. (default: 4)
+    --shards=<n>            split hosts by name into <n> files in the
+                            directory <file>, so that a change rewrites
+                            only the files of its names. (default: 16)
+    -m --managed            only touch the managed section of the hosts file.
+    --desired=<desired>     hosts file with the desired set of hosts.
+    --format=<format>       output format: tsv, json or ndjson. (default: tsv)
+                            export formats: dnsmasq, unbound or cdb.
+                            (default: dnsmasq)
+    --sort                  sort output by names.
+    --sort-memory=<mb>      memory to sort in; beyond it, sorted runs are
+                            spilled to temporary files. (default: 64)
+    --from=<input>          read <name>/<address> pairs from NDJSON or
+                            tab-separated lines. ('-' for stdin)
+    --no-merge              put names on new lines, not on existing lines
+                            of their addresses.
+    --suffix=<domain>       get the domain and names under it.
+    --glob=<pattern>        get names matching a shell-style pattern.
+    --regex=<pattern>       get names matching a regular expression.
+    --addr=<address>        delete lines of the address.
+    --cidr=<network>        delete lines of addresses in the network.
+                            (e.g. 10.4.0.0/16)
+    --max-line-length=<n>   longest line check accepts. (default: 1024)
+    -o --output=<output>    export to a file, replaced once written.
+                            (required by cdb)
+    --backups=<n>           keep the <n> previous versions of each edited
+                            file as <file>.1 to <file>.<n>. (default: 0)
+    --to=<n>                roll back to <file>.<n>, the version of <n>
+                            edits before. (default: 1)
+    --db=<db>               keep hosts in a SQLite database: list, get, put
+                            and delete use it instead of the hosts file,
+                            which import reads and render writes, if the
+                            hosts have changed since it last did.
+    --bloom=<rate>          let get <name>... reject absent names with a
+                            Bloom filter of this false positive rate (e.g.
+                            0.01), kept in <file>.bloom.
+    --stats                 print per-phase timings and counters to stderr.
 
 
     <name-address>          <name>=<address> (e.g. example.tld=127.0.0.1)
 
+Environment::
+
+    HOSTSMAN_PROFILE        dump cProfile statistics of the run to this file.
+
 '''
-import logging
+from itertools import islice
+import os
 import sys
 
-from docopt import docopt
-
+from mete0r_hostsman import OpPlan
+from mete0r_hostsman import Stats
 from mete0r_hostsman import load
+from mete0r_hostsman import open_hosts
 from mete0r_hostsman import edit
+from mete0r_hostsman import rollback
+
+# docopt, json and logging are imported only when needed: interpreter and
+# import startup dominate short invocations like `hostsman get`.
 
 
-logger = logging.getLogger(__name__)
+PROFILE_ENV = 'HOSTSMAN_PROFILE'
 
 
 def main():
-    doc = rest_to_docopt(__doc__)
-    args = docopt(doc)
+    args = parse_args_fast(sys.argv[1:])
+    if args is None:
+        from docopt import docopt
+        args = docopt(USAGE)
 
-    path = args['--file'] or '/etc/hosts'
+    profile = os.environ.get(PROFILE_ENV)
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, args)
+        finally:
+            profiler.dump_stats(profile)
+    else:
+        run(args)
 
-    if args['list']:
-        with open(path) as f:
-            hostsman = load(f)
-        hosts = hostsman.list()
-        print_hosts(hosts)
-    elif args['get']:
-        with open(path) as f:
-            hostsman = load(f)
-        hosts = hostsman.get(args['<name>'])
-        print_hosts(hosts)
-    elif args['put']:
-        kvlist = args['<name-address>']
-        hosts = parse_name_addr(kvlist)
-        with edit(path) as hostsman:
-            hostsman.put(hosts)
+
+def run(args):
+    paths = hosts_paths(args['--file'] or [], args['--files-from'])
+    managed = args['--managed']
+    if args['export']:
+        from mete0r_hostsman.export import EXPORT_FORMATS
+        formats = EXPORT_FORMATS
+    else:
+        formats = OUTPUT_FORMATS
+    # the first format is the default
+    format = args['--format'] or formats[0]
+    if format not in formats:
+        log_error('invalid format: %s', format)
+        raise SystemExit(1)
+    if args['--regex']:
+        check_regex(args['--regex'])
+    stats = Stats()
+    status = 0
+
+    if args['--db']:
+        status = run_store(args, paths, format, stats)
+    elif args['import'] or args['render']:
+        log_error('%s needs --db', 'import' if args['import'] else 'render')
+        raise SystemExit(1)
+    elif (args['list'] or args['get']) and is_streamed(args) and \
+            not is_sharded(single_path(paths, args), args):
+        from mete0r_hostsman import managed_lines
+        from mete0r_hostsman import parse
+        # written as lines are read, not once all are loaded
+        with open_hosts(single_path(paths, args)) as f:
+            lines = parse(f, share=False)
+            if managed:
+                lines = managed_lines(lines)
+            print_hosts(streamed_hosts(lines, args), format, args['--sort'],
+                        sort_memory(args), stats)
+    elif args['list'] or args['get']:
+        path = single_path(paths, args)
+        if is_sharded(path, args):
+            from mete0r_hostsman.shard import ShardedHostsManager
+            hostsman = ShardedHostsManager(path, shards=shards(args),
+                                           managed=managed, stats=stats)
+        elif args['--bloom'] and args['<name>']:
+            hostsman = load_with_bloom(path, args['<name>'],
+                                       float(args['--bloom']), managed, stats)
+        else:
+            with open_hosts(path) as f:
+                hostsman = load(f, managed=managed, stats=stats)
+        if hostsman is None:
+            hosts = iter(())
+        elif args['list']:
+            hosts = hostsman.list()
+        elif args['--suffix']:
+            hosts = hostsman.get_by_suffix(args['--suffix'])
+        elif args['--glob']:
+            hosts = hostsman.get_by_glob(args['--glob'])
+        elif args['--regex']:
+            hosts = hostsman.get_by_regex(args['--regex'])
+        else:
+            hosts = hostsman.get(args['<name>'])
+        print_hosts(hosts, format, args['--sort'], sort_memory(args), stats)
+    elif args['check']:
+        from mete0r_hostsman import MAX_LINE_LENGTH
+        from mete0r_hostsman import check_hosts
+        from mete0r_hostsman import managed_lines
+        from mete0r_hostsman import parse
+        max_line_length = int(args['--max-line-length'] or MAX_LINE_LENGTH)
+        with open_hosts(single_path(paths, args)) as f:
+            with stats.timing('check'):
+                lines = parse(f, share=False)
+                if managed:
+                    lines = managed_lines(lines)
+                problems = check_hosts(lines, max_line_length)
+                found = print_problems(problems, format)
+        stats.count('problems', found)
+        if found:
+            status = 1
+    elif args['export']:
+        from mete0r_hostsman import list_hosts
+        from mete0r_hostsman import managed_lines
+        from mete0r_hostsman import parse
+        from mete0r_hostsman.export import export_file
+        from mete0r_hostsman.export import export_hosts
+        if format == 'cdb' and not args['--output']:
+            log_error('cdb is exported only with --output')
+            raise SystemExit(1)
+        with open_hosts(single_path(paths, args)) as f:
+            with stats.timing('export'):
+                lines = parse(f, share=False)
+                if managed:
+                    lines = managed_lines(lines)
+                hosts = list_hosts(lines)
+                if args['--output']:
+                    export_file(hosts, format, args['--output'])
+                else:
+                    export_hosts(hosts, format, sys.stdout)
+    elif args['put'] or args['delete'] or args['sync']:
+        ops = parse_ops(args)
+        backups = int(args['--backups'] or 0)
+        if len(paths) == 1 and is_sharded(paths[0], args):
+            if backups:
+                log_error('backups are not kept of sharded directories')
+                raise SystemExit(1)
+            from mete0r_hostsman.shard import edit_sharded
+            try:
+                with edit_sharded(paths[0], managed=managed, stats=stats,
+                                  shards=shards(args)) as hostsman:
+                    for op in ops:
+                        result = getattr(hostsman, op[0])(*op[1:])
+            except ValueError as e:
+                log_error('%s', e)
+                raise SystemExit(1)
+            if args['sync']:
+                print_counts(result)
+        elif len(paths) == 1:
+            with edit(paths[0], managed=managed, stats=stats,
+                      backups=backups) as hostsman:
+                for op in ops:
+                    result = getattr(hostsman, op[0])(*op[1:])
+            if args['sync']:
+                print_counts(result)
+        else:
+            from mete0r_hostsman import edit_many
+            jobs = int(args['--jobs'] or 4)
+            with stats.timing('edit_many'):
+                # every file applies all the batches: they are kept
+                results = edit_many(paths, list(ops), workers=jobs,
+                                    managed=managed, backups=backups)
+            stats.count('files', len(results))
+            print_results(results)
+            if [result for result in results if result['error']]:
+                status = 1
+    elif args['rollback']:
+        version = int(args['--to'] or 1)
+        for path in paths:
+            try:
+                rollback(path, version)
+            except (ValueError, OSError) as e:
+                log_error('%s', e)
+                status = 1
+    else:
+        log_error('invalid invocation. try %s --help' % sys.argv[0])
+        raise SystemExit(1)
+
+    if args['--stats']:
+        print_stats(stats)
+    if status:
+        raise SystemExit(status)
+
+
+def run_store(args, paths, format, stats):
+    ''' Run a command on the hosts of a SQLite database; returns a status.
+    '''
+    from mete0r_hostsman.store import HostsStore
+    store = HostsStore(args['--db'], stats=stats)
+    try:
+        if args['import']:
+            with open_hosts(single_path(paths, args)) as f:
+                store.import_lines(f)
+        elif args['render']:
+            path = single_path(paths, args)
+            with stats.timing('render_file'):
+                if store.write(path):
+                    stats.count('files', 1)
+        elif args['list']:
+            print_hosts(store.list(), format, args['--sort'],
+                        sort_memory(args), stats)
+        elif args['get'] and args['--suffix']:
+            print_hosts(store.get_by_suffix(args['--suffix']), format,
+                        args['--sort'], sort_memory(args), stats)
+        elif args['get'] and args['<name>']:
+            print_hosts(store.get(args['<name>']), format, args['--sort'],
+                        sort_memory(args), stats)
+        elif args['put'] or args['delete']:
+            for op in parse_ops(args):
+                getattr(store, op[0])(*op[1:])
+        else:
+            log_error('the command is not supported with --db')
+            return 1
+    finally:
+        store.close()
+    return 0
+
+
+def single_path(paths, args):
+    ''' The only path of a command reading a single hosts file.
+    '''
+    if len(paths) != 1:
+        command = [command for command
+                   in ('list', 'get', 'check', 'export', 'import', 'render')
+                   if args[command]][0]
+        log_error('%s reads a single hosts file', command)
+        raise SystemExit(1)
+    return paths[0]
+
+
+def load_with_bloom(path, hostnames, error_rate, managed, stats):
+    ''' Load hosts with a Bloom filter kept alongside the file.
+
+    Returns None, without reading the hosts file, if the filter rejects
+    all the names. A missing or outdated filter is built and saved.
+    '''
+    from mete0r_hostsman import load_bloom
+    from mete0r_hostsman import save_bloom
+    from mete0r_hostsman import stat_signature
+    with stats.timing('bloom_load'):
+        bloom = load_bloom(path)
+    if bloom is not None and bloom.error_rate != error_rate:
+        bloom = None
+    if bloom is not None:
+        if not [hostname for hostname in hostnames if hostname in bloom]:
+            stats.count('bloom_bytes', bloom.memory)
+            return None
+    signature = stat_signature(path)
+    with open_hosts(path) as f:
+        hostsman = load(f, managed=managed, stats=stats,
+                        bloom=error_rate if bloom is None else bloom)
+    if bloom is None:
+        try:
+            save_bloom(hostsman.snapshot().bloom, path, signature)
+        except (IOError, OSError):
+            pass
+    return hostsman
+
+
+def sort_memory(args):
+    from mete0r_hostsman import SORT_MEMORY
+    if args['--sort-memory']:
+        return int(float(args['--sort-memory']) * (1 << 20))
+    return SORT_MEMORY
+
+
+def is_sharded(path, args):
+    return bool(args['--shards']) or os.path.isdir(path)
+
+
+def shards(args):
+    return int(args['--shards']) if args['--shards'] else None
+
+
+def hosts_paths(files, files_from=None):
+    ''' Expand -f patterns and --files-from lists into hosts file paths.
+    '''
+    paths = []
+    for path in files:
+        if [c for c in '*?[' if c in path]:
+            import glob
+            paths.extend(sorted(glob.glob(path)) or [path])
+        else:
+            paths.append(path)
+    if files_from == '-':
+        paths.extend(line.strip() for line in sys.stdin if line.strip())
+    elif files_from:
+        with open(files_from) as f:
+            paths.extend(line.strip() for line in f if line.strip())
+
+    # a file must not be edited twice at once; docopt also repeats values of
+    # an option shared by alternative usage patterns.
+    seen = set()
+    paths = [path for path in paths if not (path in seen or seen.add(path))]
+    return paths or ['/etc/hosts']
+
+
+PUT_BATCH = 10000
+
+
+def parse_ops(args):
+    ''' The (method, args...) operations of put, delete or sync.
+
+    Entries of put --from are put in batches of PUT_BATCH entries, as they
+    are read, instead of being loaded all at once.
+    '''
+    if args['put'] and args['--from']:
+        return read_put_ops(args['--from'], not args['--no-merge'])
+    return [parse_op(args)]
+
+
+def read_put_ops(input, merge=True):
+    if input == '-':
+        for op in put_ops(read_name_addr(sys.stdin), merge):
+            yield op
+    else:
+        with open_hosts(input) as f:
+            for op in put_ops(read_name_addr(f), merge):
+                yield op
+
+
+def put_ops(entries, merge=True, batch=PUT_BATCH):
+    ''' Put operations of (name, address) pairs, `batch` pairs each.
+    '''
+    entries = iter(entries)
+    while True:
+        hosts = dict(islice(entries, batch))
+        if not hosts:
+            break
+        yield put_op(hosts, merge)
+
+
+def put_op(hosts, merge=True):
+    if merge:
+        return ('apply_plan', OpPlan(put=hosts))
+    return ('put', hosts, False)
+
+
+def parse_op(args):
+    ''' Build the (method, args...) operation of put, delete or sync once.
+
+    Puts and deletes are compiled into an OpPlan, shared by all files.
+    '''
+    if args['put']:
+        return put_op(parse_name_addr(args['<name-address>']),
+                      not args['--no-merge'])
     elif args['delete']:
-        with edit(path) as hostsman:
-            hostsman.delete(args['<name>'])
+        if args['--addr'] or args['--cidr']:
+            check_addrs(args['--addr'], args['--cidr'])
+            return ('delete_by_addr', args['--addr'], args['--cidr'])
+        return ('apply_plan', OpPlan(delete=args['<name>']))
     else:
-        logger.error('invalid invocation. try %s --help' % sys.argv[0])
+        with open_hosts(args['--desired']) as f:
+            hosts = dict(load(f).list())
+        return ('sync', hosts)
+
+
+def check_addrs(addrs, networks):
+    ''' Exit with an error on an invalid address or network.
+    '''
+    from mete0r_hostsman import addr_key
+    from mete0r_hostsman import network_range
+    try:
+        for hostaddr in addrs:
+            if addr_key(hostaddr) is None:
+                raise ValueError('invalid address: %s' % hostaddr)
+        for network in networks:
+            network_range(network)
+    except ValueError as e:
+        log_error('%s', e)
+        raise SystemExit(1)
+
+
+def is_streamed(args):
+    ''' Whether list or get goes through the lines of a file as they are
+    read, instead of loading a HostsManager.
+
+    Only lookups through a Bloom filter and queries answered from an index,
+    --suffix and '*.<domain>' globs, load one.
+    '''
+    from mete0r_hostsman import glob_suffix
+    if args['list']:
+        return True
+    if args['--suffix'] or args['--bloom'] and args['<name>']:
+        return False
+    if args['--glob']:
+        return glob_suffix(args['--glob']) is None
+    return True
+
+
+def streamed_hosts(lines, args):
+    ''' (name, address) pairs of list or get, from parsed lines.
+    '''
+    from mete0r_hostsman import get_hosts
+    from mete0r_hostsman import get_hosts_by_predicate
+    from mete0r_hostsman import list_hosts
+    from mete0r_hostsman import predicate_glob
+    from mete0r_hostsman import predicate_regex
+    if args['list']:
+        return list_hosts(lines)
+    elif args['--glob']:
+        return get_hosts_by_predicate(lines, predicate_glob(args['--glob']))
+    elif args['--regex']:
+        return get_hosts_by_predicate(lines, predicate_regex(args['--regex']))
+    return get_hosts(lines, args['<name>'])
+
+
+def check_regex(pattern):
+    ''' Exit with an error on an invalid regular expression.
+    '''
+    import re
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        log_error('invalid regular expression: %s: %s', pattern, e)
         raise SystemExit(1)
 
 
-def print_hosts(hosts):
-    hosts = dict(hosts)
-    for hostname in sorted(hosts):
-        hostaddr = hosts[hostname]
-        sys.stdout.write('%s\t%s\n' % (hostname, hostaddr))
+OUTPUT_FORMATS = ('tsv', 'json', 'ndjson')
+
+
+def log_error(msg, *args):
+    import logging
+    # without a handler, Python 2 drops the message
+    logging.basicConfig(format='%(name)s: %(message)s')
+    logging.getLogger(__name__).error(msg, *args)
+
+
+def print_hosts(hosts, format='tsv', sort=False, sort_memory=None,
+                stats=None):
+    ''' Write (name, address) pairs to stdout as they come.
+
+    Sorted, they are written once all have come, sorted in `sort_memory`
+    bytes; see sort_hosts().
+    '''
+    if sort:
+        from mete0r_hostsman import SORT_MEMORY
+        from mete0r_hostsman import sort_hosts
+        hosts = sort_hosts(hosts, sort_memory or SORT_MEMORY, stats)
+    records = ({'name': hostname, 'addr': hostaddr}
+               for hostname, hostaddr in hosts)
+    return print_records(records, ('name', 'addr'), format)
+
+
+def print_problems(problems, format='tsv'):
+    ''' Write problems found by check_hosts() to stdout as they come.
+    '''
+    return print_records(problems, ('line_no', 'problem', 'detail'), format)
+
+
+def print_records(records, fields, format='tsv'):
+    ''' Write dicts to stdout as they come, returning how many.
+
+    TSV lines have the values of `fields`; JSON and NDJSON have whole dicts.
+    '''
+    count = 0
+    write = sys.stdout.write
+    if format == 'tsv':
+        for record in records:
+            write('\t'.join('%s' % record[field] for field in fields) + '\n')
+            count += 1
+    elif format == 'ndjson':
+        import json
+        for record in records:
+            write(json.dumps(record) + '\n')
+            count += 1
+    elif format == 'json':
+        import json
+        separator = '[\n'
+        for record in records:
+            write(separator)
+            write(json.dumps(record))
+            separator = ',\n'
+            count += 1
+        if separator == '[\n':
+            write('[')
+        write('\n]\n')
+    else:
+        raise ValueError(format)
+    return count
+
+
+def print_counts(counts):
+    for kind in ('added', 'updated', 'deleted', 'unchanged'):
+        sys.stdout.write('%s\t%d\n' % (kind, counts[kind]))
+
+
+def print_results(results):
+    ''' Print a line per file of edit_many() results.
+    '''
+    for result in results:
+        if result['error']:
+            line = '%s\terror\t%s' % (result['path'], result['error'])
+        else:
+            line = '%s\tok' % result['path']
+            for counts in result['results']:
+                if isinstance(counts, dict):
+                    line += '\t' + ' '.join('%s=%d' % (key, counts[key])
+                                            for key in sorted(counts))
+        sys.stdout.write(line + '\n')
+
+
+def print_stats(stats):
+    write = sys.stderr.write
+    for phase, seconds in sorted(stats.timings.items()):
+        write('%s\t%.6f\n' % (phase, seconds))
+    for counter, value in sorted(stats.counters.items()):
+        write('%s\t%d\n' % (counter, value))
 
 
 def rest_to_docopt(doc):
@@ -89,7 +612,87 @@ def rest_to_docopt(doc):
     return doc.replace('::\n\n', ':\n').replace('``', '')
 
 
+USAGE = rest_to_docopt(__doc__)
+
+
+class Arguments(dict):
+    ''' docopt-like arguments: absent options and commands are None.
+    '''
+
+    def __missing__(self, key):
+        return None
+
+
+def parse_args_fast(argv):
+    ''' Parse the common read-only invocations without docopt.
+
+    Only ``list`` and ``get <name>...`` with leading options are handled;
+    None is returned for anything else, which is then left to docopt.
+    '''
+    args = Arguments()
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if arg in ('-f', '--file', '--format'):
+            if not argv:
+                return None
+            if arg == '--format':
+                args['--format'] = argv.pop(0)
+            else:
+                args.setdefault('--file', []).append(argv.pop(0))
+        elif arg.startswith('--file='):
+            args.setdefault('--file', []).append(arg[len('--file='):])
+        elif arg.startswith('--format='):
+            args['--format'] = arg[len('--format='):]
+        elif arg.startswith('--bloom='):
+            args['--bloom'] = arg[len('--bloom='):]
+        elif arg.startswith('-f') and not arg.startswith('--'):
+            args.setdefault('--file', []).append(arg[len('-f'):])
+        elif arg in ('-m', '--managed'):
+            args['--managed'] = True
+        elif arg == '--sort':
+            args['--sort'] = True
+        elif arg.startswith('--sort-memory='):
+            args['--sort-memory'] = arg[len('--sort-memory='):]
+        elif arg == '--stats':
+            args['--stats'] = True
+        elif arg == 'list' and not argv:
+            args['list'] = True
+            return args
+        elif arg == 'get' and argv:
+            if [name for name in argv if name.startswith('-')]:
+                return None
+            args['get'] = True
+            args['<name>'] = argv
+            return args
+        else:
+            return None
+    return None
+
+
 def parse_name_addr(name_address_list):
     ''' Parse list of <name>=<address> lists into a dict.
     '''
     return dict(kv.split('=', 1) for kv in name_address_list)
+
+
+def read_name_addr(f):
+    ''' Read (name, address) pairs from NDJSON or tab-separated lines.
+
+    Exits with an error at the first line that is neither.
+    '''
+    import json
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if line.startswith('{'):
+                entry = json.loads(line)
+                hostname, hostaddr = entry['name'], entry['addr']
+            else:
+                hostname, hostaddr = line.split(None, 1)
+        except (ValueError, KeyError, TypeError):
+            log_error('invalid entry at line %d: %s', line_no, line)
+            raise SystemExit(1)
+        yield hostname, hostaddr
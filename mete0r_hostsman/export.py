@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+#   hostsman : Manage /etc/hosts
+#   Copyright (C) 2014 mete0r <mete0r@sarangbang.or.kr>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+''' Export hosts to the configuration or databases of resolvers.
+
+Hosts are (name, address) pairs as yielded by `list_hosts()`; they are
+written as they come. Names with an address that is not an IPv4 or IPv6
+address, or that has a zone, are skipped.
+'''
+from __future__ import with_statement
+from array import array
+import struct
+
+from mete0r_hostsman import addr_key
+from mete0r_hostsman import as_text
+from mete0r_hostsman import decode_hosts
+from mete0r_hostsman import name_key
+from mete0r_hostsman import replacing
+
+
+EXPORT_FORMATS = ('dnsmasq', 'unbound', 'cdb')
+
+
+def resolvable(hosts):
+    ''' (name, address, record type) of hosts with an IPv4 or IPv6 address.
+    '''
+    for hostname, hostaddr in decode_hosts(hosts):
+        key = addr_key(hostaddr)
+        if key is None:
+            continue
+        if key[:1] == b'\x04':
+            yield hostname, hostaddr.strip(), 'A'
+        elif len(key) == 17:
+            yield hostname, hostaddr.strip(), 'AAAA'
+
+
+def dnsmasq_lines(hosts):
+    ''' dnsmasq configuration: a ``host-record`` for each host.
+    '''
+    for hostname, hostaddr, rtype in resolvable(hosts):
+        yield 'host-record=%s,%s\n' % (hostname, hostaddr)
+
+
+def unbound_lines(hosts):
+    ''' unbound configuration: a ``local-data`` A or AAAA record for each.
+    '''
+    yield 'server:\n'
+    for hostname, hostaddr, rtype in resolvable(hosts):
+        yield '    local-data: "%s. IN %s %s"\n' % (
+            hostname.rstrip('.'), rtype, hostaddr)
+
+
+def cdb_records(hosts):
+    ''' (key, value) of each host: its name key and its address, as bytes.
+    '''
+    for hostname, hostaddr, rtype in resolvable(hosts):
+        yield cdb_key(hostname), hostaddr.encode('ascii')
+
+
+def cdb_key(hostname):
+    key = name_key(hostname)
+    if isinstance(key, bytes):
+        return key
+    return key.encode('utf-8')
+
+
+def cdb_hash(key):
+    h = 5381
+    for c in bytearray(key):
+        h = (((h << 5) + h) ^ c) & 0xffffffff
+    return h
+
+
+def write_cdb(records, f):
+    ''' Write (key, value) bytes records as a cdb to a seekable binary file.
+
+    Records are written as they come; only the hash and position of each
+    are kept until the hash tables are written at the end.
+    '''
+    hashes = [array('L') for _ in range(256)]
+    positions = [array('L') for _ in range(256)]
+    pack = struct.Struct('<LL').pack
+    f.seek(2048)
+    pos = 2048
+    for key, value in records:
+        h = cdb_hash(key)
+        hashes[h & 255].append(h)
+        positions[h & 255].append(pos)
+        f.write(pack(len(key), len(value)))
+        f.write(key)
+        f.write(value)
+        pos += 8 + len(key) + len(value)
+        if pos > 0xffffffff:
+            raise ValueError('cdb larger than 4GB')
+
+    header = []
+    for table_hashes, table_positions in zip(hashes, positions):
+        slots = [(0, 0)] * (len(table_hashes) * 2)
+        for h, p in zip(table_hashes, table_positions):
+            i = (h >> 8) % len(slots)
+            while slots[i][1]:
+                i = (i + 1) % len(slots)
+            slots[i] = (h, p)
+        header.append(pack(pos, len(slots)))
+        f.write(b''.join(pack(h, p) for h, p in slots))
+        pos += 8 * len(slots)
+        if pos > 0xffffffff:
+            raise ValueError('cdb larger than 4GB')
+    f.seek(0)
+    f.write(b''.join(header))
+
+
+def cdb_get(f, key):
+    ''' Values of a key in a cdb file, in the order they were written.
+
+    Takes a constant number of seeks, whatever the size of the file.
+    '''
+    unpack = struct.Struct('<LL').unpack
+    h = cdb_hash(key)
+    f.seek((h & 255) * 8)
+    table, slots = unpack(f.read(8))
+    values = []
+    i = (h >> 8) % slots if slots else 0
+    for _ in range(slots):
+        f.seek(table + i * 8)
+        slot_hash, pos = unpack(f.read(8))
+        if pos == 0:
+            break
+        if slot_hash == h:
+            f.seek(pos)
+            key_len, value_len = unpack(f.read(8))
+            if f.read(key_len) == key:
+                values.append(f.read(value_len))
+        i = (i + 1) % slots
+    return values
+
+
+def lookup_cdb(f, hostname):
+    ''' Addresses of a name in a cdb written by `export_hosts()`.
+    '''
+    return [as_text(value, 'ascii') for value in cdb_get(f, cdb_key(hostname))]
+
+
+def export_hosts(hosts, format, f):
+    ''' Write hosts in an export format to a file.
+
+    dnsmasq and unbound are written as text; cdb needs a seekable binary
+    file.
+    '''
+    if format == 'dnsmasq':
+        f.writelines(dnsmasq_lines(hosts))
+    elif format == 'unbound':
+        f.writelines(unbound_lines(hosts))
+    elif format == 'cdb':
+        write_cdb(cdb_records(hosts), f)
+    else:
+        raise ValueError(format)
+
+
+def export_file(hosts, format, path):
+    ''' Export hosts to a file, replacing it only once completely written.
+
+    A file replaced keeps its mode and owner; see replacing().
+    '''
+    with replacing(path, binary=(format == 'cdb')) as f:
+        export_hosts(hosts, format, f)
@@ -0,0 +1,845 @@
+# -*- coding: utf-8 -*-
+#
+#   hostsman : Manage /etc/hosts
+#   Copyright (C) 2014 mete0r <mete0r@sarangbang.or.kr>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+''' Differential fuzzing of hostsman against reference implementations.
+
+Usage::
+
+    hostsman-fuzz [options]
+    hostsman-fuzz --help
+
+Options::
+
+    -h --help               Show this screen
+    --cases=<n>             number of cases to generate. [default: 200]
+    --lines=<n>             maximum lines of a generated file. [default: 20]
+    --ops=<n>               maximum operations of a case. [default: 4]
+    --seed=<seed>           seed of the first case. [default: 0]
+    --engines=<engines>     comma-separated engines to check. (default: all)
+    --no-shrink             report failing cases as they were generated.
+    -o --output=<file>      write JSON results to a file instead of stdout.
+
+A case is a hosts file and operations on it, generated from its own seed.
+Every engine runs the case, and its results must be exactly those of the
+reference implementations: the results of queries and the final text of
+the file. Failing cases are shrunk to as few lines and operations as still
+fail.
+
+'''
+from __future__ import with_statement
+from collections import OrderedDict
+from zlib import crc32
+import json
+import os
+import os.path
+import platform
+import random
+import shutil
+import socket
+import sys
+import tempfile
+
+from mete0r_hostsman import __version__
+from mete0r_hostsman import HostsManager
+from mete0r_hostsman import NameIndex
+from mete0r_hostsman import OpPlan
+from mete0r_hostsman import MANAGED_BEGIN
+from mete0r_hostsman import MANAGED_END
+from mete0r_hostsman import SORT_ENTRY_OVERHEAD
+from mete0r_hostsman import delete_hosts
+from mete0r_hostsman import delete_hosts_by_addr
+from mete0r_hostsman import edit
+from mete0r_hostsman import edit_many
+from mete0r_hostsman import get_hosts
+from mete0r_hostsman import list_hosts
+from mete0r_hostsman import open_hosts
+from mete0r_hostsman import parse
+from mete0r_hostsman import put_hosts
+from mete0r_hostsman import reference
+from mete0r_hostsman import render
+from mete0r_hostsman import sort_hosts
+
+
+NAMES = ('localhost', 'a.tld', 'b.tld', 'www.a.tld', 'x.www.a.tld',
+         'example.tld', 'c.example.tld', 'd')
+# one form of each address: the reference tells equivalent forms apart
+ADDRS = ('127.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.1.1', '::1', 'fe80::1',
+         'fe80::1%eth0', 'bogus')
+NETWORKS = ('10.0.0.0/24', '10.0.0.0/8', '127.0.0.0/8', 'fe80::/64', '::/0')
+DOMAINS = ('tld', 'a.tld', '.a.tld', 'example.tld', 'none')
+SEPARATORS = (' ', '\t', '  ', ' \t ')
+
+QUERIES = ('get', 'suffix', 'list')
+
+# shards of the sharded engine: few, for names to share them
+SHARDS = 4
+
+# about three pairs a run, for list --sort to spill runs and merge them
+STREAM_SORT_MEMORY = 3 * SORT_ENTRY_OVERHEAD
+
+
+def random_name(rng):
+    name = rng.choice(NAMES)
+    if rng.random() < 0.3:
+        name = ''.join(c.upper() if rng.random() < 0.5 else c for c in name)
+    return name
+
+
+def random_names(rng, most):
+    ''' 1 to `most` names, none of them equal to another but for case.
+    '''
+    names = {}
+    for _ in range(rng.randint(1, most)):
+        hostname = random_name(rng)
+        names.setdefault(hostname.lower(), hostname)
+    return sorted(names.values())
+
+
+def random_hosts(rng, most):
+    ''' {name: address} of 1 to `most` names, each of its own address.
+
+    Names are ordered, as they are put on lines in the order they come.
+    The reference puts new names of an address on a line in no order, so
+    no two names are put to the same address.
+    '''
+    names = random_names(rng, most)
+    return OrderedDict(zip(names, rng.sample(ADDRS, len(names))))
+
+
+def generate_line(rng):
+    ''' A random line of a hosts file, odd ones included.
+
+    Lines are written as the reference renders them: it renders every
+    address line anew, where hostsman keeps the text of unmodified lines.
+    '''
+    line = random_line(rng)
+    return ''.join(reference.render(reference.parse([line])))
+
+
+def random_line(rng):
+    kind = rng.random()
+    if kind < 0.1:
+        return '# comment\n'
+    elif kind < 0.15:
+        return rng.choice(('\n', '   \n', 'junk\n',
+                           rng.choice(ADDRS) + ' \n'))
+    elif kind < 0.2:
+        return rng.choice((MANAGED_BEGIN, MANAGED_END)) + '\n'
+    names = [random_name(rng) for _ in range(rng.randint(1, 4))]
+    line = rng.choice(ADDRS) + rng.choice(SEPARATORS)
+    line += ''.join(name + rng.choice(SEPARATORS) for name in names[:-1])
+    line += names[-1]
+    if rng.random() < 0.05:
+        line = ' ' + line
+    if rng.random() < 0.05:
+        line += ' # trailing comment'
+    return line + rng.choice(('\n',) * 8 + (' \n', '\r\n'))
+
+
+def generate_op(rng):
+    ''' A random operation: (kind, args...)
+    '''
+    kind = rng.random()
+    if kind < 0.3:
+        return ('put', random_hosts(rng, 3))
+    elif kind < 0.5:
+        return ('delete', random_names(rng, 2))
+    elif kind < 0.65:
+        return ('plan', random_hosts(rng, 2), random_names(rng, 2))
+    elif kind < 0.75:
+        addrs = [addr for addr in ADDRS if reference_addr(addr) is not None]
+        addrs = set(rng.choice(addrs) for _ in range(rng.randint(0, 2)))
+        networks = set(rng.choice(NETWORKS) for _ in range(rng.randint(0, 1)))
+        return ('delete_addr', sorted(addrs), sorted(networks))
+    elif kind < 0.85:
+        return ('get', random_names(rng, 2))
+    elif kind < 0.95:
+        return ('suffix', rng.choice(DOMAINS))
+    return ('list', )
+
+
+def generate_case(seed, max_lines=20, max_ops=4):
+    ''' (lines, ops) of a case, the same for the same seed and maximums.
+    '''
+    rng = random.Random(seed)
+    lines = [generate_line(rng) for _ in range(rng.randint(0, max_lines))]
+    ops = [generate_op(rng) for _ in range(rng.randint(1, max_ops))]
+    return lines, ops
+
+
+# reference implementations: the functions of hostsman 0.0.0, in
+# mete0r_hostsman.reference, and plain statements of what has been added
+# since, built on nothing but those.
+#
+# Cases are generated where those functions still say what hostsman does.
+# What it does differently on purpose is left to the unit tests: it keeps
+# the text of unmodified lines and a missing newline at the end, matches
+# equivalent forms of an address, and puts new names of an address on one
+# line in the order they come.
+
+def reference_plan(parsed_lines, hosts, hostnames):
+    if hostnames:
+        parsed_lines = reference.delete_hosts(parsed_lines, hostnames)
+    return reference.put_hosts(parsed_lines, hosts)
+
+
+def reference_addr(hostaddr):
+    ''' (family, bits, zone) of an IPv4 or IPv6 address, or None.
+    '''
+    hostaddr, percent, zone = hostaddr.strip().partition('%')
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            packed = socket.inet_pton(family, hostaddr)
+        except (socket.error, ValueError):
+            continue
+        if percent and (family == socket.AF_INET or not zone):
+            return None
+        bits = ''.join('{0:08b}'.format(c) for c in bytearray(packed))
+        return family, bits, zone
+    return None
+
+
+def in_network(hostaddr, network):
+    addr = reference_addr(hostaddr)
+    network_addr, _, prefixlen = network.partition('/')
+    network_addr = reference_addr(network_addr)
+    if addr is None or addr[0] != network_addr[0]:
+        return False
+    prefixlen = int(prefixlen)
+    return addr[1][:prefixlen] == network_addr[1][:prefixlen]
+
+
+def reference_delete_addr(parsed_lines, addrs, networks):
+    addrs = [reference_addr(hostaddr) for hostaddr in addrs]
+    for line in parsed_lines:
+        if line['type'] == 'HOSTADDR':
+            hostaddr = line['addr']
+            if reference_addr(hostaddr) is not None and \
+                    reference_addr(hostaddr) in addrs:
+                continue
+            if [network for network in networks
+                    if in_network(hostaddr, network)]:
+                continue
+        yield line
+
+
+def reference_get(parsed_lines, hostnames):
+    return list(reference.get_hosts(parsed_lines, hostnames))
+
+
+def reference_suffix(parsed_lines, domain):
+    domain = domain.strip('.').upper()
+    return [(hostname, hostaddr)
+            for hostname, hostaddr in reference.list_hosts(parsed_lines)
+            if hostname.upper() == domain or
+            hostname.upper().endswith('.' + domain)]
+
+
+def reference_list(parsed_lines):
+    return list(reference.list_hosts(parsed_lines))
+
+
+def managed_section(parsed_lines):
+    ''' (before, section, after): lines around the managed section.
+
+    The section is the lines after the first MANAGED_BEGIN line, up to the
+    next MANAGED_END line or the end; None if there is no MANAGED_BEGIN.
+    '''
+    lines = list(parsed_lines)
+    begin = marker_index(lines, MANAGED_BEGIN, 0)
+    if begin is None:
+        return lines, None, []
+    end = marker_index(lines, MANAGED_END, begin + 1)
+    if end is None:
+        end = len(lines)
+    return lines[:begin + 1], lines[begin + 1:end], lines[end:]
+
+
+def marker_index(lines, marker, start):
+    for index in range(start, len(lines)):
+        line = lines[index]
+        if line['type'] == 'COMMENT' and line['line'].strip() == marker:
+            return index
+    return None
+
+
+def reference_managed(parsed_lines, change, *args):
+    ''' Lines changed inside the managed section only.
+
+    Without a section, one is appended for what the change puts, if any.
+    '''
+    before, section, after = managed_section(parsed_lines)
+    if section is not None:
+        return before + list(change(section, *args)) + after
+    section = list(change([], *args))
+    if len(section) == 0:
+        return before
+    return (before +
+            [{'type': 'COMMENT', 'line': MANAGED_BEGIN + '\n'}] +
+            section +
+            [{'type': 'COMMENT', 'line': MANAGED_END + '\n'}])
+
+
+REFERENCE_CHANGES = {
+    'put': reference.put_hosts,
+    'delete': reference.delete_hosts,
+    'plan': reference_plan,
+    'delete_addr': reference_delete_addr,
+}
+
+REFERENCE_QUERIES = {
+    'get': reference_get,
+    'suffix': reference_suffix,
+    'list': reference_list,
+}
+
+
+def text_lines(text):
+    ''' Lines of a text as they are read from a file.
+    '''
+    lines = text.split('\n')
+    return [line + '\n' for line in lines[:-1]] + [lines[-1]] * bool(lines[-1])
+
+
+def run_reference(lines, ops, managed=False, reread=False, shards=None):
+    ''' Results of the queries and final text, as an engine returns them.
+
+    With `reread`, lines are rendered and read again after each change, as
+    they are from a file written and read again. With `shards`, the case
+    is run by run_sharded_reference().
+    '''
+    if shards is not None:
+        return run_sharded_reference(lines, ops, shards)
+    parsed = list(reference.parse(lines))
+    results = []
+    for op in ops:
+        kind, args = op[0], op[1:]
+        if kind in QUERIES:
+            visible = parsed
+            if managed:
+                visible = managed_section(parsed)[1] or []
+            results.append(sorted_hosts(REFERENCE_QUERIES[kind](visible,
+                                                                *args)))
+            continue
+        change = REFERENCE_CHANGES[kind]
+        if managed:
+            parsed = reference_managed(parsed, change, *args)
+        else:
+            parsed = list(change(parsed, *args))
+        if reread:
+            text = ''.join(reference.render(parsed))
+            parsed = list(reference.parse(text_lines(text)))
+        results.append(None)
+    results.append(native(''.join(reference.render(parsed))))
+    return results
+
+
+def reference_shard(hostname, shards):
+    ''' The shard of a name: the CRC-32 of its lower case UTF-8 form.
+    '''
+    key = hostname.lower()
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return (crc32(key) & 0xffffffff) % shards
+
+
+def shard_lines(lines, shard, shards):
+    ''' Lines of a case in a shard: its names of each address line.
+
+    Lines other than address lines with names go to the first shard.
+    '''
+    for line in reference.parse(lines):
+        if line['type'] != 'HOSTADDR' or len(line['names']) == 0:
+            if shard == 0:
+                yield line['line']
+            continue
+        names = tuple(hostname for hostname in line['names']
+                      if reference_shard(hostname, shards) == shard)
+        if names:
+            yield ''.join(reference.render([dict(line, names=names)]))
+
+
+def shard_op(op, shard, shards):
+    ''' An operation on the names of a shard; None if it has none.
+
+    Operations on addresses and queries of all names go to every shard.
+    '''
+    def names_of(hostnames):
+        return [hostname for hostname in hostnames
+                if reference_shard(hostname, shards) == shard]
+
+    kind = op[0]
+    if kind in ('put', 'plan'):
+        hosts = OrderedDict((hostname, op[1][hostname])
+                            for hostname in names_of(op[1]))
+        hostnames = names_of(op[2]) if kind == 'plan' else []
+        if not hosts and not hostnames:
+            return None
+        return (kind, hosts) + ((hostnames, ) if kind == 'plan' else ())
+    elif kind == 'delete':
+        hostnames = names_of(op[1])
+        return (kind, hostnames) if hostnames else None
+    elif kind == 'get':
+        return (kind, names_of(op[1]))
+    return op
+
+
+def run_sharded_reference(lines, ops, shards):
+    ''' Each shard run as a file of its own, with its part of the case.
+
+    The final text is that of each shard.
+    '''
+    results = [[] if op[0] in QUERIES else None for op in ops]
+    texts = []
+    for shard in range(shards):
+        shard_ops = [(index, shard_op(op, shard, shards))
+                     for index, op in enumerate(ops)]
+        shard_ops = [(index, op) for index, op in shard_ops if op is not None]
+        shard_results = run_reference(list(shard_lines(lines, shard, shards)),
+                                      [op for index, op in shard_ops],
+                                      reread=True)
+        for (index, op), result in zip(shard_ops, shard_results):
+            if result is not None:
+                results[index] = sorted(results[index] + result)
+        texts.append(shard_results[-1])
+    return results + [texts]
+
+
+# engines: run a case, returning what run_reference() does
+
+def native(value):
+    ''' A str of text, bytes or unicode, for results to compare. '''
+    if isinstance(value, bytes) and bytes is not str:
+        return value.decode('utf-8')
+    if not isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def sorted_hosts(hosts):
+    return sorted([native(hostname), native(hostaddr)]
+                  for hostname, hostaddr in hosts)
+
+
+def method_op(op):
+    ''' The (method, args...) of HostsManager for an operation.
+    '''
+    kind, args = op[0], tuple(op[1:])
+    if kind == 'plan':
+        return ('apply_plan', OpPlan(put=args[0], delete=args[1]))
+    methods = {
+        'put': 'put',
+        'delete': 'delete',
+        'delete_addr': 'delete_by_addr',
+        'get': 'get',
+        'suffix': 'get_by_suffix',
+        'list': 'list',
+    }
+    return (methods[kind], ) + args
+
+
+def op_result(op, result):
+    if op[0] in QUERIES:
+        return sorted_hosts(result)
+
+
+def apply_op(hostsman, op):
+    method = method_op(op)
+    return op_result(op, getattr(hostsman, method[0])(*method[1:]))
+
+
+def run_manager(hostsman, ops):
+    results = [apply_op(hostsman, op) for op in ops]
+    results.append(''.join(native(text) for text in hostsman.render()))
+    return results
+
+
+def run_functions(lines, ops):
+    ''' Functions over parsed lines: put_hosts(), delete_hosts(), OpPlan...
+    '''
+    parsed = list(parse(lines))
+    results = []
+    for op in ops:
+        kind, args = op[0], op[1:]
+        if kind == 'put':
+            parsed = list(put_hosts(parsed, *args))
+        elif kind == 'delete':
+            parsed = list(delete_hosts(parsed, *args))
+        elif kind == 'plan':
+            parsed = list(OpPlan(put=args[0], delete=args[1]).apply(parsed))
+        elif kind == 'delete_addr':
+            parsed = list(delete_hosts_by_addr(parsed, *args))
+        elif kind == 'get':
+            results.append(sorted_hosts(get_hosts(parsed, *args)))
+            continue
+        elif kind == 'suffix':
+            index = NameIndex(list_hosts(parsed))
+            results.append(sorted_hosts(index.suffix(*args)))
+            continue
+        elif kind == 'list':
+            results.append(sorted_hosts(list_hosts(parsed)))
+            continue
+        results.append(None)
+    results.append(native(''.join(render(parsed))))
+    return results
+
+
+def run_hostsman(lines, ops):
+    return run_manager(HostsManager(lines), ops)
+
+
+def run_managed(lines, ops):
+    return run_manager(HostsManager(lines, managed=True), ops)
+
+
+def run_bloom(lines, ops):
+    return run_manager(HostsManager(lines, bloom=0.01), ops)
+
+
+def recoded(value):
+    ''' Strings of the other type: bytes on Python 3, unicode on Python 2.
+    '''
+    if isinstance(value, dict):
+        return type(value)((recoded(k), recoded(v))
+                           for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(recoded(item) for item in value)
+    if isinstance(value, str) and bytes is not str:
+        return value.encode('utf-8')
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def run_recoded(lines, ops):
+    ''' HostsManager on lines and operations of the other string type.
+    '''
+    return run_manager(HostsManager(recoded(lines)),
+                       [(op[0], ) + recoded(tuple(op[1:])) for op in ops])
+
+
+def write_lines(path, lines):
+    with open(path, 'wb') as f:
+        f.write(''.join(lines).encode('utf-8'))
+
+
+def read_text(path):
+    with open(path, 'rb') as f:
+        return native(f.read())
+
+
+def run_edit(lines, ops, backups=0):
+    ''' edit() of a file, one operation per edit.
+    '''
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'hosts')
+        write_lines(path, lines)
+        results = []
+        for op in ops:
+            with edit(path, backups=backups) as hostsman:
+                results.append(apply_op(hostsman, op))
+        results.append(read_text(path))
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def run_edit_backups(lines, ops):
+    return run_edit(lines, ops, backups=2)
+
+
+def run_edit_many(lines, ops, copies=3):
+    ''' edit_many() of copies of a file, one operation per edit_many().
+    '''
+    workdir = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(workdir, 'hosts%d' % copy)
+                 for copy in range(copies)]
+        for path in paths:
+            write_lines(path, lines)
+        results = []
+        for op in ops:
+            edited = edit_many(paths, [method_op(op)], workers=copies)
+            op_results = []
+            for result in edited:
+                if result['error'] is not None:
+                    raise result['error']
+                op_results.append(op_result(op, result['results'][0]))
+            results.append(op_results[0])
+            if [r for r in op_results if r != op_results[0]]:
+                raise AssertionError('copies differ: %r' % op_results)
+        texts = [read_text(path) for path in paths]
+        if [text for text in texts if text != texts[0]]:
+            raise AssertionError('copies differ: %r' % texts)
+        results.append(texts[0])
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def run_stream(lines, ops):
+    ''' edit() of a file, listed as `hostsman list --sort` lists it.
+
+    The lines are streamed from the file and their hosts sorted in runs
+    spilled to disk; they must come sorted, as the reference sorts them.
+    '''
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'hosts')
+        write_lines(path, lines)
+        results = []
+        for op in ops:
+            if op[0] == 'list':
+                with open_hosts(path) as f:
+                    hosts = sort_hosts(list_hosts(parse(f, share=False)),
+                                       STREAM_SORT_MEMORY)
+                    results.append([[native(hostname), native(hostaddr)]
+                                    for hostname, hostaddr in hosts])
+                continue
+            with edit(path) as hostsman:
+                results.append(apply_op(hostsman, op))
+        results.append(read_text(path))
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def run_sharded(lines, ops, shards=SHARDS):
+    ''' edit_sharded() of a directory of shards, one operation per edit.
+
+    The shards are written with the lines of the case as the reference
+    splits them; see shard_lines().
+    '''
+    from mete0r_hostsman.shard import edit_sharded
+    from mete0r_hostsman.shard import shard_paths
+    workdir = tempfile.mkdtemp()
+    try:
+        paths = shard_paths(workdir, shards)
+        for shard, path in enumerate(paths):
+            write_lines(path, shard_lines(lines, shard, shards))
+        results = []
+        for op in ops:
+            with edit_sharded(workdir) as hostsman:
+                results.append(apply_op(hostsman, op))
+        results.append([read_text(path) for path in paths])
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def run_store(lines, ops):
+    ''' HostsStore of an in-memory database, rendered to a file at the end.
+    '''
+    from mete0r_hostsman.store import HostsStore
+    workdir = tempfile.mkdtemp()
+    store = HostsStore(':memory:')
+    try:
+        store.import_lines(lines)
+        results = [apply_op(store, op) for op in ops]
+        path = os.path.join(workdir, 'hosts')
+        store.write(path)
+        results.append(read_text(path))
+        return results
+    finally:
+        store.close()
+        shutil.rmtree(workdir)
+
+
+# (name, run, options of run_reference() to compare with)
+ENGINES = (
+    ('functions', run_functions, {}),
+    ('hostsman', run_hostsman, {}),
+    ('managed', run_managed, {'managed': True}),
+    ('bloom', run_bloom, {}),
+    ('recoded', run_recoded, {}),
+    ('edit', run_edit, {'reread': True}),
+    ('edit_backups', run_edit_backups, {'reread': True}),
+    ('edit_many', run_edit_many, {'reread': True}),
+    ('stream', run_stream, {'reread': True}),
+    ('sharded', run_sharded, {'shards': SHARDS}),
+    ('store', run_store, {}),
+)
+
+
+def outcome(run, lines, ops, **options):
+    ''' ('ok', results) of a run, or ('error', '<exception type>: <message>').
+    '''
+    try:
+        return ('ok', run(lines, ops, **options))
+    except Exception as e:
+        return ('error', '%s: %s' % (type(e).__name__, e))
+
+
+def same(expected, actual):
+    if expected[0] == 'error' and actual[0] == 'error':
+        # the same type of error, whatever the message
+        return expected[1].split(':')[0] == actual[1].split(':')[0]
+    return expected == actual
+
+
+def engine_fails(engine, lines, ops):
+    name, run, options = engine
+    return not same(outcome(run_reference, lines, ops, **options),
+                    outcome(run, lines, ops))
+
+
+def removals(items):
+    ''' Copies of a list with chunks removed, halving the chunks.
+    '''
+    size = len(items) // 2 or len(items)
+    while size >= 1:
+        for start in range(0, len(items), size):
+            yield items[:start] + items[start + size:]
+        size //= 2
+
+
+def smaller_ops(op):
+    ''' Copies of an operation with a name or address less.
+    '''
+    for index in range(1, len(op)):
+        arg = op[index]
+        if isinstance(arg, dict):
+            for key in sorted(arg):
+                smaller = type(arg)(arg)
+                del smaller[key]
+                yield op[:index] + (smaller, ) + op[index + 1:]
+        elif isinstance(arg, (list, tuple)):
+            for i in range(len(arg)):
+                yield op[:index] + (arg[:i] + arg[i + 1:], ) + op[index + 1:]
+
+
+def candidates(lines, ops):
+    for smaller in removals(ops):
+        yield lines, smaller
+    for smaller in removals(lines):
+        yield smaller, ops
+    for i, op in enumerate(ops):
+        for smaller in smaller_ops(op):
+            yield lines, ops[:i] + [smaller] + ops[i + 1:]
+
+
+def shrink(fails, lines, ops):
+    ''' Make a failing case smaller while `fails(lines, ops)`.
+
+    Chunks of operations and of lines are removed, then names and
+    addresses from operations, until none can be without passing.
+    '''
+    lines = list(lines)
+    ops = [tuple(op) for op in ops]
+    while True:
+        for candidate in candidates(lines, ops):
+            if fails(*candidate):
+                lines, ops = candidate
+                break
+        else:
+            return lines, ops
+
+
+def select_engines(names=None):
+    if names is None:
+        return ENGINES
+    engines = [engine for engine in ENGINES if engine[0] in names]
+    unknown = set(names) - set(engine[0] for engine in engines)
+    if unknown:
+        raise ValueError('unknown engines: %s' % ', '.join(sorted(unknown)))
+    return engines
+
+
+def failing_engines(lines, ops, engines=None):
+    ''' Names of the engines whose results differ from the reference.
+    '''
+    return [engine[0] for engine in select_engines(engines)
+            if engine_fails(engine, lines, ops)]
+
+
+def fuzz(cases=200, max_lines=20, max_ops=4, seed=0, engines=None,
+         shrink_failures=True):
+    ''' Check engines on generated cases; returns the failures.
+
+    A failure is a dict with the 'engine', the 'seed' of the case, its
+    'lines' and 'ops', shrunk unless not to `shrink_failures`, and the
+    'expected' and 'actual' outcomes.
+    '''
+    engines = select_engines(engines)
+    failures = []
+    for case_seed in range(seed, seed + cases):
+        lines, ops = generate_case(case_seed, max_lines, max_ops)
+        for engine in engines:
+            if not engine_fails(engine, lines, ops):
+                continue
+
+            def fails(lines, ops):
+                return engine_fails(engine, lines, ops)
+
+            failing_lines, failing_ops = lines, ops
+            if shrink_failures:
+                failing_lines, failing_ops = shrink(fails, lines, ops)
+            name, run, options = engine
+            failures.append({
+                'engine': name,
+                'seed': case_seed,
+                'lines': failing_lines,
+                'ops': failing_ops,
+                'expected': outcome(run_reference, failing_lines,
+                                    failing_ops, **options),
+                'actual': outcome(run, failing_lines, failing_ops),
+            })
+    return failures
+
+
+def main():
+    from docopt import docopt
+    from mete0r_hostsman.cli import rest_to_docopt
+    args = docopt(rest_to_docopt(__doc__))
+
+    engines = None
+    if args['--engines']:
+        engines = args['--engines'].split(',')
+    options = {
+        'cases': int(args['--cases']),
+        'max_lines': int(args['--lines']),
+        'max_ops': int(args['--ops']),
+        'seed': int(args['--seed']),
+    }
+    failures = fuzz(engines=engines, shrink_failures=not args['--no-shrink'],
+                    **options)
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'options': options,
+        'engines': [engine[0] for engine in select_engines(engines)],
+        'failures': failures,
+    }
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            write_report(report, f)
+    else:
+        write_report(report, sys.stdout)
+    if failures:
+        raise SystemExit(1)
+
+
+def write_report(report, f):
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
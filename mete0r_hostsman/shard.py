@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+#   hostsman : Manage /etc/hosts
+#   Copyright (C) 2014 mete0r <mete0r@sarangbang.or.kr>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+''' Hosts split across the files of a directory, by a hash of their names.
+
+A shard is a hosts file of its own, e.g. an addn-hosts file of dnsmasq.
+Every name is kept in the shard of its name key, so that a lookup reads
+one shard and a change rewrites only the shards of the names it touches.
+'''
+from __future__ import with_statement
+from contextlib import contextmanager
+from itertools import chain
+from zlib import crc32
+import os
+import os.path
+import re
+
+from mete0r_hostsman import HostsManager
+from mete0r_hostsman import OpPlan
+from mete0r_hostsman import Stats
+from mete0r_hostsman import basestring
+from mete0r_hostsman import dump
+from mete0r_hostsman import name_key
+from mete0r_hostsman import replacing
+
+
+SHARDS = 16
+SHARD_NAME = re.compile(r'^hosts\.([0-9]+)$')
+
+
+def shard_of(hostname, shards):
+    ''' The shard of a name: stable across runs, platforms and cases.
+    '''
+    key = name_key(hostname)
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return (crc32(key) & 0xffffffff) % shards
+
+
+def shard_paths(directory, shards):
+    width = len(str(shards - 1))
+    return [os.path.join(directory, 'hosts.%0*d' % (width, shard))
+            for shard in range(shards)]
+
+
+def count_shards(directory):
+    ''' Number of shards in a directory: None if there is none yet.
+    '''
+    numbers = set()
+    for filename in os.listdir(directory):
+        match = SHARD_NAME.match(filename)
+        if match:
+            numbers.add(int(match.group(1)))
+    if not numbers:
+        return None
+    if numbers != set(range(len(numbers))):
+        raise ValueError('%s: missing shards' % directory)
+    return len(numbers)
+
+
+class ShardedHostsManager(object):
+    ''' Hosts of a sharded directory, as one HostsManager.
+
+    Shards are loaded when first needed. `save()` writes the shards whose
+    lines have changed since they were loaded.
+    '''
+
+    def __init__(self, directory, shards=None, managed=False, stats=None):
+        existing = count_shards(directory)
+        if existing is None:
+            existing = shards or SHARDS
+        elif shards is not None and shards != existing:
+            raise ValueError('%s: %d shards, not %d' % (directory, existing,
+                                                        shards))
+        self.directory = directory
+        self.shards = existing
+        self.paths = shard_paths(directory, existing)
+        self.managed = managed
+        self.stats = Stats() if stats is None else stats
+        self._loaded = {}
+
+    def shard(self, shard):
+        ''' The HostsManager of a shard, loaded on first use.
+        '''
+        try:
+            return self._loaded[shard][1]
+        except KeyError:
+            pass
+        lines = []
+        if os.path.exists(self.paths[shard]):
+            with open(self.paths[shard]) as f:
+                with self.stats.timing('read'):
+                    lines = list(f)
+        hostsman = HostsManager(lines, managed=self.managed, stats=self.stats)
+        self._loaded[shard] = (hostsman.snapshot().chunks, hostsman)
+        return hostsman
+
+    def all_shards(self):
+        return [self.shard(shard) for shard in range(self.shards)]
+
+    def split(self, hostnames):
+        ''' Names grouped by their shards.
+        '''
+        if isinstance(hostnames, basestring):
+            hostnames = (hostnames, )
+        by_shard = {}
+        for hostname in hostnames:
+            by_shard.setdefault(shard_of(hostname, self.shards),
+                                []).append(hostname)
+        return by_shard
+
+    def split_hosts(self, hosts):
+        by_shard = {}
+        for shard, hostnames in self.split(hosts).items():
+            by_shard[shard] = dict((hostname, hosts[hostname])
+                                   for hostname in hostnames)
+        return by_shard
+
+    def list(self):
+        return chain.from_iterable(hostsman.list()
+                                   for hostsman in self.all_shards())
+
+    __iter__ = list
+
+    def get(self, hostnames=()):
+        return chain.from_iterable(self.shard(shard).get(names)
+                                   for shard, names
+                                   in sorted(self.split(hostnames).items()))
+
+    def get_by_suffix(self, domain, include_domain=True):
+        return chain.from_iterable(
+            hostsman.get_by_suffix(domain, include_domain)
+            for hostsman in self.all_shards()
+        )
+
+    def get_by_glob(self, pattern):
+        return chain.from_iterable(hostsman.get_by_glob(pattern)
+                                   for hostsman in self.all_shards())
+
+    def get_by_regex(self, pattern):
+        return chain.from_iterable(hostsman.get_by_regex(pattern)
+                                   for hostsman in self.all_shards())
+
+    def __getitem__(self, key):
+        return self.shard(shard_of(key, self.shards))[key]
+
+    def put(self, hosts, merge=True):
+        for shard, shard_hosts in self.split_hosts(hosts).items():
+            self.shard(shard).put(shard_hosts, merge)
+
+    def __setitem__(self, hostname, hostaddr):
+        self.put({hostname: hostaddr})
+
+    def delete(self, hostnames):
+        for shard, names in self.split(hostnames).items():
+            self.shard(shard).delete(names)
+
+    __delitem__ = delete
+
+    def apply_plan(self, plan):
+        puts = self.split_hosts(plan.put)
+        deletes = self.split(plan.delete)
+        for shard in set(puts) | set(deletes):
+            self.shard(shard).apply_plan(OpPlan(put=puts.get(shard),
+                                                delete=deletes.get(shard, ())))
+
+    def delete_by_addr(self, addrs=(), networks=()):
+        return sum(hostsman.delete_by_addr(addrs, networks)
+                   for hostsman in self.all_shards())
+
+    def sync(self, hosts):
+        ''' Sync every shard with its part of the hosts; returns counts.
+        '''
+        by_shard = self.split_hosts(hosts)
+        counts = {}
+        for shard, hostsman in enumerate(self.all_shards()):
+            shard_counts = hostsman.sync(by_shard.get(shard, {}))
+            for kind, count in shard_counts.items():
+                counts[kind] = counts.get(kind, 0) + count
+        return counts
+
+    def changed(self):
+        ''' Shards whose lines have changed since they were loaded.
+        '''
+        return sorted(shard for shard, (chunks, hostsman)
+                      in self._loaded.items()
+                      if hostsman.snapshot().chunks != chunks)
+
+    def save(self):
+        ''' Write changed and missing shards, each replaced once written.
+
+        Shards replaced keep their mode and owner. Returns the paths written.
+        '''
+        written = []
+        missing = [shard for shard in range(self.shards)
+                   if not os.path.exists(self.paths[shard])]
+        for shard in sorted(set(self.changed()) | set(missing)):
+            hostsman = self.shard(shard)
+            path = self.paths[shard]
+            with replacing(path) as f:
+                dump(hostsman, f)
+            self._loaded[shard] = (hostsman.snapshot().chunks, hostsman)
+            written.append(path)
+        return written
+
+
+@contextmanager
+def edit_sharded(directory, managed=False, stats=None, shards=None):
+    ''' Edit a sharded directory, writing the changed shards when done.
+
+    The directory is created if missing.
+    '''
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    elif not os.path.isdir(directory):
+        raise ValueError('%s: not a directory' % directory)
+    hostsman = ShardedHostsManager(directory, shards=shards, managed=managed,
+                                   stats=stats)
+    yield hostsman
+    hostsman.save()
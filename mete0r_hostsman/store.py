@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+#
+#   hostsman : Manage /etc/hosts
+#   Copyright (C) 2014 mete0r <mete0r@sarangbang.or.kr>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+''' Hosts kept in a SQLite database, with the hosts file rendered from it.
+
+Lines of a hosts file are rows of `lines`, in the order of their position,
+and the names of address lines are rows of `names`. Names are indexed by
+their name key and lines by their address key, so that get, put and delete
+only touch the rows of their names and addresses.
+
+A hosts file is imported through parse() and rendered through render().
+Every change counts a new generation, so that a file is rendered again
+only if the hosts have changed since it last was.
+'''
+from __future__ import with_statement
+import os.path
+import sqlite3
+
+from mete0r_hostsman import Stats
+from mete0r_hostsman import addr_key
+from mete0r_hostsman import addr_ranges
+from mete0r_hostsman import basestring
+from mete0r_hostsman import dump
+from mete0r_hostsman import name_key
+from mete0r_hostsman import new_hostaddr_lines
+from mete0r_hostsman import parse
+from mete0r_hostsman import render
+from mete0r_hostsman import replacing
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS lines (
+    position INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    text TEXT,
+    addr TEXT,
+    addr_key BLOB
+);
+CREATE INDEX IF NOT EXISTS lines_addr_key ON lines (addr_key, position);
+CREATE TABLE IF NOT EXISTS names (
+    line INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    PRIMARY KEY (line, seq)
+);
+CREATE INDEX IF NOT EXISTS names_name_key ON names (name_key);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+'''
+
+IMPORT_BATCH = 10000
+
+
+def native(value):
+    ''' A str: text on Python 3, UTF-8 bytes on Python 2, as SQLite gives.
+    '''
+    if bytes is str:
+        if isinstance(value, bytes):
+            return value
+        return value.encode('utf-8')
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def store_addr_key(hostaddr):
+    ''' addr_key() of an address; the text of anything else, apart.
+    '''
+    key = addr_key(hostaddr)
+    if key is None:
+        text = hostaddr.strip()
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        key = b'\x00' + text
+    return sqlite3.Binary(key)
+
+
+class HostsStore(object):
+    ''' Hosts of a SQLite database, as a HostsManager.
+
+    Lines left without names are dropped, and names put to an address go
+    to its first line, as with put_hosts() and delete_hosts().
+    '''
+
+    def __init__(self, path, stats=None):
+        self.path = path
+        self.stats = Stats() if stats is None else stats
+        self.db = sqlite3.connect(path)
+        if bytes is str:
+            self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def meta(self, key, default=0):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key, )).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) '
+                        'VALUES (?, ?)', (key, value))
+
+    def generation(self):
+        return self.meta('generation')
+
+    def changed(self):
+        self.set_meta('generation', self.generation() + 1)
+
+    def import_lines(self, lines):
+        ''' Replace the hosts by the lines of a hosts file.
+        '''
+        with self.stats.timing('import'):
+            with self.db:
+                self.db.execute('DELETE FROM names')
+                self.db.execute('DELETE FROM lines')
+                nameless = 0
+                line_rows = []
+                name_rows = []
+                for line in parse(native(text) for text in lines):
+                    line_rows.append(self.line_row(line))
+                    if line['type'] == 'HOSTADDR':
+                        name_rows.extend(self.name_rows(line['line_no'],
+                                                        line['names']))
+                        if not line['names']:
+                            nameless += 1
+                    if len(line_rows) >= IMPORT_BATCH:
+                        self.insert_rows(line_rows, name_rows)
+                        line_rows = []
+                        name_rows = []
+                self.insert_rows(line_rows, name_rows)
+                # dropped by the next put or delete
+                self.set_meta('nameless', nameless)
+                self.changed()
+
+    def line_row(self, line):
+        if line['type'] == 'HOSTADDR':
+            return (line['line_no'], line['type'], line.get('line'),
+                    line['addr'], store_addr_key(line['addr']))
+        return (line['line_no'], line['type'], line['line'], None, None)
+
+    def name_rows(self, position, names):
+        return [(position, seq, hostname, name_key(hostname))
+                for seq, hostname in enumerate(names)]
+
+    def insert_rows(self, line_rows, name_rows):
+        self.db.executemany('INSERT INTO lines (position, type, text, addr, '
+                            'addr_key) VALUES (?, ?, ?, ?, ?)', line_rows)
+        self.db.executemany('INSERT INTO names (line, seq, name, name_key) '
+                            'VALUES (?, ?, ?, ?)', name_rows)
+
+    def lines(self):
+        ''' Lines as parsed, in order: modified lines without their text.
+        '''
+        names = self.db.execute(
+            'SELECT line, name FROM names WHERE line IN '
+            '(SELECT position FROM lines WHERE text IS NULL) '
+            'ORDER BY line, seq'
+        )
+        pending = next(names, None)
+        for position, type, text, addr in self.db.execute(
+                'SELECT position, type, text, addr FROM lines '
+                'ORDER BY position'):
+            if text is not None:
+                yield {'type': type, 'line': text}
+                continue
+            line_names = []
+            while pending is not None and pending[0] == position:
+                line_names.append(pending[1])
+                pending = next(names, None)
+            yield {'type': type, 'addr': addr, 'names': tuple(line_names)}
+
+    def render(self):
+        return render(self.lines())
+
+    def write(self, path):
+        ''' Render the hosts to a file, unless it is rendered already.
+
+        The file is rendered again only if the hosts have changed since it
+        last was, and replaced once written. Returns whether it was.
+        '''
+        rendered = 'rendered:' + os.path.abspath(path)
+        generation = self.generation()
+        if os.path.exists(path) and self.meta(rendered, None) == generation:
+            return False
+        with replacing(path) as f:
+            dump(self, f)
+        with self.db:
+            self.set_meta(rendered, generation)
+        return True
+
+    def list(self):
+        return iter(self.db.execute(
+            'SELECT n.name, l.addr FROM names n '
+            'JOIN lines l ON l.position = n.line ORDER BY n.line, n.seq'
+        ))
+
+    __iter__ = list
+
+    def get(self, hostnames=()):
+        if isinstance(hostnames, basestring):
+            hostnames = (hostnames, )
+        rows = []
+        for key in set(name_key(native(hostname)) for hostname in hostnames):
+            rows.extend(self.db.execute(
+                'SELECT n.line, n.seq, n.name, l.addr FROM names n '
+                'JOIN lines l ON l.position = n.line WHERE n.name_key = ?',
+                (key, )
+            ))
+        rows.sort()
+        return iter([(hostname, hostaddr)
+                     for line, seq, hostname, hostaddr in rows])
+
+    def get_by_suffix(self, domain, include_domain=True):
+        ''' Names under a domain: a scan of the names, unlike get().
+        '''
+        key = name_key(native(domain).strip('.'))
+        pattern = '%.' + key.replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_')
+        return iter(self.db.execute(
+            'SELECT n.name, l.addr FROM names n '
+            'JOIN lines l ON l.position = n.line '
+            'WHERE (n.name_key = ? AND ?) '
+            "OR n.name_key LIKE ? ESCAPE '\\' ORDER BY n.line, n.seq",
+            (key, bool(include_domain), pattern)
+        ))
+
+    def __getitem__(self, key):
+        for hostname, hostaddr in self.get(key):
+            if hostname == native(key):
+                return hostaddr
+        raise KeyError(key)
+
+    def put(self, hosts, merge=True):
+        ''' Put names to their addresses; see HostsManager.put().
+        '''
+        with self.stats.timing('put'):
+            with self.db:
+                self._put(hosts, merge)
+
+    def __setitem__(self, hostname, hostaddr):
+        self.put({hostname: hostaddr})
+
+    def delete(self, hostnames):
+        with self.stats.timing('delete'):
+            with self.db:
+                self._delete(hostnames)
+
+    __delitem__ = delete
+
+    def apply_plan(self, plan):
+        with self.stats.timing('apply_plan'):
+            with self.db:
+                if plan.delete:
+                    self._delete(plan.delete)
+                self._put(plan.put)
+
+    def delete_by_addr(self, addrs=(), networks=()):
+        ''' Drop lines of the addresses or in the networks; returns how many.
+        '''
+        positions = set()
+        for lowest, highest in addr_ranges(addrs, networks):
+            positions.update(position for position, in self.db.execute(
+                'SELECT position FROM lines WHERE addr_key BETWEEN ? AND ?',
+                (sqlite3.Binary(lowest), sqlite3.Binary(highest))
+            ))
+        with self.db:
+            self.drop_lines(positions)
+            if positions:
+                self.changed()
+        return len(positions)
+
+    def _put(self, hosts, merge=True):
+        execute = self.db.execute
+        touched = set()
+        unplaced = []
+        for hostname, hostaddr in hosts.items():
+            hostname = native(hostname)
+            hostaddr = native(hostaddr)
+            key = name_key(hostname)
+            target = None
+            if merge:
+                row = execute('SELECT position FROM lines WHERE addr_key = ? '
+                              'ORDER BY position LIMIT 1',
+                              (store_addr_key(hostaddr), )).fetchone()
+                if row is not None:
+                    target = row[0]
+            touched.update(self.remove_name(key, keep=target))
+            if target is None:
+                unplaced.append((hostname, hostaddr))
+            elif not execute('SELECT 1 FROM names '
+                             'WHERE line = ? AND name_key = ?',
+                             (target, key)).fetchone():
+                seq = execute('SELECT COALESCE(MAX(seq) + 1, 0) FROM names '
+                              'WHERE line = ?', (target, )).fetchone()[0]
+                execute('INSERT INTO names (line, seq, name, name_key) '
+                        'VALUES (?, ?, ?, ?)', (target, seq, hostname, key))
+                touched.add(target)
+
+        position = execute('SELECT COALESCE(MAX(position), 0) '
+                           'FROM lines').fetchone()[0]
+        line_rows = []
+        name_rows = []
+        for line in new_hostaddr_lines(unplaced):
+            position += 1
+            line_rows.append(self.line_row(dict(line, line_no=position)))
+            name_rows.extend(self.name_rows(position, line['names']))
+        self.insert_rows(line_rows, name_rows)
+
+        dropped = self.drop_nameless(touched)
+        if touched or line_rows or dropped:
+            self.changed()
+
+    def _delete(self, hostnames):
+        if isinstance(hostnames, basestring):
+            hostnames = (hostnames, )
+        touched = set()
+        for hostname in hostnames:
+            touched.update(self.remove_name(name_key(native(hostname))))
+        dropped = self.drop_nameless(touched)
+        if touched or dropped:
+            self.changed()
+
+    def remove_name(self, key, keep=None):
+        ''' Remove a name from all lines but `keep`; returns their positions.
+        '''
+        positions = [line for line, in self.db.execute(
+            'SELECT DISTINCT line FROM names WHERE name_key = ?', (key, )
+        ) if line != keep]
+        if positions:
+            self.db.execute('DELETE FROM names '
+                            'WHERE name_key = ? AND line != ?',
+                            (key, -1 if keep is None else keep))
+        return positions
+
+    def drop_nameless(self, touched):
+        ''' Mark modified lines, and drop those left without names.
+
+        Address lines imported without names are dropped, too, once.
+        '''
+        execute = self.db.execute
+        self.db.executemany('UPDATE lines SET text = NULL WHERE position = ?',
+                            [(position, ) for position in touched])
+        nameless = [position for position in touched
+                    if not execute('SELECT 1 FROM names WHERE line = ? '
+                                   'LIMIT 1', (position, )).fetchone()]
+        self.drop_lines(nameless)
+        dropped = len(nameless)
+        if self.meta('nameless'):
+            dropped += execute(
+                "DELETE FROM lines WHERE type = 'HOSTADDR' AND NOT EXISTS "
+                '(SELECT 1 FROM names WHERE names.line = lines.position)'
+            ).rowcount
+            self.set_meta('nameless', 0)
+        return dropped
+
+    def drop_lines(self, positions):
+        rows = [(position, ) for position in positions]
+        self.db.executemany('DELETE FROM names WHERE line = ?', rows)
+        self.db.executemany('DELETE FROM lines WHERE position = ?', rows)
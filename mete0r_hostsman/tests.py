@@ -17,7 +17,9 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from unittest import TestCase
+from unittest import TestSuite
 from unittest import makeSuite
+import json
 # from pprint import pprint
 
 from mete0r_hostsman import parse
@@ -27,7 +29,43 @@ from mete0r_hostsman import get_hosts
 from mete0r_hostsman import get_hosts_by_predicate
 from mete0r_hostsman import put_hosts
 from mete0r_hostsman import delete_hosts
+from mete0r_hostsman import sync_hosts
+from mete0r_hostsman import check_hosts
+from mete0r_hostsman import decode_hosts
+from mete0r_hostsman import managed_lines
+from mete0r_hostsman import apply_managed
 from mete0r_hostsman import HostsManager
+from mete0r_hostsman import OpPlan
+from mete0r_hostsman import NameIndex
+from mete0r_hostsman import AddressIndex
+from mete0r_hostsman import addr_key
+from mete0r_hostsman import predicate_hostaddr
+from mete0r_hostsman import name_key
+from mete0r_hostsman import rechunk
+from mete0r_hostsman import network_range
+from mete0r_hostsman import delete_hosts_by_addr
+from mete0r_hostsman import predicate_glob
+from mete0r_hostsman import predicate_regex
+
+
+def without_keys(lines):
+    ''' Lines without the keys of their address and names, if they have
+    any: those are checked first.
+    '''
+    stripped = []
+    for line in lines:
+        if line['type'] == 'HOSTADDR':
+            line = dict(line)
+            keys = line.pop('keys', None)
+            if keys not in (None, tuple(map(name_key, line['names']))):
+                raise AssertionError('keys of %r' % line)
+            key = line.pop('addr_key', None)
+            if key not in (None, addr_key(line['addr'])):
+                raise AssertionError('addr_key of %r' % line)
+        stripped.append(line)
+    if isinstance(lines, tuple):
+        return tuple(stripped)
+    return stripped
 
 
 class HostsManTest(TestCase):
@@ -38,7 +76,7 @@ class HostsManTest(TestCase):
         parsed = parse([
             '127.0.0.1\tlocalhost\n',
             '# managed by mete0r.hostsman\n',
-            '127.0.1.1\ta.example.tld example.tld\n',
+            '127.0.1.1\tA.example.tld example.tld\n',
             '127.0.1.2\tb.example.tld\n',
             '127.0.1.2\tc.example.tld\n',
         ])
@@ -55,11 +93,11 @@ class HostsManTest(TestCase):
             'line_no': 2,
             'type': 'COMMENT',
         }, {
-            'line': '127.0.1.1\ta.example.tld example.tld\n',
+            'line': '127.0.1.1\tA.example.tld example.tld\n',
             'line_no': 3,
             'type': 'HOSTADDR',
             'addr': '127.0.1.1',
-            'names': ('a.example.tld', 'example.tld'),
+            'names': ('A.example.tld', 'example.tld'),
         }, {
             'line': '127.0.1.2\tb.example.tld\n',
             'line_no': 4,
@@ -74,6 +112,64 @@ class HostsManTest(TestCase):
             'names': ('c.example.tld', ),
         }], parsed)
 
+    def test_parse_shares_repeated_strings(self):
+        parsed = list(parse([
+            '0.0.0.0\ta.example.tld b.example.tld\n',
+            '0.0.0.0\ta.example.tld\n',
+        ]))
+        self.assertTrue(parsed[0]['addr'] is parsed[1]['addr'])
+        self.assertTrue(parsed[0]['names'][0] is parsed[1]['names'][0])
+
+    def test_parse_without_sharing(self):
+        lines = [
+            '0.0.0.0\ta.example.tld b.example.tld\n',
+            '0.0.0.0\ta.example.tld\n',
+        ]
+        self.assertEquals(list(parse(lines)), list(parse(lines, share=False)))
+
+    def test_line_keys(self):
+        from mete0r_hostsman import line_addr_key
+        from mete0r_hostsman import line_keys
+        parsed = list(parse([
+            '127.0.0.1\tlocalhost\n',
+            '::1\tA.example.tld example.tld\n',
+        ]))
+        self.assertTrue('keys' not in parsed[0])
+        self.assertTrue('addr_key' not in parsed[0])
+        # names all lower case are their own keys
+        keys = line_keys(parsed[0])
+        self.assertTrue(keys is parsed[0]['names'])
+        self.assertTrue(line_keys(parsed[0]) is keys)
+        self.assertEquals(('a.example.tld', 'example.tld'),
+                          line_keys(parsed[1]))
+        self.assertTrue(line_keys(parsed[1]) is parsed[1]['keys'])
+        self.assertEquals(addr_key('::1'), line_addr_key(parsed[1]))
+        self.assertEquals(addr_key('::1'), parsed[1]['addr_key'])
+
+    def test_sort_hosts(self):
+        import random
+        from mete0r_hostsman import Stats
+        from mete0r_hostsman import sort_hosts
+        rng = random.Random(0)
+        hosts = [('host%d.example.tld' % rng.randint(0, 1000),
+                  '10.0.%d.%d' % (rng.randint(0, 255), rng.randint(0, 255)))
+                 for _ in range(5000)]
+        stats = Stats()
+        self.assertEquals(sorted(hosts),
+                          list(sort_hosts(iter(hosts), 10000, stats)))
+        self.assertTrue(stats.counters['sort_runs'] > 10)
+        stats = Stats()
+        self.assertEquals(sorted(hosts), list(sort_hosts(hosts, stats=stats)))
+        self.assertEquals(1, stats.counters['sort_runs'])
+        self.assertEquals([], list(sort_hosts([], 1)))
+        binary = [(b'b.tld', b'10.0.0.1'), (b'a.tld', b'10.0.0.2')]
+        self.assertEquals(sorted(binary), list(sort_hosts(binary, 1)))
+
+    def test_name_key(self):
+        self.assertEquals('example.tld', name_key('Example.TLD'))
+        hostname = 'a.example.tld'
+        self.assertTrue(name_key(hostname) is hostname)
+
     def test_render(self):
         parsed = parse([
             '127.0.0.1\tlocalhost\n',
@@ -87,6 +183,47 @@ class HostsManTest(TestCase):
             '127.0.1.1\texample.tld\n',
             ''.join(rendered))
 
+    def test_render_keeps_unmodified_lines(self):
+        parsed = parse([
+            '127.0.0.1   localhost\n',
+            '127.0.1.1 a.example.tld  example.tld\n',
+            '127.0.1.2\tb.example.tld',
+        ])
+        parsed = put_hosts(parsed, {
+            'example.tld': '127.0.1.3',
+        })
+        self.assertEquals(
+            '127.0.0.1   localhost\n'
+            '127.0.1.1\ta.example.tld\n'
+            '127.0.1.2\tb.example.tld\n'
+            '127.0.1.3\texample.tld\n',
+            ''.join(render(parsed)))
+
+        # CRLF newlines of unmodified lines are kept
+        parsed = delete_hosts(parse(['10.0.0.1\ta.tld\r\n',
+                                     '10.0.0.2\tb.tld\r\n']), ['b.tld'])
+        self.assertEquals('10.0.0.1\ta.tld\r\n', ''.join(render(parsed)))
+
+    def test_dump(self):
+        from StringIO import StringIO
+        from mete0r_hostsman import dump
+
+        class File(StringIO):
+            writes = 0
+
+            def write(self, s):
+                self.writes += 1
+                StringIO.write(self, s)
+
+        lines = ['127.0.1.%d\texample%d.tld\n' % (i, i) for i in range(100)]
+        hostsman = HostsManager(lines)
+        f = File()
+        dump(hostsman, f, buffer_size=1000)
+        self.assertEquals(''.join(lines), f.getvalue())
+        self.assertEquals(3, f.writes)
+        self.assertEquals(len(f.getvalue()),
+                          hostsman.stats.counters['bytes_written'])
+
     def test_list_hosts(self):
         parsed = parse([
             '127.0.0.1\tlocalhost\n',
@@ -141,6 +278,92 @@ class HostsManTest(TestCase):
         }, dict(get_hosts_by_predicate(parsed, lambda hostname, hostaddr:
                                        hostname != 'localhost')))
 
+    def test_predicate_glob(self):
+        predicate = predicate_glob('*.Example.tld')
+        self.assertTrue(predicate('a.example.TLD', '127.0.0.1'))
+        self.assertFalse(predicate('example.tld', '127.0.0.1'))
+
+    def test_predicate_regex(self):
+        predicate = predicate_regex('^[ab]\\.example')
+        self.assertTrue(predicate('A.example.tld', '127.0.0.1'))
+        self.assertFalse(predicate('c.example.tld', '127.0.0.1'))
+
+    def test_name_index_suffix(self):
+        index = NameIndex([
+            ('localhost', '127.0.0.1'),
+            ('example.tld', '127.0.1.1'),
+            ('a.Example.tld', '127.0.1.1'),
+            ('b.a.example.tld', '127.0.1.2'),
+            ('notexample.tld', '127.0.1.3'),
+            ('example.tld.other', '127.0.1.4'),
+            ('example-a.tld', '127.0.1.5'),
+        ])
+        self.assertEquals([
+            ('example.tld', '127.0.1.1'),
+            ('a.Example.tld', '127.0.1.1'),
+            ('b.a.example.tld', '127.0.1.2'),
+        ], list(index.suffix('example.tld')))
+        self.assertEquals([
+            ('a.Example.tld', '127.0.1.1'),
+            ('b.a.example.tld', '127.0.1.2'),
+        ], list(index.suffix('.EXAMPLE.tld.', include_domain=False)))
+        self.assertEquals([], list(index.suffix('missing.tld')))
+
+    def test_addr_key(self):
+        self.assertEquals(b'\x04\x7f\x00\x00\x01', addr_key('127.0.0.1'))
+        self.assertEquals(b'\x06' + b'\x00' * 15 + b'\x01', addr_key('::1'))
+        self.assertEquals(None, addr_key('localhost'))
+        self.assertTrue(addr_key('255.255.255.255') < addr_key('::'))
+        self.assertEquals(addr_key('::1'), addr_key('0:0:0:0:0:0:0:1'))
+        self.assertEquals(addr_key('fe80::1%eth0'), addr_key('fe80:0::1%eth0'))
+        self.assertNotEquals(addr_key('fe80::1%eth0'), addr_key('fe80::1'))
+        self.assertNotEquals(addr_key('fe80::1%eth0'),
+                             addr_key('fe80::1%eth1'))
+        self.assertEquals(None, addr_key('127.0.0.1%eth0'))
+        self.assertEquals(None, addr_key('fe80::1%'))
+
+    def test_predicate_hostaddr(self):
+        predicate = predicate_hostaddr(['::1', ' unknown '])
+        self.assertTrue(predicate('localhost', '0:0::1'))
+        self.assertTrue(predicate('localhost', 'unknown'))
+        self.assertFalse(predicate('localhost', '::2'))
+
+    def test_network_range(self):
+        self.assertEquals((addr_key('10.4.0.0'), addr_key('10.4.255.255')),
+                          network_range('10.4.1.2/16'))
+        self.assertEquals((addr_key('fe80::'),
+                           addr_key('fe80::ffff:ffff:ffff:ffff')),
+                          network_range('fe80::/64'))
+        self.assertEquals((addr_key('10.0.0.1'), addr_key('10.0.0.1')),
+                          network_range('10.0.0.1'))
+        self.assertRaises(ValueError, network_range, '10.0.0.0/33')
+        self.assertRaises(ValueError, network_range, 'example.tld/8')
+        self.assertRaises(ValueError, network_range, '10.0.0.0/x')
+
+    def test_address_index(self):
+        index = AddressIndex(parse([
+            '10.4.0.1\ta.example.tld\n',
+            '# comment\n',
+            '::1\tlocalhost\n',
+            '10.5.0.1\tb.example.tld\n',
+            '10.4.255.1\tc.example.tld\n',
+            '10.4.0.1\td.example.tld\n',
+        ]))
+        self.assertEquals([0, 4, 5], index.find(networks='10.4.0.0/16'))
+        self.assertEquals([0, 2, 5], index.find(['10.4.0.1', '::1']))
+        self.assertEquals([], index.find('10.6.0.1'))
+        self.assertEquals([2], index.find('0::1'))
+        self.assertRaises(ValueError, index.find, 'example.tld')
+
+    def test_delete_hosts_by_addr(self):
+        parsed = delete_hosts_by_addr(parse([
+            '10.4.0.1\ta.example.tld\n',
+            '10.5.0.1\tb.example.tld\n',
+            '10.4.255.1\tc.example.tld\n',
+        ]), networks=['10.4.0.0/16'])
+        self.assertEquals('10.5.0.1\tb.example.tld\n',
+                          ''.join(render(parsed)))
+
     def test_put_hosts(self):
         parsed = parse([
             '127.0.0.1\tlocalhost\n'
@@ -149,9 +372,8 @@ class HostsManTest(TestCase):
             'dev.example.tld': '127.0.0.1',
             'example.tld': '127.0.1.1'
         })
-        parsed = list(parsed)
+        parsed = without_keys(parsed)
         self.assertEquals([{
-            'line': '127.0.0.1\tlocalhost\n',
             'line_no': 1,
             'type': 'HOSTADDR',
             'addr': '127.0.0.1',
@@ -162,6 +384,28 @@ class HostsManTest(TestCase):
             'names': ('example.tld', ),
         }], parsed)
 
+    def test_put_hosts_matches_equivalent_addresses(self):
+        parsed = parse([
+            '::1\tlocalhost\n',
+            'fe80::1%eth0\tlink.example.tld\n',
+        ])
+        parsed = put_hosts(parsed, {
+            'localhost': '0:0:0:0:0:0:0:1',
+            'ip6-localhost': '0::1',
+            'link.example.tld': 'fe80:0::1%eth0',
+            'a.example.tld': 'fe80::2',
+            'b.example.tld': 'fe80:0::2',
+        })
+        self.assertEquals(
+            '::1\tlocalhost ip6-localhost\n'
+            'fe80::1%eth0\tlink.example.tld\n',
+            ''.join(render(list(parsed)[:2])))
+        parsed = put_hosts(parse([]), {
+            'a.example.tld': 'fe80::2',
+            'b.example.tld': 'fe80:0::2',
+        })
+        self.assertEquals(1, len(list(parsed)))
+
     def test_put_hosts_handles_multiple_matching_address_lines(self):
         parsed = parse([
             '127.0.2.1\tfoo.example.tld\n',
@@ -170,9 +414,8 @@ class HostsManTest(TestCase):
         parsed = put_hosts(parsed, {
             'baz.example.tld': '127.0.2.1'
         })
-        parsed = list(parsed)
+        parsed = without_keys(parsed)
         self.assertEquals([{
-            'line': '127.0.2.1\tfoo.example.tld\n',
             'line_no': 1,
             'type': 'HOSTADDR',
             'addr': '127.0.2.1',
@@ -185,6 +428,13 @@ class HostsManTest(TestCase):
             'names': ('bar.example.tld',),
         }], parsed)
 
+    def test_delete_hosts_ignores_case(self):
+        parsed = delete_hosts(parse([
+            '127.0.1.1\tA.Example.tld example.tld\n',
+        ]), ['a.example.TLD', 'b.example.tld'])
+        self.assertEquals([('example.tld', )],
+                          [line['names'] for line in parsed])
+
     def test_delete_hosts(self):
         parsed = parse([
             '127.0.0.1\tlocalhost\n',
@@ -197,7 +447,7 @@ class HostsManTest(TestCase):
             'example.tld',
             'b.example.tld'
         ])
-        parsed = list(parsed)
+        parsed = without_keys(parsed)
         self.assertEquals([{
             'line': '127.0.0.1\tlocalhost\n',
             'line_no': 1,
@@ -209,7 +459,6 @@ class HostsManTest(TestCase):
             'line_no': 2,
             'type': 'COMMENT',
         }, {
-            'line': '127.0.1.1\ta.example.tld example.tld\n',
             'line_no': 3,
             'type': 'HOSTADDR',
             'addr': '127.0.1.1',
@@ -222,13 +471,12 @@ class HostsManTest(TestCase):
             'names': ('c.example.tld', ),
         }], parsed)
         parsed = delete_hosts(parsed, 'localhost')
-        parsed = list(parsed)
+        parsed = without_keys(parsed)
         self.assertEquals([{
             'line': '# managed by mete0r.hostsman\n',
             'line_no': 2,
             'type': 'COMMENT',
         }, {
-            'line': '127.0.1.1\ta.example.tld example.tld\n',
             'line_no': 3,
             'type': 'HOSTADDR',
             'addr': '127.0.1.1',
@@ -241,6 +489,123 @@ class HostsManTest(TestCase):
             'names': ('c.example.tld', ),
         }], parsed)
 
+    def test_sync_hosts(self):
+        parsed = parse([
+            '127.0.0.1\tlocalhost\n',
+            '# managed by mete0r.hostsman\n',
+            '127.0.1.1\ta.example.tld example.tld\n',
+            '127.0.1.2\tb.example.tld\n',
+            '127.0.1.2\tc.example.tld\n',
+        ])
+        counts = {}
+        parsed = sync_hosts(parsed, {
+            'localhost': '127.0.0.1',
+            'A.example.tld': '127.0.1.1',
+            'b.example.tld': '127.0.1.3',
+            'd.example.tld': '127.0.1.3',
+        }, counts)
+        parsed = without_keys(parsed)
+        self.assertEquals([{
+            'line': '127.0.0.1\tlocalhost\n',
+            'line_no': 1,
+            'type': 'HOSTADDR',
+            'addr': '127.0.0.1',
+            'names': ('localhost', ),
+        }, {
+            'line': '# managed by mete0r.hostsman\n',
+            'line_no': 2,
+            'type': 'COMMENT',
+        }, {
+            'line_no': 3,
+            'type': 'HOSTADDR',
+            'addr': '127.0.1.1',
+            'names': ('a.example.tld', ),
+        }, {
+            'type': 'HOSTADDR',
+            'addr': '127.0.1.3',
+            'names': ('b.example.tld', 'd.example.tld'),
+        }], [dict(line, names=tuple(sorted(line['names'])))
+             if 'names' in line else line
+             for line in parsed])
+        self.assertEquals({
+            'added': 1,
+            'updated': 1,
+            'deleted': 2,
+            'unchanged': 2,
+        }, counts)
+
+    def test_sync_hosts_leaves_matching_lines_untouched(self):
+        parsed = list(parse([
+            '127.0.0.1\tlocalhost\n',
+            '127.0.1.1\texample.tld\n',
+        ]))
+        synced = list(sync_hosts(parsed, {
+            'localhost': '127.0.0.1',
+            'example.tld': '127.0.1.1',
+        }))
+        self.assertEquals(len(parsed), len(synced))
+        for line, synced_line in zip(parsed, synced):
+            self.assertTrue(line is synced_line)
+
+    def test_managed_lines(self):
+        parsed = parse([
+            '127.0.0.1\tlocalhost\n',
+            '# BEGIN managed by mete0r.hostsman\n',
+            '127.0.1.1\texample.tld\n',
+            '# END managed by mete0r.hostsman\n',
+            '127.0.1.2\tb.example.tld\n',
+        ])
+        self.assertEquals({
+            'example.tld': '127.0.1.1',
+        }, dict(list_hosts(managed_lines(parsed))))
+
+    def test_apply_managed(self):
+        parsed = parse([
+            '127.0.0.1\tlocalhost example.tld\n',
+            '# BEGIN managed by mete0r.hostsman\n',
+            '127.0.1.1\texample.tld\n',
+            '# END managed by mete0r.hostsman\n',
+            '127.0.1.2\tb.example.tld\n',
+        ])
+        parsed = apply_managed(parsed, put_hosts, {
+            'example.tld': '127.0.1.2',
+        })
+        self.assertEquals(
+            '127.0.0.1\tlocalhost example.tld\n'
+            '# BEGIN managed by mete0r.hostsman\n'
+            '127.0.1.2\texample.tld\n'
+            '# END managed by mete0r.hostsman\n'
+            '127.0.1.2\tb.example.tld\n',
+            ''.join(render(parsed)))
+
+    def test_apply_managed_appends_new_section(self):
+        parsed = list(parse([
+            '127.0.0.1\tlocalhost\n',
+        ]))
+        self.assertEquals(
+            '127.0.0.1\tlocalhost\n',
+            ''.join(render(apply_managed(parsed, delete_hosts,
+                                         'localhost'))))
+        self.assertEquals(
+            '127.0.0.1\tlocalhost\n'
+            '# BEGIN managed by mete0r.hostsman\n'
+            '127.0.0.1\texample.tld\n'
+            '# END managed by mete0r.hostsman\n',
+            ''.join(render(apply_managed(parsed, put_hosts, {
+                'example.tld': '127.0.0.1',
+            }))))
+
+    def test_rechunk(self):
+        lines = [{'type': 'COMMENT', 'line': '# %d\n' % i} for i in range(7)]
+        chunks = rechunk((), lines, size=2)
+        self.assertEquals([2, 2, 2, 1], [len(chunk) for chunk in chunks])
+        changed = lines[:3] + [dict(lines[3])] + lines[4:] + [lines[0]]
+        new_chunks = rechunk(chunks, changed, size=2)
+        self.assertEquals(changed, [line for chunk in new_chunks
+                                    for line in chunk])
+        self.assertTrue(new_chunks[0] is chunks[0])
+        self.assertTrue(new_chunks[2] is chunks[2])
+
     def test_hostmanager_init(self):
         hostsman = HostsManager([
             '127.0.0.1\tlocalhost\n',
@@ -277,7 +642,7 @@ class HostsManTest(TestCase):
             'type': 'HOSTADDR',
             'addr': '127.0.1.2',
             'names': ('c.example.tld', ),
-        }), hostsman.parsed)
+        }), without_keys(hostsman.parsed))
 
     def test_hostmanager_list(self):
         hostsman = HostsManager([
@@ -340,7 +705,6 @@ class HostsManTest(TestCase):
             'example.tld': '127.0.1.1'
         })
         self.assertEquals(({
-            'line': '127.0.0.1\tlocalhost\n',
             'line_no': 1,
             'type': 'HOSTADDR',
             'addr': '127.0.0.1',
@@ -349,7 +713,7 @@ class HostsManTest(TestCase):
             'type': 'HOSTADDR',
             'addr': '127.0.1.1',
             'names': ('example.tld', ),
-        }), hostsman.parsed)
+        }), without_keys(hostsman.parsed))
 
     def test_hostmanager_setitem(self):
         hostsman = HostsManager([
@@ -358,7 +722,6 @@ class HostsManTest(TestCase):
         hostsman['dev.example.tld'] = '127.0.0.1'
         hostsman['example.tld'] = '127.0.1.1'
         self.assertEquals(({
-            'line': '127.0.0.1\tlocalhost\n',
             'line_no': 1,
             'type': 'HOSTADDR',
             'addr': '127.0.0.1',
@@ -367,7 +730,7 @@ class HostsManTest(TestCase):
             'type': 'HOSTADDR',
             'addr': '127.0.1.1',
             'names': ('example.tld', ),
-        }), hostsman.parsed)
+        }), without_keys(hostsman.parsed))
 
     def test_hostmanager_delete(self):
         hostsman = HostsManager([
@@ -392,7 +755,6 @@ class HostsManTest(TestCase):
             'line_no': 2,
             'type': 'COMMENT',
         }, {
-            'line': '127.0.1.1\ta.example.tld example.tld\n',
             'line_no': 3,
             'type': 'HOSTADDR',
             'addr': '127.0.1.1',
@@ -403,7 +765,7 @@ class HostsManTest(TestCase):
             'type': 'HOSTADDR',
             'addr': '127.0.1.2',
             'names': ('c.example.tld', ),
-        }), hostsman.parsed)
+        }), without_keys(hostsman.parsed))
 
     def test_hostmanager_delitem(self):
         hostsman = HostsManager([
@@ -426,7 +788,6 @@ class HostsManTest(TestCase):
             'line_no': 2,
             'type': 'COMMENT',
         }, {
-            'line': '127.0.1.1\ta.example.tld example.tld\n',
             'line_no': 3,
             'type': 'HOSTADDR',
             'addr': '127.0.1.1',
@@ -437,8 +798,1125 @@ class HostsManTest(TestCase):
             'type': 'HOSTADDR',
             'addr': '127.0.1.2',
             'names': ('c.example.tld', ),
-        }), hostsman.parsed)
+        }), without_keys(hostsman.parsed))
+
+    def test_hostmanager_sync(self):
+        hostsman = HostsManager([
+            '127.0.0.1\tlocalhost\n',
+            '127.0.1.1\ta.example.tld example.tld\n',
+        ])
+        counts = hostsman.sync({
+            'localhost': '127.0.0.1',
+            'example.tld': '127.0.1.2',
+        })
+        self.assertEquals({
+            'added': 0,
+            'updated': 1,
+            'deleted': 1,
+            'unchanged': 1,
+        }, counts)
+        self.assertEquals({
+            'localhost': '127.0.0.1',
+            'example.tld': '127.0.1.2',
+        }, dict(hostsman))
+
+    def test_hostmanager_managed(self):
+        hostsman = HostsManager([
+            '127.0.0.1\tlocalhost\n',
+            '# BEGIN managed by mete0r.hostsman\n',
+            '127.0.1.1\ta.example.tld\n',
+            '# END managed by mete0r.hostsman\n',
+        ], managed=True)
+        self.assertEquals({
+            'a.example.tld': '127.0.1.1',
+        }, dict(hostsman))
+        self.assertRaises(KeyError, hostsman.__getitem__, 'localhost')
+        hostsman.delete(['localhost', 'a.example.tld'])
+        hostsman['b.example.tld'] = '127.0.1.2'
+        self.assertEquals(
+            '127.0.0.1\tlocalhost\n'
+            '# BEGIN managed by mete0r.hostsman\n'
+            '127.0.1.2\tb.example.tld\n'
+            '# END managed by mete0r.hostsman\n',
+            ''.join(hostsman.render()))
+
+    def test_hostmanager_get_by_suffix_glob_regex(self):
+        hostsman = HostsManager([
+            '127.0.0.1\tlocalhost\n',
+            '127.0.1.1\ta.example.tld example.tld\n',
+            '127.0.1.2\tb.example.tld\n',
+        ])
+        self.assertEquals({
+            'a.example.tld': '127.0.1.1',
+            'example.tld': '127.0.1.1',
+            'b.example.tld': '127.0.1.2',
+        }, dict(hostsman.get_by_suffix('example.tld')))
+        self.assertEquals({
+            'a.example.tld': '127.0.1.1',
+            'b.example.tld': '127.0.1.2',
+        }, dict(hostsman.get_by_glob('*.example.tld')))
+        self.assertEquals({
+            'a.example.tld': '127.0.1.1',
+        }, dict(hostsman.get_by_glob('a*')))
+        self.assertEquals({
+            'localhost': '127.0.0.1',
+        }, dict(hostsman.get_by_regex('host$')))
+        hostsman['c.example.tld'] = '127.0.1.3'
+        self.assertEquals({
+            'a.example.tld': '127.0.1.1',
+            'b.example.tld': '127.0.1.2',
+            'c.example.tld': '127.0.1.3',
+        }, dict(hostsman.get_by_glob('*.example.tld')))
+
+    def test_hostmanager_delete_by_addr(self):
+        hostsman = HostsManager([
+            '127.0.0.1\tlocalhost\n',
+            '# BEGIN managed by mete0r.hostsman\n',
+            '10.4.0.1\ta.example.tld\n',
+            '10.5.0.1\tb.example.tld\n',
+            '# END managed by mete0r.hostsman\n',
+        ], managed=True)
+        self.assertEquals(1, hostsman.delete_by_addr(
+            '127.0.0.1', networks='10.4.0.0/16'))
+        self.assertEquals(
+            '127.0.0.1\tlocalhost\n'
+            '# BEGIN managed by mete0r.hostsman\n'
+            '10.5.0.1\tb.example.tld\n'
+            '# END managed by mete0r.hostsman\n',
+            ''.join(hostsman.render()))
+
+    def test_hostmanager_snapshot(self):
+        lines = ['127.0.1.%d\texample%d.tld\n' % (i % 256, i)
+                 for i in range(3000)]
+        hostsman = HostsManager(lines)
+        snapshot = hostsman.snapshot()
+        del hostsman['example2999.tld']
+        hostsman['example.tld'] = '127.0.0.1'
+        self.assertEquals('127.0.1.183', snapshot['example2999.tld'])
+        self.assertRaises(KeyError, snapshot.__getitem__, 'example.tld')
+        self.assertEquals(''.join(lines), ''.join(snapshot.render()))
+        self.assertRaises(KeyError, hostsman.__getitem__, 'example2999.tld')
+        self.assertEquals('127.0.0.1', hostsman['example.tld'])
+        # unchanged chunks are shared
+        new_snapshot = hostsman.snapshot()
+        self.assertTrue(new_snapshot.chunks[0] is snapshot.chunks[0])
+        self.assertTrue(new_snapshot.chunks[1] is snapshot.chunks[1])
+
+    def test_hostmanager_stats(self):
+        hostsman = HostsManager([
+            '127.0.0.1\tlocalhost\n',
+            '# managed by mete0r.hostsman\n',
+            '127.0.1.1 a.example.tld example.tld\n',
+            'garbage\n',
+        ])
+        hostsman.delete(['example.tld'])
+        self.assertEquals('127.0.0.1\tlocalhost\n'
+                          '# managed by mete0r.hostsman\n'
+                          '127.0.1.1\ta.example.tld\n'
+                          'garbage\n',
+                          ''.join(hostsman.render()))
+        self.assertEquals({
+            'lines_parsed': 4,
+            'lines_unrecognized': 1,
+            'lines_rewritten': 1,
+        }, hostsman.stats.counters)
+        self.assertEquals(set(['parse', 'delete_hosts']),
+                          set(hostsman.stats.timings))
+
+    def test_op_plan(self):
+        put = {'example.tld': '127.0.1.1',
+               'other.tld': '10.0.0.2',
+               'new.tld': '10.0.0.3'}
+        delete = ['OLD.tld', 'localhost']
+        plan = OpPlan(put=put, delete=delete)
+        parsed = tuple(parse(['127.0.0.1\tlocalhost\n',
+                              '127.0.1.1\told.tld Example.tld\n',
+                              '# comment\n',
+                              '10.0.0.1\tother.tld\n']))
+        expected = ('127.0.1.1\tExample.tld\n'
+                    '# comment\n'
+                    '10.0.0.2\tother.tld\n'
+                    '10.0.0.3\tnew.tld\n')
+        self.assertEquals(expected, ''.join(render(plan.apply(parsed))))
+        self.assertEquals(expected, ''.join(render(plan.apply(parsed))))
+        self.assertEquals(expected, ''.join(render(
+            put_hosts(delete_hosts(parsed, delete), put))))
+
+        parsed = tuple(parse(['10.0.0.3\tnew.tld\n']))
+        self.assertEquals(parsed, tuple(plan.apply(parsed))[:1])
+
+        hostsman = HostsManager(['127.0.1.1\told.tld\n'], managed=True)
+        hostsman.apply_plan(plan)
+        self.assertEquals('127.0.1.1\told.tld\n',
+                          next(iter(hostsman.render())))
+        self.assertEquals(set([
+            ('example.tld', '127.0.1.1'),
+            ('other.tld', '10.0.0.2'),
+            ('new.tld', '10.0.0.3'),
+        ]), set(hostsman.list()))
+
+    def test_check_hosts(self):
+        lines = ['127.0.0.1\tlocalhost\n',
+                 '\n',
+                 '10.0.0.1\ta.tld b.tld\n',
+                 'bogus\n',
+                 '10.0.0.2\tA.tld\n',
+                 '10.0.0.1 b.tld a.tld\n',
+                 '# %s\n' % ('x' * 30)]
+        problems = list(check_hosts(parse(lines), max_line_length=30))
+        self.assertEquals([
+            (4, 'unrecognized', 'bogus'),
+            (5, 'multiple-addresses', 'A.tld is 10.0.0.2, also 10.0.0.1 '
+                                      'on line 3'),
+            (6, 'duplicate-line', 'same as line 3'),
+            (7, 'too-long', '32 characters'),
+        ], [(problem['line_no'], problem['problem'], problem['detail'])
+            for problem in problems])
+        self.assertEquals(('A.tld', '10.0.0.2', '10.0.0.1', 3),
+                          (problems[1]['name'], problems[1]['addr'],
+                           problems[1]['first_addr'],
+                           problems[1]['first_line_no']))
+        self.assertEquals([], list(check_hosts(parse(lines[:3]))))
+
+    def test_bytes_and_text_lines(self):
+        for lines in ([b'127.0.0.1\tlocalhost\n', b'# comment\n',
+                       b'10.0.0.1 old.tld'],
+                      [u'127.0.0.1\tlocalhost\n', u'# comment\n',
+                       u'10.0.0.1 old.tld']):
+            string = type(lines[0])
+            hostsman = HostsManager(lines, managed=True)
+            hostsman.put({string(b'example.tld'): string(b'127.0.1.1')})
+            hostsman.managed = False
+            hostsman.delete([string(b'OLD.tld')])
+            rendered = list(hostsman.render())
+            self.assertEquals([string], list(set(map(type, rendered))))
+            self.assertEquals(string(b'127.0.0.1\tlocalhost\n'
+                                     b'# comment\n'
+                                     b'# BEGIN managed by mete0r.hostsman\n'
+                                     b'127.0.1.1\texample.tld\n'
+                                     b'# END managed by mete0r.hostsman\n'),
+                              string().join(rendered))
+            self.assertEquals([(u'example.tld', u'127.0.1.1')],
+                              list(decode_hosts(hostsman.get_by_suffix(
+                                  string(b'tld')))))
+
+    def test_edit_binary(self):
+        import os
+        import tempfile
+        from mete0r_hostsman import edit
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, b'127.0.0.1\tlocalhost\n')
+            os.close(fd)
+            with edit(path, binary=True) as hostsman:
+                hostsman[b'example.tld'] = b'127.0.1.1'
+            with open(path, 'rb') as f:
+                self.assertEquals(b'127.0.0.1\tlocalhost\n'
+                                  b'127.0.1.1\texample.tld\n', f.read())
+        finally:
+            os.unlink(path)
+
+    def test_load_compressed(self):
+        import bz2
+        import gzip
+        import os.path
+        import shutil
+        import tempfile
+        from mete0r_hostsman import compression
+        from mete0r_hostsman import edit
+        from mete0r_hostsman import load
+        content = b'127.0.0.1\tlocalhost\n127.0.1.1\texample.tld\n'
+        workdir = tempfile.mkdtemp()
+        try:
+            plain = os.path.join(workdir, 'hosts')
+            with open(plain, 'wb') as f:
+                f.write(content)
+            gz = os.path.join(workdir, 'hosts.gz')
+            f = gzip.GzipFile(gz, 'wb')
+            f.write(content)
+            f.close()
+            bz = os.path.join(workdir, 'hosts.bz2')
+            with open(bz, 'wb') as f:
+                f.write(bz2.compress(content))
+            for path, kind in ((plain, None), (gz, 'gzip'), (bz, 'bz2')):
+                self.assertEquals(kind, compression(path))
+                self.assertEquals([('localhost', '127.0.0.1'),
+                                   ('example.tld', '127.0.1.1')],
+                                  list(load(path).list()))
+            with self.assertRaises(ValueError):
+                with edit(gz):
+                    pass
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_bloom_filter(self):
+        from mete0r_hostsman import BloomFilter
+        bloom = BloomFilter(1000, 0.01)
+        bloom.update('host%d.tld' % i for i in range(1000))
+        self.assertTrue(all('HOST%d.tld' % i in bloom for i in range(1000)))
+        false_positives = len([i for i in range(10000)
+                               if 'absent%d.tld' % i in bloom])
+        self.assertTrue(false_positives < 200, false_positives)
+        self.assertEquals((bloom.bits + 7) // 8, bloom.memory)
+
+        hostsman = HostsManager(['127.0.0.1\tlocalhost\n'], bloom=0.01)
+        self.assertEquals([], list(hostsman.get('absent.tld')))
+        self.assertRaises(KeyError, hostsman.__getitem__, 'absent.tld')
+        hostsman['example.tld'] = '127.0.1.1'
+        self.assertEquals('127.0.1.1', hostsman['example.tld'])
+        self.assertEquals('127.0.0.1', hostsman['localhost'])
+        self.assertTrue(hostsman.stats.counters['bloom_bytes'] > 0)
+
+        # lines published from outside keep their text
+        hostsman.parsed = tuple(parse(['10.0.0.1\tother.tld\n']))
+        self.assertEquals([('other.tld', '10.0.0.1')],
+                          list(hostsman.get('other.tld')))
+        self.assertEquals('10.0.0.1', hostsman['other.tld'])
+        hostsman.publish(parse(['10.0.0.2\tpublished.tld\n']))
+        self.assertEquals('10.0.0.2', hostsman['published.tld'])
+
+    def test_bloom_sidecar(self):
+        import os
+        import tempfile
+        from mete0r_hostsman import build_bloom
+        from mete0r_hostsman import load_bloom
+        from mete0r_hostsman import save_bloom
+        from mete0r_hostsman import stat_signature
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, b'127.0.0.1\tlocalhost\n')
+            os.close(fd)
+            self.assertEquals(None, load_bloom(path))
+            with open(path) as f:
+                bloom = build_bloom(parse(f))
+            save_bloom(bloom, path, stat_signature(path))
+            loaded = load_bloom(path)
+            self.assertEquals(bloom.data, loaded.data)
+            self.assertTrue('localhost' in loaded)
+            with open(path, 'a') as f:
+                f.write('127.0.1.1\texample.tld\n')
+            self.assertEquals(None, load_bloom(path))
+        finally:
+            os.unlink(path)
+            if os.path.exists(path + '.bloom'):
+                os.unlink(path + '.bloom')
+
+    def test_edit_stats(self):
+        import os
+        import tempfile
+        from mete0r_hostsman import Stats
+        from mete0r_hostsman import edit
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, '127.0.0.1\tlocalhost\n')
+            os.close(fd)
+            stats = Stats()
+            with edit(path, stats=stats) as hostsman:
+                hostsman['example.tld'] = '127.0.1.1'
+            with open(path) as f:
+                self.assertEquals(f.read(), ''.join(hostsman.render()))
+        finally:
+            os.unlink(path)
+        self.assertEquals(set(['read', 'parse', 'append_check', 'append',
+                               'render', 'write']),
+                          set(stats.timings))
+        self.assertEquals(len('127.0.1.1\texample.tld\n'),
+                          stats.counters['bytes_written'])
+
+    def test_edit_appends_or_rewrites(self):
+        import os
+        import tempfile
+        from mete0r_hostsman import Stats
+        from mete0r_hostsman import edit
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, b'127.0.0.1\tlocalhost')
+            os.close(fd)
+
+            def put(hosts, merge=True):
+                stats = Stats()
+                with edit(path, stats=stats) as hostsman:
+                    hostsman.put(hosts, merge)
+                with open(path) as f:
+                    return f.read(), stats
+
+            # a new name of a new address: appended
+            content, stats = put({'a.tld': '127.0.1.1'})
+            self.assertEquals('127.0.0.1\tlocalhost\n'
+                              '127.0.1.1\ta.tld\n', content)
+            self.assertEquals(len('\n127.0.1.1\ta.tld\n'),
+                              stats.counters['bytes_written'])
+            # nothing changed: not written
+            content, stats = put({'a.tld': '127.0.1.1'})
+            self.assertEquals('127.0.0.1\tlocalhost\n'
+                              '127.0.1.1\ta.tld\n', content)
+            self.assertTrue('bytes_written' not in stats.counters)
+            # a new name of an existing address: rewritten
+            content, stats = put({'b.tld': '127.0.1.1'})
+            self.assertEquals('127.0.0.1\tlocalhost\n'
+                              '127.0.1.1\ta.tld b.tld\n', content)
+            self.assertTrue('put_hosts' in stats.timings)
+            # unless not merged
+            content, stats = put({'c.tld': '127.0.1.1'}, merge=False)
+            self.assertEquals('127.0.0.1\tlocalhost\n'
+                              '127.0.1.1\ta.tld b.tld\n'
+                              '127.0.1.1\tc.tld\n', content)
+            self.assertEquals(1, stats.counters['lines_appended'])
+            # an existing name, not merged: moved to a new line
+            content, stats = put({'a.tld': '127.0.1.1'}, merge=False)
+            self.assertEquals('127.0.0.1\tlocalhost\n'
+                              '127.0.1.1\tb.tld\n'
+                              '127.0.1.1\tc.tld\n'
+                              '127.0.1.1\ta.tld\n', content)
+        finally:
+            os.unlink(path)
+
+    def test_edit_backups(self):
+        import os
+        import os.path
+        import shutil
+        import tempfile
+        from mete0r_hostsman import edit
+        from mete0r_hostsman import rollback
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, 'hosts')
+            with open(path, 'w') as f:
+                f.write('127.0.0.1\tlocalhost\n')
+            os.chmod(path, 0o640)
+
+            def read(path):
+                with open(path) as f:
+                    return f.read()
+
+            versions = [read(path)]
+            for hostname in ('a.tld', 'b.tld', 'c.tld'):
+                inode = os.stat(path).st_ino
+                with edit(path, backups=2) as hostsman:
+                    hostsman.put({hostname: '10.0.0.1'})
+                versions.insert(0, read(path))
+                # the previous file is linked, not copied
+                self.assertEquals(inode, os.stat(path + '.1').st_ino)
+                self.assertEquals(0o640, os.stat(path).st_mode & 0o777)
+            self.assertEquals(versions[1], read(path + '.1'))
+            self.assertEquals(versions[2], read(path + '.2'))
+            self.assertFalse(os.path.exists(path + '.3'))
+            self.assertFalse(os.path.exists(path + '.tmp'))
+
+            # nothing changed: no new version
+            with edit(path, backups=2) as hostsman:
+                hostsman.put({'c.tld': '10.0.0.1'})
+            self.assertEquals(versions[1], read(path + '.1'))
+
+            rollback(path)
+            self.assertEquals(versions[1], read(path))
+            self.assertEquals(versions[2], read(path + '.1'))
+            self.assertFalse(os.path.exists(path + '.2'))
+            self.assertRaises(ValueError, rollback, path, 2)
+            rollback(path, 1)
+            self.assertEquals(versions[2], read(path))
+            self.assertFalse(os.path.exists(path + '.1'))
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_replacing(self):
+        import os
+        import os.path
+        import shutil
+        import tempfile
+        from mete0r_hostsman import replacing
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, 'hosts')
+            with replacing(path) as f:
+                f.write('127.0.0.1\tlocalhost\n')
+            os.chmod(path, 0o640)
+            try:
+                # only where the user may give files away
+                os.chown(path, 1, 1)
+            except (AttributeError, OSError):
+                pass
+            st = os.stat(path)
+
+            def fail():
+                with replacing(path) as f:
+                    f.write('10.0.0.1\ta.tld\n')
+                    raise IOError('disk full')
+            self.assertRaises(IOError, fail)
+            self.assertFalse(os.path.exists(path + '.tmp'))
+            with open(path) as f:
+                self.assertEquals('127.0.0.1\tlocalhost\n', f.read())
+
+            with replacing(path) as f:
+                f.write('10.0.0.1\ta.tld\n')
+            with open(path) as f:
+                self.assertEquals('10.0.0.1\ta.tld\n', f.read())
+            self.assertEquals(0o640, os.stat(path).st_mode & 0o777)
+            self.assertEquals((st.st_uid, st.st_gid),
+                              (os.stat(path).st_uid, os.stat(path).st_gid))
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_edit_many(self):
+        import os.path
+        import shutil
+        import tempfile
+        from mete0r_hostsman import edit_many
+        workdir = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(workdir, 'hosts%d' % i) for i in range(3)]
+            for path in paths:
+                with open(path, 'w') as f:
+                    f.write('127.0.0.1\tlocalhost\n'
+                            '127.0.1.1\told.tld\n')
+            missing = os.path.join(workdir, 'missing')
+            results = edit_many(paths + [missing], [
+                ('put', {'example.tld': '127.0.1.1'}),
+                ('delete', ['old.tld']),
+                ('sync', {'localhost': '127.0.0.1',
+                          'example.tld': '127.0.1.1'}),
+            ], workers=2)
+            self.assertEquals(paths + [missing],
+                              [result['path'] for result in results])
+            for path, result in zip(paths, results):
+                self.assertEquals(None, result['error'])
+                self.assertEquals([None, None, {
+                    'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 2,
+                }], result['results'])
+                with open(path) as f:
+                    self.assertEquals('127.0.0.1\tlocalhost\n'
+                                      '127.0.1.1\texample.tld\n',
+                                      f.read())
+            self.assertEquals(None, results[-1]['results'])
+            self.assertTrue(isinstance(results[-1]['error'], IOError))
+        finally:
+            shutil.rmtree(workdir)
+
+
+class CliTest(TestCase):
+
+    def print_hosts(self, *args, **kwargs):
+        from StringIO import StringIO
+        import sys
+        from mete0r_hostsman.cli import print_hosts
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            print_hosts(*args, **kwargs)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_print_hosts(self):
+        hosts = [
+            ('localhost', '127.0.0.1'),
+            ('example.tld', '127.0.1.1'),
+        ]
+        self.assertEquals(
+            'localhost\t127.0.0.1\n'
+            'example.tld\t127.0.1.1\n',
+            self.print_hosts(iter(hosts)))
+        self.assertEquals(
+            'example.tld\t127.0.1.1\n'
+            'localhost\t127.0.0.1\n',
+            self.print_hosts(iter(hosts), sort=True))
+        self.assertEquals(
+            'example.tld\t127.0.1.1\n'
+            'localhost\t127.0.0.1\n',
+            self.print_hosts(iter(hosts), sort=True, sort_memory=1))
+        self.assertEquals([
+            {'name': 'localhost', 'addr': '127.0.0.1'},
+            {'name': 'example.tld', 'addr': '127.0.1.1'},
+        ], [json.loads(line) for line in
+            self.print_hosts(iter(hosts), 'ndjson').splitlines()])
+        self.assertEquals([
+            {'name': 'localhost', 'addr': '127.0.0.1'},
+            {'name': 'example.tld', 'addr': '127.0.1.1'},
+        ], json.loads(self.print_hosts(iter(hosts), 'json')))
+        self.assertEquals([], json.loads(self.print_hosts(iter([]), 'json')))
+
+    def test_check_exit_status(self):
+        from StringIO import StringIO
+        import os
+        import sys
+        import tempfile
+        from mete0r_hostsman.cli import main
+        fd, path = tempfile.mkstemp()
+        argv, stdout = sys.argv, sys.stdout
+        try:
+            os.write(fd, '127.0.0.1\tlocalhost\n')
+            os.close(fd)
+            sys.argv = ['hostsman', '-f', path, 'check']
+            sys.stdout = StringIO()
+            main()
+            self.assertEquals('', sys.stdout.getvalue())
+
+            with open(path, 'a') as f:
+                f.write('bogus\n')
+            sys.argv = ['hostsman', '-f', path, '--format=ndjson', 'check']
+            sys.stdout = StringIO()
+            with self.assertRaises(SystemExit) as raised:
+                main()
+            self.assertEquals(1, raised.exception.code)
+            self.assertEquals([{'line_no': 2, 'problem': 'unrecognized',
+                                'detail': 'bogus'}],
+                              [json.loads(line) for line
+                               in sys.stdout.getvalue().splitlines()])
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+            os.unlink(path)
+
+    def test_get_streamed(self):
+        from StringIO import StringIO
+        import os
+        import sys
+        import tempfile
+        from mete0r_hostsman.cli import is_streamed
+        from mete0r_hostsman.cli import main
+        fd, path = tempfile.mkstemp()
+        argv, stdout = sys.argv, sys.stdout
+        try:
+            os.write(fd, '127.0.0.1\tlocalhost\n'
+                         '# BEGIN managed by mete0r.hostsman\n'
+                         '127.0.1.1\tA.example.tld b.example.tld\n'
+                         '# END managed by mete0r.hostsman\n')
+            os.close(fd)
+            for args, output in [
+                (['get', 'a.example.tld', 'LOCALHOST'],
+                 'localhost\t127.0.0.1\nA.example.tld\t127.0.1.1\n'),
+                (['--managed', 'get', 'localhost', 'b.example.tld'],
+                 'b.example.tld\t127.0.1.1\n'),
+                (['get', '--glob=?.example.*'],
+                 'A.example.tld\t127.0.1.1\nb.example.tld\t127.0.1.1\n'),
+                (['get', '--regex=^l'], 'localhost\t127.0.0.1\n'),
+            ]:
+                sys.argv = ['hostsman', '-f', path] + args
+                sys.stdout = StringIO()
+                main()
+                self.assertEquals(output, sys.stdout.getvalue())
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+            os.unlink(path)
+
+        args = dict.fromkeys(['list', 'get', '--suffix', '--glob', '--regex',
+                              '--bloom', '<name>'])
+        self.assertTrue(is_streamed(dict(args, list=True)))
+        self.assertTrue(is_streamed(dict(args, get=True, **{'<name>': ['a']})))
+        self.assertTrue(is_streamed(dict(args, get=True, **{'--glob': 'a*'})))
+        self.assertFalse(is_streamed(dict(args, get=True,
+                                          **{'--glob': '*.tld'})))
+        self.assertFalse(is_streamed(dict(args, get=True,
+                                          **{'--suffix': 'tld'})))
+        self.assertFalse(is_streamed(dict(args, get=True,
+                                          **{'--bloom': '0.01',
+                                             '<name>': ['a']})))
+
+    def test_put_no_merge_sharded(self):
+        import shutil
+        import sys
+        import tempfile
+        from mete0r_hostsman.cli import main
+        from mete0r_hostsman.shard import ShardedHostsManager
+        directory = tempfile.mkdtemp()
+        argv = sys.argv
+        try:
+            sys.argv = ['hostsman', '-f', directory, '--shards=1', 'put',
+                        'a.tld=10.0.0.3']
+            main()
+            sys.argv = ['hostsman', '-f', directory, 'put', '--no-merge',
+                        'b.tld=10.0.0.3']
+            main()
+            hostsman = ShardedHostsManager(directory)
+            self.assertEquals(['10.0.0.3\ta.tld\n', '10.0.0.3\tb.tld\n'],
+                              list(hostsman.shard(0).render()))
+        finally:
+            sys.argv = argv
+            shutil.rmtree(directory)
+
+    def test_delete_invalid_addrs(self):
+        import os
+        import sys
+        import tempfile
+        from mete0r_hostsman.cli import main
+        fd, path = tempfile.mkstemp()
+        argv = sys.argv
+        try:
+            os.write(fd, '10.0.0.1\ta.tld\n')
+            os.close(fd)
+            for arg in ('--addr=bogus', '--cidr=10.0.0.0/33',
+                        '--cidr=10.0.0.0/x'):
+                sys.argv = ['hostsman', '-f', path, 'delete', arg]
+                with self.assertRaises(SystemExit) as raised:
+                    main()
+                self.assertEquals(1, raised.exception.code)
+            with open(path) as f:
+                self.assertEquals('10.0.0.1\ta.tld\n', f.read())
+        finally:
+            sys.argv = argv
+            os.unlink(path)
+
+    def test_get_invalid_regex(self):
+        import os
+        import sys
+        import tempfile
+        from mete0r_hostsman.cli import main
+        fd, path = tempfile.mkstemp()
+        argv = sys.argv
+        try:
+            os.write(fd, '10.0.0.1\ta.tld\n')
+            os.close(fd)
+            sys.argv = ['hostsman', '-f', path, 'get', '--regex=a(']
+            with self.assertRaises(SystemExit) as raised:
+                main()
+            self.assertEquals(1, raised.exception.code)
+        finally:
+            sys.argv = argv
+            os.unlink(path)
+
+    def test_put_from_invalid_entries(self):
+        import os
+        import sys
+        import tempfile
+        from mete0r_hostsman.cli import main
+        fd, path = tempfile.mkstemp()
+        entries_fd, entries = tempfile.mkstemp()
+        argv = sys.argv
+        try:
+            os.write(fd, '10.0.0.1\ta.tld\n')
+            os.close(fd)
+            os.close(entries_fd)
+            for text in ('b.tld\t10.0.0.2\nc.tld\n',
+                         '{"name": "b.tld", "addr": \n',
+                         '{"name": "b.tld"}\n'):
+                with open(entries, 'w') as f:
+                    f.write(text)
+                sys.argv = ['hostsman', '-f', path, 'put', '--from', entries]
+                with self.assertRaises(SystemExit) as raised:
+                    main()
+                self.assertEquals(1, raised.exception.code)
+            with open(path) as f:
+                self.assertEquals('10.0.0.1\ta.tld\n', f.read())
+        finally:
+            sys.argv = argv
+            os.unlink(path)
+            os.unlink(entries)
+
+    def test_put_ops(self):
+        from mete0r_hostsman.cli import put_ops
+        entries = [('h%d.tld' % i, '10.0.0.%d' % i) for i in range(5)]
+        ops = list(put_ops(iter(entries), batch=2))
+        self.assertEquals([entries[:2], entries[2:4], entries[4:]],
+                          [sorted(op[1].put.items()) for op in ops])
+        self.assertEquals([('put', dict(entries[:2]), False)],
+                          list(put_ops(entries[:2], merge=False)))
+        self.assertEquals([], list(put_ops([])))
+
+    def test_read_name_addr(self):
+        from mete0r_hostsman.cli import read_name_addr
+        self.assertEquals([
+            ('localhost', '127.0.0.1'),
+            ('example.tld', '127.0.1.1'),
+        ], list(read_name_addr([
+            'localhost\t127.0.0.1\n',
+            '\n',
+            '{"name": "example.tld", "addr": "127.0.1.1"}\n',
+        ])))
+
+    def test_hosts_paths(self):
+        import os.path
+        import shutil
+        import tempfile
+        from mete0r_hostsman.cli import hosts_paths
+        self.assertEquals(['/etc/hosts'], hosts_paths([]))
+        workdir = tempfile.mkdtemp()
+        try:
+            a = os.path.join(workdir, 'a.hosts')
+            b = os.path.join(workdir, 'b.hosts')
+            listing = os.path.join(workdir, 'list')
+            for path in (a, b):
+                open(path, 'w').close()
+            with open(listing, 'w') as f:
+                f.write('%s\n\nc.hosts\n' % a)
+            self.assertEquals(
+                [a, b, 'z*.hosts', 'c.hosts'],
+                hosts_paths([os.path.join(workdir, '*.hosts'), a,
+                             'z*.hosts'], listing))
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_parse_args_fast(self):
+        from mete0r_hostsman.cli import parse_args_fast
+        args = parse_args_fast(['-f', 'hosts', 'get', 'a', 'b'])
+        self.assertEquals(['hosts'], args['--file'])
+        self.assertEquals(['a', 'b'], args['<name>'])
+        self.assertTrue(args['get'])
+        self.assertEquals(None, args['put'])
+        args = parse_args_fast(['--format=json', '-m', '--sort', 'list'])
+        self.assertEquals('json', args['--format'])
+        self.assertTrue(args['--managed'])
+        self.assertTrue(args['--sort'])
+        self.assertTrue(args['list'])
+        args = parse_args_fast(['--sort', '--sort-memory=8', 'list'])
+        self.assertEquals('8', args['--sort-memory'])
+        self.assertEquals(None, parse_args_fast(['put', 'a=127.0.0.1']))
+        self.assertEquals(None, parse_args_fast(['get', '-f', 'hosts']))
+        self.assertEquals(None, parse_args_fast(['list', 'extra']))
+        self.assertEquals(None, parse_args_fast(['--help']))
+
+    def test_startup_imports(self):
+        import os.path
+        import subprocess
+        import sys
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.check_output([sys.executable, '-c', '''if 1:
+            import sys
+            import mete0r_hostsman.cli
+            heavy = ('docopt', 'json', 'logging')
+            print(' '.join(m for m in heavy if m in sys.modules))
+        '''], cwd=os.path.dirname(package_dir))
+        self.assertEquals('', output.strip())
+
+
+class BenchTest(TestCase):
+
+    def test_generate_lines(self):
+        from mete0r_hostsman.bench import generate_lines
+        lines = list(generate_lines(100, seed=1))
+        self.assertEquals(100, len(lines))
+        self.assertEquals(lines, list(generate_lines(100, seed=1)))
+        parsed = list(parse(lines))
+        self.assertEquals([], [line for line in parsed
+                               if line['type'] == 'UNRECOGNIZED'])
+        self.assertTrue([line for line in parsed
+                         if line['type'] == 'COMMENT'])
+
+    def test_bench_operations(self):
+        from mete0r_hostsman.bench import bench_operations
+        from mete0r_hostsman.bench import scaling
+        results = bench_operations([10, 20], repeat=1)
+        self.assertEquals(set(['parse', 'render', 'get', 'put', 'delete',
+                               'plan', 'roundtrip_bytes',
+                               'roundtrip_text']),
+                          set(result['operation'] for result in results))
+        self.assertEquals(set(['parse', 'render', 'get', 'put', 'delete',
+                               'plan', 'roundtrip_bytes',
+                               'roundtrip_text']),
+                          set(scaling(results)))
+        # measured with tracemalloc, or in a forked child on Python 2
+        for result in results:
+            self.assertTrue(result['peak_bytes'] >= 0)
+
+
+class FuzzTest(TestCase):
+
+    def test_generate_case(self):
+        from mete0r_hostsman.fuzz import generate_case
+        lines, ops = generate_case(1, max_lines=50, max_ops=10)
+        self.assertEquals((lines, ops),
+                          generate_case(1, max_lines=50, max_ops=10))
+        self.assertTrue(len(lines) <= 50)
+        self.assertTrue(1 <= len(ops) <= 10)
+        self.assertEquals(len(lines), len(list(parse(lines))))
+
+    def test_fuzz(self):
+        from mete0r_hostsman.fuzz import ENGINES
+        from mete0r_hostsman.fuzz import fuzz
+        engines = [engine[0] for engine in ENGINES
+                   if engine[0] != 'edit_many']
+        self.assertEquals([], fuzz(cases=50, engines=engines))
+        self.assertEquals([], fuzz(cases=2, engines=['edit_many']))
+
+    def test_reproducers(self):
+        from mete0r_hostsman.fuzz import failing_engines
+        # address lines without names are dropped by any put
+        self.assertEquals([], failing_engines(['\t\n'], [('put', {})]))
+        self.assertEquals([], failing_engines(['10.0.0.1\t\n'],
+                                              [('put', {'a.tld': '::1'})]))
+        # unless a name is put to their address
+        self.assertEquals([], failing_engines(
+            ['10.0.0.1\t\n', '10.0.0.1\ta.tld\n'],
+            [('put', {'b.tld': '10.0.0.1'})]
+        ))
+        # listed sorted, from a file and from shards
+        self.assertEquals([], failing_engines(
+            ['10.0.0.2\tb.tld a.tld\n', '10.0.0.1\td localhost\n'],
+            [('list', ), ('put', {'c.example.tld': '::1'}), ('list', )],
+            ['stream', 'sharded']
+        ))
+        # networks as bytes
+        self.assertEquals([], failing_engines(
+            ['127.0.0.1\tlocalhost\n'],
+            [('delete_addr', [], ['127.0.0.0/8'])],
+            ['recoded']
+        ))
+
+    def test_shrink(self):
+        from mete0r_hostsman.fuzz import generate_case
+        from mete0r_hostsman.fuzz import shrink
+
+        def fails(lines, ops):
+            return ([line for line in lines if line.startswith('#')] and
+                    [op for op in ops if op[0] == 'get' and op[1]])
+
+        for seed in range(100):
+            lines, ops = generate_case(seed)
+            if fails(lines, ops):
+                break
+        lines, ops = shrink(fails, lines, ops)
+        self.assertEquals(1, len(lines))
+        self.assertTrue(lines[0].startswith('#'))
+        self.assertEquals(1, len(ops))
+        self.assertEquals('get', ops[0][0])
+        self.assertEquals(1, len(ops[0][1]))
+
+
+class ExportTest(TestCase):
+
+    hosts = [
+        ('localhost', '127.0.0.1'),
+        ('LocalHost', '::1'),
+        ('bogus.tld', 'bogus'),
+        ('link.tld', 'fe80::1%eth0'),
+    ]
+
+    def test_dnsmasq_unbound(self):
+        from mete0r_hostsman.export import dnsmasq_lines
+        from mete0r_hostsman.export import unbound_lines
+        self.assertEquals(['host-record=localhost,127.0.0.1\n',
+                           'host-record=LocalHost,::1\n'],
+                          list(dnsmasq_lines(iter(self.hosts))))
+        self.assertEquals(['server:\n',
+                           '    local-data: "localhost. IN A 127.0.0.1"\n',
+                           '    local-data: "LocalHost. IN AAAA ::1"\n'],
+                          list(unbound_lines(iter(self.hosts))))
+
+    def test_export_cli(self):
+        from StringIO import StringIO
+        import os
+        import sys
+        import tempfile
+        from mete0r_hostsman.cli import main
+        fd, path = tempfile.mkstemp()
+        argv, stdout = sys.argv, sys.stdout
+        try:
+            os.write(fd, '127.0.0.1\tlocalhost\n')
+            os.close(fd)
+            # dnsmasq without --format
+            for args, output in [
+                ([], 'host-record=localhost,127.0.0.1\n'),
+                (['--format=unbound'],
+                 'server:\n    local-data: "localhost. IN A 127.0.0.1"\n'),
+            ]:
+                sys.argv = ['hostsman', '-f', path] + args + ['export']
+                sys.stdout = StringIO()
+                main()
+                self.assertEquals(output, sys.stdout.getvalue())
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+            os.unlink(path)
+
+    def test_cdb(self):
+        from io import BytesIO
+        from mete0r_hostsman.export import cdb_hash
+        from mete0r_hostsman.export import export_hosts
+        from mete0r_hostsman.export import lookup_cdb
+        self.assertEquals(5381, cdb_hash(b''))
+        self.assertEquals(177604, cdb_hash(b'a'))
+        hosts = self.hosts + [('host%d.tld' % i, '10.0.%d.%d' % divmod(i, 256))
+                              for i in range(1000)]
+        f = BytesIO()
+        export_hosts(iter(hosts), 'cdb', f)
+        self.assertEquals(['127.0.0.1', '::1'], lookup_cdb(f, 'LOCALHOST'))
+        self.assertEquals(['10.0.3.231'], lookup_cdb(f, 'host999.tld'))
+        self.assertEquals([], lookup_cdb(f, 'bogus.tld'))
+        self.assertEquals([], lookup_cdb(f, 'absent.tld'))
+
+
+class ShardTest(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def test_shard_of(self):
+        from mete0r_hostsman.shard import shard_of
+        self.assertEquals(shard_of('example.tld', 16),
+                          shard_of('Example.TLD', 16))
+        self.assertEquals(set(range(4)), set(shard_of('host%d.tld' % i, 4)
+                                             for i in range(100)))
+
+    def test_sharded(self):
+        import os
+        from mete0r_hostsman.shard import ShardedHostsManager
+        from mete0r_hostsman.shard import edit_sharded
+        from mete0r_hostsman.shard import shard_of
+        hosts = dict(('host%d.tld' % i, '10.0.0.%d' % i) for i in range(20))
+        with edit_sharded(self.directory, shards=4) as hostsman:
+            hostsman.put(hosts)
+        self.assertEquals(['hosts.0', 'hosts.1', 'hosts.2', 'hosts.3'],
+                          sorted(os.listdir(self.directory)))
+
+        hostsman = ShardedHostsManager(self.directory)
+        self.assertEquals(4, hostsman.shards)
+        self.assertEquals(sorted(hosts.items()), sorted(hostsman.list()))
+        self.assertEquals('10.0.0.3', hostsman['host3.tld'])
+        self.assertEquals([('host3.tld', '10.0.0.3')],
+                          list(hostsman.get(['HOST3.tld', 'absent.tld'])))
+
+        hostsman['host1.tld'] = '10.0.1.1'
+        hostsman.delete('host1.tld')
+        hostsman['host1.tld'] = '10.0.1.1'
+        self.assertEquals([shard_of('host1.tld', 4)], hostsman.changed())
+        self.assertEquals([hostsman.paths[shard_of('host1.tld', 4)]],
+                          hostsman.save())
+        self.assertEquals([], hostsman.changed())
+        hostsman['host1.tld'] = '10.0.1.1'
+        self.assertEquals([], hostsman.save())
+
+        self.assertEquals({'added': 1, 'updated': 0, 'deleted': 19,
+                           'unchanged': 1},
+                          hostsman.sync({'host1.tld': '10.0.1.1',
+                                         'new.tld': '10.0.2.1'}))
+        hostsman.save()
+        self.assertEquals([('host1.tld', '10.0.1.1'),
+                           ('new.tld', '10.0.2.1')],
+                          sorted(ShardedHostsManager(self.directory).list()))
+        self.assertRaises(ValueError, ShardedHostsManager, self.directory, 8)
+
+    def test_save_keeps_mode(self):
+        import os
+        from mete0r_hostsman.shard import edit_sharded
+        with edit_sharded(self.directory, shards=2) as hostsman:
+            hostsman.put({'a.tld': '10.0.0.1', 'b.tld': '10.0.0.2'})
+        for path in hostsman.paths:
+            os.chmod(path, 0o640)
+        with edit_sharded(self.directory) as hostsman:
+            hostsman.put({'a.tld': '10.0.1.1', 'b.tld': '10.0.1.2'})
+        for path in hostsman.paths:
+            self.assertEquals(0o640, os.stat(path).st_mode & 0o777)
+
+    def test_not_a_directory(self):
+        import os
+        from mete0r_hostsman.shard import edit_sharded
+        path = os.path.join(self.directory, 'hosts')
+        with open(path, 'w') as f:
+            f.write('127.0.0.1\tlocalhost\n')
+
+        def put():
+            with edit_sharded(path, shards=2) as hostsman:
+                hostsman.put({'a.tld': '10.0.0.1'})
+        self.assertRaises(ValueError, put)
+
+    def test_not_a_directory_cli(self):
+        import os
+        import sys
+        from mete0r_hostsman.cli import main
+        path = os.path.join(self.directory, 'hosts')
+        with open(path, 'w') as f:
+            f.write('127.0.0.1\tlocalhost\n')
+        argv = sys.argv
+        try:
+            sys.argv = ['hostsman', '-f', path, '--shards=2', 'put',
+                        'a.tld=10.0.0.1']
+            self.assertRaises(SystemExit, main)
+        finally:
+            sys.argv = argv
+        with open(path) as f:
+            self.assertEquals('127.0.0.1\tlocalhost\n', f.read())
+
+
+class StoreTest(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def test_store(self):
+        from mete0r_hostsman import OpPlan
+        from mete0r_hostsman.store import HostsStore
+        store = HostsStore(':memory:')
+        store.import_lines(['127.0.0.1 localhost\n',
+                            '# comment\n',
+                            '10.0.0.1 a.tld b.tld\n',
+                            '10.0.0.2 \n',
+                            '10.0.0.3 c.tld'])
+        self.assertEquals([('localhost', '127.0.0.1'),
+                           ('a.tld', '10.0.0.1'),
+                           ('b.tld', '10.0.0.1'),
+                           ('c.tld', '10.0.0.3')], list(store.list()))
+        self.assertEquals([('a.tld', '10.0.0.1'), ('c.tld', '10.0.0.3')],
+                          list(store.get(['C.tld', 'A.TLD', 'absent.tld'])))
+        self.assertEquals('10.0.0.1', store['b.tld'])
+        self.assertRaises(KeyError, store.__getitem__, 'B.tld')
+
+        # the line without names gets the name put to its address
+        store.put({'b.tld': '10.0.0.2', 'd.tld': '10.0.0.4'})
+        self.assertEquals(['127.0.0.1 localhost\n',
+                           '# comment\n',
+                           '10.0.0.1\ta.tld\n',
+                           '10.0.0.2\tb.tld\n',
+                           '10.0.0.3 c.tld', '\n',
+                           '10.0.0.4\td.tld\n'], list(store.render()))
+
+        store.apply_plan(OpPlan(put={'e.tld': '10.0.0.1'},
+                                delete=['a.tld', 'b.tld']))
+        self.assertEquals([('localhost', '127.0.0.1'),
+                           ('c.tld', '10.0.0.3'),
+                           ('d.tld', '10.0.0.4'),
+                           ('e.tld', '10.0.0.1')], list(store.list()))
+        self.assertEquals(2, store.delete_by_addr(networks=['10.0.0.0/30']))
+        self.assertEquals([('localhost', '127.0.0.1'), ('d.tld', '10.0.0.4')],
+                          list(store.list()))
+
+    def test_write(self):
+        import os
+        import os.path
+        from mete0r_hostsman.store import HostsStore
+        db = os.path.join(self.directory, 'hosts.db')
+        path = os.path.join(self.directory, 'hosts')
+        store = HostsStore(db)
+        store.import_lines(['127.0.0.1 localhost\n'])
+        self.assertTrue(store.write(path))
+        self.assertFalse(store.write(path))
+        store.delete(['absent.tld'])
+        self.assertFalse(store.write(path))
+        store.close()
+
+        os.chmod(path, 0o640)
+        try:
+            os.chown(path, 1, 1)
+        except (AttributeError, OSError):
+            pass
+        st = os.stat(path)
+
+        store = HostsStore(db)
+        store['example.tld'] = '10.0.0.1'
+        self.assertTrue(store.write(path))
+        store.close()
+        with open(path) as f:
+            self.assertEquals('127.0.0.1 localhost\n'
+                              '10.0.0.1\texample.tld\n', f.read())
+        # replaced with the mode and owner of the file rendered before
+        self.assertEquals(0o640, os.stat(path).st_mode & 0o777)
+        self.assertEquals((st.st_uid, st.st_gid),
+                          (os.stat(path).st_uid, os.stat(path).st_gid))
 
 
 def test_suite():
-    return makeSuite(HostsManTest)
+    return TestSuite([
+        makeSuite(HostsManTest),
+        makeSuite(CliTest),
+        makeSuite(BenchTest),
+        makeSuite(FuzzTest),
+        makeSuite(ExportTest),
+        makeSuite(ShardTest),
+        makeSuite(StoreTest),
+    ])
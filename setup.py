@@ -117,7 +117,9 @@ setup_info = {
     },
     'entry_points': {
         'console_scripts': [
-            'hostsman = mete0r_hostsman.cli:main'
+            'hostsman = mete0r_hostsman.cli:main',
+            'hostsman-bench = mete0r_hostsman.bench:main',
+            'hostsman-fuzz = mete0r_hostsman.fuzz:main',
         ]
     },
     'classifiers': [